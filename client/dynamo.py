@@ -8,21 +8,22 @@ import random
 import zmq
 import sys
 import socket
+import time
 import redis
 
-from datetime import datetime
 from config.redis_config import redis_config
+from fd_cache import OPEN_PER_OP, FdCache
 from locking import FLock
+from pipeline import KeyedExecutor, job_paths
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from logger import pubsub_logger
 from config import CTRL_MSG_PORT
 from response_actions import response_action, DynamoException
 from config import error_codes
+from utils import codec
 
-
-def timestamp():
-    return datetime.utcnow().strftime('%Y/%m/%d %H:%M:%S.%f')
+DEPTH_REPORT_INTERVAL = 60  # Seconds between queue depth reports of pipelined workers
 
 
 def build_message(result, action, data, time_stamp, error_code=None, error_message=None, path=None, line=None):
@@ -67,17 +68,29 @@ class Dynamo(object):
             else:
                 self.locking_db = None
             self.flock = FLock(self.locking_db, locking_type)
+            # Codec of the last frame received from the Controller, results are sent back with the same one
+            self._codec = codec.DEFAULT_CODEC
+            # Jobs run at the same time by this process, 1 runs them one by one as they arrive
+            self.queue_depth = kwargs.get('queue_depth', 1)
+            # Descriptors of files read and written are kept open across jobs, or opened for every job
+            fd_cache_size = kwargs.get('fd_cache', 0)
+            self.fd_cache = FdCache(fd_cache_size) if fd_cache_size else OPEN_PER_OP
+            # Alignment of O_DIRECT offsets and lengths, 0 uses the logical block size of each mount point
+            self.direct_alignment = kwargs.get('direct_alignment', 0)
             self.logger.info(f"Dynamo {self._socket.identity} init done")
         except Exception as e:
             self.logger.error(f"Connection error: {e}")
 
     def run(self):
         self.logger.info(f"Dynamo {self._socket.identity} started")
+        if self.queue_depth > 1:
+            self._run_pipelined()
+            return
         try:
             msg = None
             job_id = None
-            # Send a connect message
-            self._socket.send_json({'message': 'connect'})
+            # Send a connect message, announcing that we accept batched jobs and which codecs we speak
+            self._socket.send_json({'message': 'connect', 'batch': True, 'codecs': codec.available_codecs()})
             self.logger.debug(f"Client {self._socket.identity} sent back 'connect' message.")
             # Poll the socket for incoming messages. This will wait up to
             # 0.1 seconds before returning False. The other way to do this
@@ -85,35 +98,106 @@ class Dynamo(object):
             # catching zmq.AGAIN and sleeping for 0.1.
             while True:
                 try:
-                    # Note that we can still use send_json()/recv_json() here,
+                    # Note that we can still use plain send()/recv() here,
                     # the DEALER socket ensures we don't have to deal with
                     # client ids at all.
                     # self.logger.debug(f"Blocking waiting for response form socket {self._socket.identity}")
-                    job_id, work = self._socket.recv_json()
+                    frame = self._socket.recv()
+                    self._codec = codec.detect(frame)
+                    incoming = self._codec.decode(frame)
+                    if isinstance(incoming, dict) and incoming.get('message') == 'jobs':
+                        # Batched frame: run all the jobs and send their results back in one frame
+                        results = []
+                        for job_id, work in incoming['jobs']:
+                            msg = self._do_work(work)
+                            results.append((job_id, msg))
+                        self.logger.debug(f"Going to send {len(results)} results")
+                        self._socket.send(self._codec.encode(
+                            {'message': 'job_done_batch',
+                             'results': results}))
+                        self.logger.debug(f"{len(results)} results sent")
+                        continue
+                    job_id, work = incoming
                     # self.logger.debug(f"Job: {job_id} received from socket {self._socket.identity}")
                     msg = self._do_work(work)
                     self.logger.debug(f"Going to send {job_id}: {msg}")
-                    self._socket.send_json(
+                    self._socket.send(self._codec.encode(
                         {'message': 'job_done',
                          'result': msg,
-                         'job_id': job_id})
+                         'job_id': job_id}))
                     self.logger.debug(f"{job_id} sent")
                 except zmq.ZMQError as zmq_error:
                     self.logger.warn(f"Failed to send message due to: {zmq_error}. Message {job_id} lost!")
                 except TypeError:
-                    self.logger.error(f"JSON Serialisation error: msg: {msg}")
+                    self.logger.error(f"{self._codec.name} serialisation error: msg: {msg}")
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            self.logger.exception(e)
+        finally:
+            self._disconnect()
+
+    def _run_pipelined(self):
+        """Run up to queue_depth jobs at the same time on a thread pool, jobs on the same path in the order they
+        arrived. Results are sent back in batches as they complete, from this thread only, zmq sockets aren't
+        thread safe.
+        """
+        executor = KeyedExecutor(self.queue_depth)
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        poller.register(executor.fileno(), zmq.POLLIN)
+        try:
+            self._socket.send_json({'message': 'connect', 'batch': True, 'codecs': codec.available_codecs()})
+            self.logger.debug(f"Client {self._socket.identity} sent back 'connect' message.")
+            last_report = time.monotonic()
+            while True:
+                events = dict(poller.poll(DEPTH_REPORT_INTERVAL * 1000))
+                if self._socket in events:
+                    frame = self._socket.recv()
+                    self._codec = codec.detect(frame)
+                    incoming = self._codec.decode(frame)
+                    if isinstance(incoming, dict) and incoming.get('message') == 'jobs':
+                        jobs = incoming['jobs']
+                    else:
+                        jobs = [incoming]
+                    for job_id, work in jobs:
+                        executor.submit(job_paths(work['data']), job_id, self._do_work, work)
+                if executor.fileno() in events:
+                    results = executor.results()
+                    if results:
+                        try:
+                            self._socket.send(self._codec.encode({'message': 'job_done_batch', 'results': results}))
+                        except zmq.ZMQError as zmq_error:
+                            self.logger.warn(f"Failed to send message due to: {zmq_error}. "
+                                             f"{len(results)} results lost!")
+                        except TypeError:
+                            self.logger.error(f"{self._codec.name} serialisation error: results: {results}")
+                if time.monotonic() - last_report >= DEPTH_REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    self._report_depth(executor)
         except KeyboardInterrupt:
             pass
         except Exception as e:
             self.logger.exception(e)
         finally:
+            self._report_depth(executor)
             self._disconnect()
+            executor.shutdown()
+
+    def _report_depth(self, executor):
+        self.logger.info(f"Dynamo {self._socket.identity} queue depth: {executor.average_depth():.2f} average, "
+                         f"{executor.stats['max_depth']} max of {executor.depth}, {executor.stats['jobs']} jobs")
 
     def _disconnect(self):
         """
         Send the Controller a disconnect message and end the run loop
         """
         self._socket.send_json({'message': 'disconnect'})
+        if isinstance(self.fd_cache, FdCache):
+            self.logger.info(f"Dynamo {self._socket.identity} fd cache: {self.fd_cache.stats['hits']} hits, "
+                             f"{self.fd_cache.stats['misses']} misses, {self.fd_cache.stats['evictions']} evictions, "
+                             f"{self.fd_cache.stats['stale']} stale")
+            self.fd_cache.close()
 
     def _do_work(self, work):
         """
@@ -132,17 +216,19 @@ class Dynamo(object):
                 raise DynamoException(error_codes.NO_TARGET,
                                       "{0}".format("Target not specified", work['data']['target']))
             response = response_action(action, mount_point, work['data'],
-                                       dst_mount_point=mount_point, flock=self.flock)
+                                       dst_mount_point=mount_point, flock=self.flock, fd_cache=self.fd_cache,
+                                       direct_alignment=self.direct_alignment)
             if response:
                 data = response
         except OSError as os_error:
-            return build_message('failed', action, data, timestamp(), error_code=os_error.errno,
+            return build_message('failed', action, data, self._codec.timestamp(), error_code=os_error.errno,
                                  error_message=os_error.strerror,
                                  path='/'.join([mount_point, work['data']['target']]),
                                  line=sys.exc_info()[-1].tb_lineno)
         except Exception as unhandled_error:
             self.logger.exception(unhandled_error)
-            return build_message('failed', action, data, timestamp(), error_message=unhandled_error.args[0],
-                                 path=''.join([mount_point, work['data']['target']]),
+            return build_message('failed', action, data, self._codec.timestamp(),
+                                 error_message=unhandled_error.args[0],
+                                 path='/'.join([mount_point, work['data']['target']]),
                                  line=sys.exc_info()[-1].tb_lineno)
-        return build_message('success', action, data, timestamp(), path=work['data']['target'])
+        return build_message('success', action, data, self._codec.timestamp(), path=work['data']['target'])
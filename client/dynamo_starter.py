@@ -50,7 +50,20 @@ def get_args():
     parser.add_argument('--end_vip', type=str, help="End VIP address range")
     parser.add_argument('-l', '--locking', type=str, help='Locking Type', choices=['native', 'application', 'off'],
                         default="native")
+    parser.add_argument('-q', '--queue_depth', type=int, default=1,
+                        help='Jobs each worker process runs at the same time, 1 runs them one by one')
+    parser.add_argument('--fd_cache', type=int, default=0,
+                        help='Open files each worker process keeps across jobs, 0 opens them for every job')
+    parser.add_argument('--direct_alignment', type=int, default=0,
+                        help='Alignment of read_direct/write_direct offsets and lengths in bytes, 0 uses the logical '
+                             'block size of the mount point')
     args = parser.parse_args()
+    if args.direct_alignment < 0 or args.direct_alignment & (args.direct_alignment - 1):
+        parser.error("--direct_alignment must be 0 or a power of 2")
+    if args.fd_cache < 0:
+        parser.error("--fd_cache must be 0 or more")
+    if args.queue_depth < 1:
+        parser.error("--queue_depth must be at least 1")
     return args
 
 
@@ -76,7 +89,10 @@ def run():
     with ProcessPoolExecutor(MAX_WORKERS_PER_CLIENT) as executor:
         for i in range(MAX_WORKERS_PER_CLIENT):
             futures.append(executor.submit(run_worker, mounter.mount_points, args.controller, args.server, args.nodes,
-                                           args.domains, **dict(locking_type=args.locking)))
+                                           args.domains, **dict(locking_type=args.locking,
+                                                                queue_depth=args.queue_depth,
+                                                                fd_cache=args.fd_cache,
+                                                                direct_alignment=args.direct_alignment)))
     futures_validator(futures, logger)
     logger.info('all done')
 
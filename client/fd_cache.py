@@ -0,0 +1,158 @@
+"""
+File descriptor cache for the data path of Dynamo workers
+2016 samuels (c)
+"""
+import collections
+import contextlib
+import os
+import threading
+
+__author__ = 'samuels'
+
+
+class OpenPerOp(object):
+    """Opens the file for every operation and closes it right after, so each one pays the full
+    LOOKUP/OPEN/CLOSE cost and close-to-open consistency of NFS. The default, for metadata tests.
+    """
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open(mount_point, target, flags):
+        fd = os.open(''.join([mount_point, target]), flags)
+        try:
+            yield fd
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def invalidate(target):
+        pass
+
+    @staticmethod
+    def close():
+        pass
+
+
+OPEN_PER_OP = OpenPerOp()
+
+
+class FdCache(object):
+    """LRU cache of open file descriptors, so data path tests measure READ/WRITE and not the open and close
+    around them.
+
+    Descriptors are keyed by mount point and target, and opened read-write whatever the operation, so a file
+    read first can be written through the same descriptor later. Jobs which change the name or the size of a
+    file have to invalidate() its target first, on every mount point. A cached descriptor of a file deleted, or
+    renamed over, by another worker has no links left, it's dropped on its next use and the target is opened again
+    the way OPEN_PER_OP would. Files renamed away by other workers aren't seen, reads and writes keep going to the
+    file the descriptor was opened on.
+
+    Thread safe. A descriptor in use isn't closed by eviction or invalidation until its user is done with it.
+    """
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity: int, max descriptors kept open while not in use
+        """
+        if capacity < 1:
+            raise ValueError(f"Bad fd cache capacity. Got {capacity}, 1 or more is expected")
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._fds = collections.OrderedDict()  # (mount_point, target) -> [fd, users], least recently used first
+        self._mount_points = collections.defaultdict(set)  # target -> mount points it's open through
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'stale': 0}
+
+    def __len__(self):
+        return len(self._fds)
+
+    @contextlib.contextmanager
+    def open(self, mount_point, target, flags):
+        """Cached descriptor of the file, only O_CREAT of flags is used when it has to be opened"""
+        key = (mount_point, target)
+        entry = self._acquire(key, flags)
+        try:
+            yield entry[0]
+        finally:
+            self._release(key, entry)
+
+    def _acquire(self, key, flags):
+        with self._lock:
+            entry = self._fds.get(key)
+            if entry is not None:
+                self._fds.move_to_end(key)
+                entry[1] += 1
+                self.stats['hits'] += 1
+        if entry is not None:
+            if os.fstat(entry[0]).st_nlink:
+                return entry
+            self._drop_stale(key, entry)
+        # Opened outside of the lock, it's a round trip to the filer
+        fd = os.open(''.join(key), os.O_RDWR | (flags & os.O_CREAT))
+        entry = [fd, 1]
+        with self._lock:
+            self.stats['misses'] += 1
+            if key in self._fds:
+                # Opened by another thread meanwhile, keep ours out of the cache
+                return entry
+            self._fds[key] = entry
+            self._mount_points[key[1]].add(key[0])
+            self._evict()
+        return entry
+
+    def _release(self, key, entry):
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] or self._fds.get(key) is entry:
+                return
+        os.close(entry[0])
+
+    def _drop_stale(self, key, entry):
+        """The file of a cached descriptor was unlinked, stop using the descriptor and count the lookup as a miss"""
+        with self._lock:
+            self.stats['hits'] -= 1
+            self.stats['stale'] += 1
+            entry[1] -= 1
+            if self._fds.get(key) is entry:
+                self._pop(key)
+            if entry[1]:
+                return
+        os.close(entry[0])
+
+    def _evict(self):
+        """Close least recently used descriptors nobody is using, down to capacity"""
+        if len(self._fds) <= self.capacity:
+            return
+        for key, entry in list(self._fds.items()):
+            if entry[1]:
+                continue
+            self._pop(key)
+            os.close(entry[0])
+            self.stats['evictions'] += 1
+            if len(self._fds) <= self.capacity:
+                return
+
+    def _pop(self, key):
+        entry = self._fds.pop(key)
+        mount_points = self._mount_points[key[1]]
+        mount_points.discard(key[0])
+        if not mount_points:
+            del self._mount_points[key[1]]
+        return entry
+
+    def invalidate(self, target):
+        """Close the descriptors of target on all mount points, e.g. before it's deleted, renamed or truncated"""
+        with self._lock:
+            entries = [self._pop((mount_point, target)) for mount_point in list(self._mount_points.get(target, ()))]
+            # Descriptors in use are closed by their last user
+            idle = [fd for fd, users in entries if not users]
+        for fd in idle:
+            os.close(fd)
+
+    def close(self):
+        with self._lock:
+            idle = [fd for fd, users in self._fds.values() if not users]
+            self._fds.clear()
+            self._mount_points.clear()
+        for fd in idle:
+            os.close(fd)
@@ -0,0 +1,132 @@
+"""
+Pipelined job execution for Dynamo workers, several filesystem operations in flight per process
+2016 samuels (c)
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = 'samuels'
+
+
+def job_paths(data):
+    """Paths on the mount point a job works on, the keys it's serialized on. Renames work on their destination
+    too, rename_dest is a path like the target for rename_exist and a name in the target's directory for rename.
+    """
+    dest = data.get('rename_dest')
+    if dest is None:
+        return (data['target'],)
+    if not dest.startswith('/'):
+        dest = '/'.join([os.path.dirname(data['target']), dest])
+    return data['target'], dest
+
+
+class KeyedExecutor(object):
+    """Runs jobs on a pool of depth threads, jobs sharing a key one after another in the order they were
+    submitted, so operations on the same file never overtake each other.
+
+    A job may have several keys, e.g. both paths of a rename, and then waits for the jobs submitted before it on
+    any of them. Each key points to the last job submitted with it, a new job is queued behind those and started
+    once all of them completed, by the thread which ran the last one. Results are collected in a queue, and every
+    one of them writes a byte into a pipe, so the owner of the zmq socket can poll fileno() together with its socket
+    and send them from its own thread.
+    """
+
+    def __init__(self, depth):
+        """
+        Args:
+            depth: int, max jobs run at the same time
+        """
+        if depth < 1:
+            raise ValueError(f"Bad queue depth. Got {depth}, 1 or more is expected")
+        self.depth = depth
+        self._pool = ThreadPoolExecutor(max_workers=depth, thread_name_prefix='dynamo')
+        self._lock = threading.Lock()
+        self._last = {}  # key -> last _KeyedJob submitted with that key which didn't complete yet
+        self._results = queue.SimpleQueue()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        self.running = 0  # Jobs being run right now
+        # depth_total: sum of the jobs running as each job started, divided by jobs it's the achieved queue depth
+        self.stats = {'jobs': 0, 'depth_total': 0, 'max_depth': 0}
+
+    def fileno(self):
+        """Readable once results are ready"""
+        return self._wakeup_r
+
+    def submit(self, keys, handle, fn, *args):
+        """Run fn(*args) once every job submitted before with any of the keys completed, its result is returned by
+        results() together with handle
+        """
+        job = _KeyedJob(set(keys), handle, fn, args)
+        with self._lock:
+            for key in job.keys:
+                last = self._last.get(key)
+                if last is not None:
+                    last.next_jobs.append(job)
+                    job.waits_for += 1
+                self._last[key] = job
+            if job.waits_for:
+                return
+        self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        while job:
+            with self._lock:
+                self.running += 1
+                self.stats['jobs'] += 1
+                self.stats['depth_total'] += self.running
+                self.stats['max_depth'] = max(self.stats['max_depth'], self.running)
+            try:
+                self._results.put((job.handle, job.fn(*job.args)))
+            finally:
+                ready = []
+                with self._lock:
+                    self.running -= 1
+                    for key in job.keys:
+                        if self._last[key] is job:
+                            del self._last[key]
+                    for next_job in job.next_jobs:
+                        next_job.waits_for -= 1
+                        if not next_job.waits_for:
+                            ready.append(next_job)
+                os.write(self._wakeup_w, b'\0')
+            # The first job ready runs on this thread, any other one on a thread of its own
+            job = ready.pop(0) if ready else None
+            for ready_job in ready:
+                self._pool.submit(self._run, ready_job)
+
+    def results(self):
+        """(handle, result) of the jobs completed since the last call"""
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        completed = []
+        while True:
+            try:
+                completed.append(self._results.get_nowait())
+            except queue.Empty:
+                return completed
+
+    def average_depth(self):
+        return self.stats['depth_total'] / self.stats['jobs'] if self.stats['jobs'] else 0.0
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+
+class _KeyedJob(object):
+    __slots__ = ('keys', 'handle', 'fn', 'args', 'waits_for', 'next_jobs')
+
+    def __init__(self, keys, handle, fn, args):
+        self.keys = keys
+        self.handle = handle
+        self.fn = fn
+        self.args = args
+        self.waits_for = 0  # Jobs submitted before with one of the keys which didn't complete yet
+        self.next_jobs = []  # Jobs submitted after with one of the keys
@@ -2,15 +2,17 @@ import xxhash
 import os
 import random
 import shutil
-import errno
 import fcntl
+import functools
 # import data_operations.data_generators
 import sys
 import mmap
+import threading
 from timeit import default_timer as timer
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from config import error_codes
+from client.fd_cache import OPEN_PER_OP
 
 __author__ = "samuels"
 
@@ -36,24 +38,25 @@ GB512 = (GB1 * 512)  # level 2 can map up to 256GB
 TB128 = (TB1 * 128)  # level 3 can map up to 128TB
 ZERO_PADDING_START = 128 * MB1  # 128MB
 MAX_FILE_SIZE = TB1 + MB1
-DATA_PATTERN_A = {'pattern': PATTERN, 'repeats': KB4 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB4 // len(PATTERN))).intdigest()}
-DATA_PATTERN_B = {'pattern': PATTERN, 'repeats': KB8 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB8 // len(PATTERN))).intdigest()}
-DATA_PATTERN_C = {'pattern': PATTERN, 'repeats': KB16 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB16 // len(PATTERN))).intdigest()}
-DATA_PATTERN_D = {'pattern': PATTERN, 'repeats': KB32 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB32 // len(PATTERN))).intdigest()}
-DATA_PATTERN_E = {'pattern': PATTERN, 'repeats': KB64 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB64 // len(PATTERN))).intdigest()}
-DATA_PATTERN_F = {'pattern': PATTERN, 'repeats': KB128 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB128 // len(PATTERN))).intdigest()}
-DATA_PATTERN_G = {'pattern': PATTERN, 'repeats': KB256 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB256 // len(PATTERN))).intdigest()}
-DATA_PATTERN_H = {'pattern': PATTERN, 'repeats': KB512 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (KB512 // len(PATTERN))).intdigest()}
-DATA_PATTERN_I = {'pattern': PATTERN, 'repeats': MB1 // len(PATTERN),
-                  'checksum': xxhash.xxh64(PATTERN * (MB1 // len(PATTERN))).intdigest()}
+# Every data pattern is PATTERN repeated, so each one is a prefix of a single read-only buffer made once per process.
+# Writes hand zero-copy slices of it to the kernel instead of building the data on every call
+PATTERN_BUFFER = memoryview(PATTERN * (MB1 // len(PATTERN)))
+
+
+def make_data_pattern(repeats):
+    buffer = PATTERN_BUFFER[:len(PATTERN) * repeats]
+    return {'pattern': PATTERN, 'repeats': repeats, 'buffer': buffer, 'checksum': xxhash.xxh64(buffer).intdigest()}
+
+
+DATA_PATTERN_A = make_data_pattern(KB4 // len(PATTERN))
+DATA_PATTERN_B = make_data_pattern(KB8 // len(PATTERN))
+DATA_PATTERN_C = make_data_pattern(KB16 // len(PATTERN))
+DATA_PATTERN_D = make_data_pattern(KB32 // len(PATTERN))
+DATA_PATTERN_E = make_data_pattern(KB64 // len(PATTERN))
+DATA_PATTERN_F = make_data_pattern(KB128 // len(PATTERN))
+DATA_PATTERN_G = make_data_pattern(KB256 // len(PATTERN))
+DATA_PATTERN_H = make_data_pattern(KB512 // len(PATTERN))
+DATA_PATTERN_I = make_data_pattern(MB1 // len(PATTERN))
 
 PADDING = [0, ZERO_PADDING_START]
 OFFSETS_LIST = [0, INLINE, KB1, KB4, MB1, MB512, GB1, GB256, GB512, TB1]
@@ -66,6 +69,64 @@ class DynamoException(EnvironmentError):
     pass
 
 
+_read_buffers = threading.local()  # Pipelined workers read from several threads, each gets a buffer of its own
+
+
+def read_buffer(size):
+    """Reusable buffer of this thread for reads of up to size bytes. It only grows, so once the largest chunk was
+    read no more memory is allocated on the read path.
+    """
+    buf = getattr(_read_buffers, 'buf', None)
+    if buf is None or len(buf) < size:
+        buf = _read_buffers.buf = bytearray(size)
+    return memoryview(buf)[:size]
+
+
+_direct_buffers = threading.local()
+
+
+def direct_buffer(kind, size):
+    """Reusable buffer of this thread for O_DIRECT I/O of up to size bytes, a multiple of the block size. Anonymous
+    maps start on a page boundary, which bytearrays don't. The 'write' buffer holds PATTERN repeated, the 'read' one
+    is read into.
+    """
+    buf = getattr(_direct_buffers, kind, None)
+    if buf is None or len(buf) < size:
+        buf = mmap.mmap(-1, max(size, mmap.PAGESIZE))
+        if kind == 'write':
+            buf.write(PATTERN * (len(buf) // len(PATTERN)))
+        setattr(_direct_buffers, kind, buf)
+    return memoryview(buf)[:size]
+
+
+@functools.lru_cache(maxsize=None)
+def direct_alignment(mount_point):
+    """Alignment of O_DIRECT offsets and lengths: the logical block size of the device the mount point is on, a page
+    for network and memory filesystems which have none. Not the block size statvfs() reports, on NFS mounts that's
+    wsize and every direct write would be a megabyte.
+    """
+    dev = os.stat(mount_point).st_dev
+    device = f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}'
+    # Partitions have no queue of their own, it's the one of their disk
+    for queue_dir in (os.path.join(device, 'queue'), os.path.join(device, '..', 'queue')):
+        try:
+            with open(os.path.join(queue_dir, 'logical_block_size')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            continue
+    return mmap.PAGESIZE
+
+
+@functools.lru_cache(maxsize=None)
+def pattern_checksum(length):
+    """Checksum of the first length bytes of PATTERN repeated"""
+    return xxhash.xxh64(PATTERN * (length // len(PATTERN))).intdigest()
+
+
+def align_up(value, alignment):
+    return -(-value // alignment) * alignment
+
+
 class DataPatterns:
     def __init__(self):
         self.data_patterns_dict = {}
@@ -93,6 +154,7 @@ def profiler(f):
 def response_action(action, mount_point, incoming_data, **kwargs):
     return {
         "mkdir": mkdir,
+        "populate": populate,
         "list": list_dir,
         "delete": delete,
         "touch": touch,
@@ -101,7 +163,9 @@ def response_action(action, mount_point, incoming_data, **kwargs):
         "write": write,
         "rename": rename,
         "rename_exist": rename_exist,
-        "truncate": truncate
+        "truncate": truncate,
+        "read_direct": read_direct,
+        "write_direct": write_direct
     }[action](mount_point, incoming_data, **kwargs)
 
 
@@ -112,6 +176,37 @@ def mkdir(mount_point, incoming_data, **kwargs):
     return outgoing_data
 
 
+def populate(mount_point, incoming_data, **kwargs):
+    """Pre-population: create the directory, unless another chunk of it already did, and all the files of the job.
+    Files which fail are reported back instead of failing the whole job.
+    """
+    outgoing_data = {}
+    dir_path = '/'.join([mount_point, incoming_data['target']])
+    try:
+        os.mkdir(dir_path)
+        outgoing_data['mkdir'] = True
+    except FileExistsError:
+        outgoing_data['mkdir'] = False
+    failed = []
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+    for name in incoming_data['files']:
+        try:
+            fd = os.open('/'.join([dir_path, name]), flags)
+        except FileExistsError:
+            continue  # Created by an earlier run of a re-queued job
+        except OSError as os_error:
+            failed.append((name, os_error.errno))
+            continue
+        try:
+            os.write(fd, b'\0')
+        except OSError as os_error:
+            failed.append((name, os_error.errno))
+        finally:
+            os.close(fd)
+    outgoing_data['failed'] = failed
+    return outgoing_data
+
+
 def list_dir(mount_point, incoming_data, **kwargs):
     outgoing_data = {}
     os.listdir(''.join([mount_point, incoming_data['target']]))
@@ -122,8 +217,12 @@ def delete(mount_point, incoming_data, **kwargs):
     outgoing_data = {}
     flock = kwargs['flock']
     f_path = ''.join([mount_point, incoming_data['target']])
-    with open(f_path, 'rb') as fp:
-        flock.release(fp.fileno(), 0, os.path.getsize(f_path))
+    kwargs.get('fd_cache', OPEN_PER_OP).invalidate(incoming_data['target'])
+    fd = os.open(f_path, os.O_RDONLY)
+    try:
+        flock.release(fd, 0, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
     os.remove(f_path)
     outgoing_data['uuid'] = incoming_data['uuid']
     outgoing_data['tid'] = incoming_data['tid']
@@ -153,27 +252,28 @@ def stat(mount_point, incoming_data, **kwargs):
 def read(mount_point, incoming_data, **kwargs):
     outgoing_data = {}
     flock = kwargs['flock']
+    fd_cache = kwargs.get('fd_cache', OPEN_PER_OP)
     offset = incoming_data['offset']
     chunk_size = incoming_data['repeats']
-    f_path = ''.join([mount_point, incoming_data['target']])
-    with open(f_path, 'rb') as f:
-        f.seek(offset)
-        flock.lockf(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB, chunk_size, offset, 0)
-        buf = f.read(chunk_size)
-        flock.lockf(f.fileno(), fcntl.LOCK_UN, chunk_size, offset)
-        outgoing_data['hash'] = xxhash.xxh64(buf).intdigest()
-        outgoing_data['offset'] = offset
-        outgoing_data['chunk_size'] = chunk_size
-        outgoing_data['uuid'] = incoming_data['uuid']
-        outgoing_data['tid'] = incoming_data['tid']
-        # outgoing_data['buffer'] = buf[:256].decode()
-        return outgoing_data
+    buf = read_buffer(chunk_size)
+    with fd_cache.open(mount_point, incoming_data['target'], os.O_RDONLY) as fd:
+        flock.lockf(fd, fcntl.LOCK_SH | fcntl.LOCK_NB, chunk_size, offset, 0)
+        read_size = os.preadv(fd, [buf], offset)
+        flock.lockf(fd, fcntl.LOCK_UN, chunk_size, offset)
+    # Hashed in place, the data is never copied out of the buffer
+    outgoing_data['hash'] = xxhash.xxh64(buf[:read_size]).intdigest()
+    outgoing_data['offset'] = offset
+    outgoing_data['chunk_size'] = chunk_size
+    outgoing_data['uuid'] = incoming_data['uuid']
+    outgoing_data['tid'] = incoming_data['tid']
+    # outgoing_data['buffer'] = buf[:256].decode()
+    return outgoing_data
 
 
 def write(mount_point, incoming_data, **kwargs):
     outgoing_data = {}
     flock = kwargs['flock']
-    io_mode = 'rb+'
+    fd_cache = kwargs.get('fd_cache', OPEN_PER_OP)
     if incoming_data['io_type'] == 'sequential':
         offset = incoming_data['offset'] + incoming_data['data_pattern_len']
     else:
@@ -182,18 +282,12 @@ def write(mount_point, incoming_data, **kwargs):
         offset = int(random.random() * MAX_FILE_SIZE)
     pattern_index = int(random.random() * len(DATA_PATTERNS_LIST))
     data_pattern = DATA_PATTERNS_LIST[pattern_index]
-    pattern_to_write = data_pattern['pattern'] * data_pattern['repeats']
     data_hash = data_pattern['checksum']
-    file_path = ''.join([mount_point, incoming_data['target']])
-    if not os.path.exists(file_path):
-        io_mode = 'w+b'
-    with open(file_path, io_mode) as f:
-        flock.lockf(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB, data_pattern['repeats'], offset, 0)
-        f.seek(offset)
-        f.write(pattern_to_write)
-        # f.flush()
-        # os.fsync(f.fileno())
-        flock.lockf(f.fileno(), fcntl.LOCK_UN, data_pattern['repeats'], offset)
+    with fd_cache.open(mount_point, incoming_data['target'], os.O_RDWR | os.O_CREAT) as fd:
+        flock.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, data_pattern['repeats'], offset, 0)
+        os.pwrite(fd, data_pattern['buffer'], offset)
+        # os.fsync(fd)
+        flock.lockf(fd, fcntl.LOCK_UN, data_pattern['repeats'], offset)
         #  Checking if original data pattern and pattern on disk are the same
         # f.seek(offset)
         # buf = f.read(len(pattern_to_write))
@@ -214,11 +308,10 @@ def write(mount_point, incoming_data, **kwargs):
 
 def rename(mount_point, incoming_data, **kwargs):
     outgoing_data = {}
-    fullpath = incoming_data['target'].split('/')[1:]
-    dirpath = fullpath[0]
-    fname = fullpath[1]
+    dirpath, _, fname = incoming_data['target'].lstrip('/').rpartition('/')
     dst_mount_point = kwargs['dst_mount_point']
     outgoing_data['rename_dest'] = incoming_data['rename_dest']
+    kwargs.get('fd_cache', OPEN_PER_OP).invalidate(incoming_data['target'])
     os.rename('/'.join([mount_point, dirpath, fname]),
               '/'.join([dst_mount_point, dirpath, incoming_data['rename_dest']]))
     outgoing_data['uuid'] = incoming_data['uuid']
@@ -230,13 +323,14 @@ def rename_exist(mount_point, incoming_data, **kwargs):
     outgoing_data = {}
     src_path = incoming_data['rename_source']
     dst_path = incoming_data['rename_dest']
-    src_dirpath = src_path.split('/')[1]
-    src_fname = src_path.split('/')[2]
-    dst_dirpath = dst_path.split('/')[1]
-    dst_fname = dst_path.split('/')[2]
+    src_dirpath, _, src_fname = src_path.lstrip('/').rpartition('/')
+    dst_dirpath, _, dst_fname = dst_path.lstrip('/').rpartition('/')
     if src_fname == dst_fname:
         raise DynamoException(error_codes.SAMEFILE, "Error: Trying to move file into itself.", src_path)
     dst_mount_point = kwargs['dst_mount_point']
+    fd_cache = kwargs.get('fd_cache', OPEN_PER_OP)
+    fd_cache.invalidate(src_path)
+    fd_cache.invalidate(dst_path)
     shutil.move('/'.join([mount_point, src_dirpath, src_fname]),
                 '/'.join([dst_mount_point, dst_dirpath, dst_fname]))
     outgoing_data['rename_source'] = src_path
@@ -251,27 +345,16 @@ def truncate(mount_point, incoming_data, **kwargs):
     flock = kwargs['flock']
     padding = random.choice(PADDING)
     offset = random.choice(OFFSETS_LIST) + padding
-    fp = None
+    kwargs.get('fd_cache', OPEN_PER_OP).invalidate(incoming_data['target'])
+    fd = os.open(''.join([mount_point, incoming_data['target']]), os.O_WRONLY)
     try:
-        fp = open(''.join([mount_point, incoming_data['target']]), 'r+b')
-        # flock.lockf(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        fp.truncate(offset)
-        fp.flush()
-        os.fsync(fp.fileno())
-        # flock.lockf(fp.fileno(), fcntl.LOCK_UN)
-        fp.close()
-    except (IOError, OSError) as env_error:
-        if fp:
-            try:
-                fcntl.lockf(fp.fileno(), fcntl.LOCK_UN)
-            except OSError as os_err:
-                if os_err.errno == errno.ENOLCK:
-                    pass
-                else:
-                    fp.close()
-                    raise os_err
-            fp.close()
-        raise env_error
+        # flock.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.ftruncate(fd, offset)
+        os.fsync(fd)
+        # flock.lockf(fd, fcntl.LOCK_UN)
+    finally:
+        # Closing drops any lock the process holds on the file
+        os.close(fd)
     outgoing_data['size'] = offset
     outgoing_data['uuid'] = incoming_data['uuid']
     outgoing_data['tid'] = incoming_data['tid']
@@ -279,27 +362,24 @@ def truncate(mount_point, incoming_data, **kwargs):
 
 
 def read_direct(mount_point, incoming_data, **kwargs):
+    """read() bypassing the client page cache. O_DIRECT wants the buffer, offset and length aligned to the block
+    size, so the aligned blocks around the requested range are read and only the range is hashed.
+    """
     outgoing_data = {}
     flock = kwargs['flock']
-    fd = None
+    alignment = kwargs.get('direct_alignment') or direct_alignment(mount_point)
+    offset = incoming_data['offset']
+    chunk_size = incoming_data['repeats']
+    start = offset - offset % alignment
+    buf = direct_buffer('read', align_up(offset + chunk_size, alignment) - start)
+    fd = os.open(''.join([mount_point, incoming_data['target']]), os.O_RDONLY | os.O_DIRECT)
     try:
-        f_path = "{0}{1}".format(mount_point, incoming_data['target'])
-        fd = os.open(f_path, os.O_RDONLY | os.O_DIRECT)
-        mmap_buf = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
-        offset = incoming_data['offset']
-        chunk_size = incoming_data['repeats']
-        mmap_buf.seek(offset)
-        flock.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, chunk_size, offset)
-        buf = mmap_buf.read(chunk_size)
-        flock.lockf(fd, fcntl.LOCK_UN)
+        flock.lockf(fd, fcntl.LOCK_SH | fcntl.LOCK_NB, chunk_size, offset, 0)
+        read_size = os.preadv(fd, [buf], start)
+        flock.lockf(fd, fcntl.LOCK_UN, chunk_size, offset)
+    finally:
         os.close(fd)
-    except (IOError, OSError) as env_error:
-        if fd:
-            os.close(fd)
-        raise env_error
-    hasher = xxhash.xxh64()
-    hasher.update(buf)
-    outgoing_data['hash'] = hasher.hexdigest()
+    outgoing_data['hash'] = xxhash.xxh64(buf[offset - start:min(read_size, offset - start + chunk_size)]).intdigest()
     outgoing_data['offset'] = offset
     outgoing_data['chunk_size'] = chunk_size
     outgoing_data['uuid'] = incoming_data['uuid']
@@ -308,56 +388,30 @@ def read_direct(mount_point, incoming_data, **kwargs):
 
 
 def write_direct(mount_point, incoming_data, **kwargs):
+    """write() bypassing the client page cache. The data pattern is rounded up to whole blocks and written at a block
+    aligned offset, chunk_size is the number of bytes written.
+    """
     outgoing_data = {}
-    hasher = xxhash.xxh64()
-    fp = None
+    flock = kwargs['flock']
+    alignment = kwargs.get('direct_alignment') or direct_alignment(mount_point)
     if incoming_data['io_type'] == 'sequential':
         offset = incoming_data['offset'] + incoming_data['data_pattern_len']
     else:
-        padding = random.choice(PADDING)
-        base_offset = random.choice(OFFSETS_LIST) + padding
-        offset = base_offset + random.randint(base_offset, MAX_FILE_SIZE)
-    data_pattern = random.choice(DATA_PATTERNS_LIST)
-    pattern_to_write = data_pattern['pattern'] * data_pattern['repeats']
-    hasher.update(pattern_to_write)
-    data_hash = hasher.hexdigest()
+        offset = int(random.random() * MAX_FILE_SIZE)
+    offset = align_up(offset, alignment)
+    data_pattern = DATA_PATTERNS_LIST[int(random.random() * len(DATA_PATTERNS_LIST))]
+    chunk_size = align_up(len(data_pattern['buffer']), alignment)
+    buf = direct_buffer('write', chunk_size)
+    fd = os.open(''.join([mount_point, incoming_data['target']]), os.O_WRONLY | os.O_CREAT | os.O_DIRECT)
     try:
-        fp = os.open("{0}{1}".format(mount_point, incoming_data['target']), os.O_WRONLY | os.O_DIRECT)
-        fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB, data_pattern['repeats'], offset, 0)
-        os.lseek(fp, offset, os.SEEK_SET)
-        pattern_len = data_pattern['repeats']
-        aligned_pattern_len = pattern_len if not pattern_len % 2 else pattern_len + 1  # write pattern needs to be
-        #  stored in allgned memory buffer
-        mmap_buf = mmap.mmap(-1, int(aligned_pattern_len), prot=mmap.PROT_WRITE)
-        mmap_buf.write(data_pattern['pattern'] * aligned_pattern_len)
-        os.write(fp, mmap_buf)
-        os.fsync(fp)
-        #  Checking if original data pattern and pattern on disk are the same
-        os.lseek(fp, offset, os.SEEK_SET)
-        buf = os.read(fp, data_pattern['repeats'])
-        hasher = xxhash.xxh64()
-        hasher.update(buf)
-        read_hash = hasher.hexdigest()
-        if read_hash != data_hash:
-            outgoing_data['dynamo_error'] = error_codes.HASHERR
-            outgoing_data['bad_hash'] = read_hash
-        fcntl.lockf(fp, fcntl.LOCK_UN)
-        os.close(fp)
-    except (IOError, OSError) as env_error:
-        if fp:
-            try:
-                fcntl.lockf(fp, fcntl.LOCK_UN)
-            except OSError as os_err:
-                if os_err.errno == errno.ENOLCK:
-                    pass
-                else:
-                    os.close(fp)
-                    raise os_err
-            os.close(fp)
-        raise env_error
-    outgoing_data['data_pattern'] = data_pattern['pattern']
-    outgoing_data['chunk_size'] = data_pattern['repeats']
-    outgoing_data['hash'] = data_hash
+        flock.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, chunk_size, offset, 0)
+        os.pwrite(fd, buf, offset)
+        flock.lockf(fd, fcntl.LOCK_UN, chunk_size, offset)
+    finally:
+        os.close(fd)
+    outgoing_data['data_pattern'] = data_pattern['pattern'].decode()
+    outgoing_data['chunk_size'] = chunk_size
+    outgoing_data['hash'] = pattern_checksum(chunk_size)
     outgoing_data['offset'] = offset
     outgoing_data['uuid'] = incoming_data['uuid']
     outgoing_data['io_type'] = incoming_data['io_type']
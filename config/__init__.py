@@ -4,7 +4,9 @@ CTRL_MSG_PORT = int(os.environ.get("CTRL_MSG_PORT", "5557"))
 CLIENT_MSG_PORT = int(os.environ.get("CLIENT_MSG_PORT", "5558"))
 CLIENT_PROXY_FRONTEND = int(os.environ.get("CLIENT_PROXY_FRONTEND", "6000"))
 PUBSUB_LOGGER_PORT = int(os.environ.get("PUBSUB_LOGGER_PORT", "5559"))
+SHARD_BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", "5600"))
 MAX_FILES_PER_DIR = int(os.environ.get("MAX_FILES_PER_DIR", "10000"))
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", "2048"))
 
 SET_SSH_PATH = os.environ.get("SET_SSH_PATH", "/zebra/qa/qa-util-scripts/set-ssh-client")
 DYNAMO_PATH = os.environ.get("DYNAMO_PATH", "~/qa/dynamo")
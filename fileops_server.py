@@ -22,13 +22,22 @@ from config.redis_config import redis_config
 from logger.pubsub_logger import SUBLogger
 from logger.server_logger import ConsoleLogger
 from server.async_controller import Controller
+from server.asyncio_controller import AsyncioController
+from server.shard import ShardRouter
+from server.snapshot import SNAPSHOT_INTERVAL, load_snapshot, shard_snapshot_path, snapshot_path, snapshots_supported
 from tree import dirtree
 from utils import ssh_utils
+from utils.name_corpus import NameCorpus
 from utils.shell_utils import ShellUtils
 
 stop_event = Event()
 logger = ConsoleLogger(__name__).logger
 
+CONTROLLER_ENGINES = {
+    'threaded': Controller,
+    'asyncio': AsyncioController,
+}
+
 SSH_PUB_KEY_PATH = os.environ.get(
     "SSH_PUB_KEY_PATH",
     os.path.expanduser(os.path.join('~', '.ssh', 'id_rsa.pub'))
@@ -88,10 +97,53 @@ def get_args():
                         help="Random seed for reproducibility. Logged at startup.")
     parser.add_argument('--strict', action='store_true',
                         help="Fail fast on first unexpected filesystem error")
+    parser.add_argument('--engine', type=str, default='threaded', choices=list(CONTROLLER_ENGINES),
+                        help="Controller messaging engine")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Number of controller processes to partition the directory tree across")
+    parser.add_argument('--snapshot_interval', type=int, default=SNAPSHOT_INTERVAL,
+                        help="Seconds between snapshots of the expected state tree, 0 disables them")
+    parser.add_argument('--queue_depth', type=int, default=1,
+                        help="Jobs each client worker process runs at the same time, 1 runs them one by one")
+    parser.add_argument('--fd_cache', type=int, default=0,
+                        help="Open files each client worker process keeps across jobs, 0 opens them for every job")
+    parser.add_argument('--direct_alignment', type=int, default=0,
+                        help="Alignment of read_direct/write_direct offsets and lengths in bytes, 0 uses the "
+                             "logical block size of the client mount points")
+    parser.add_argument('--resume', type=str, default=None,
+                        help="Snapshot to reload the expected state tree from. Snapshots keep being written to it")
     args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.queue_depth < 1:
+        parser.error("--queue_depth must be at least 1")
+    if args.fd_cache < 0:
+        parser.error("--fd_cache must be 0 or more")
+    if args.direct_alignment < 0 or args.direct_alignment & (args.direct_alignment - 1):
+        parser.error("--direct_alignment must be 0 or a power of 2")
+    if args.snapshot_interval < 0:
+        parser.error("--snapshot_interval must be 0 or more")
+    if args.resume:
+        if not snapshots_supported():
+            parser.error("--resume requires msgpack to be installed")
+        missing = [path for path in resume_paths(args.resume, args.shards) if not os.path.isfile(path)]
+        if missing:
+            parser.error(f"--resume snapshot not found: {' '.join(missing)}")
     return args
 
 
+def resume_paths(path, shards):
+    if shards == 1:
+        return [path]
+    return [shard_snapshot_path(path, (index, shards)) for index in range(shards)]
+
+
+def load_tree(dir_tree, path):
+    restored = load_snapshot(path, dir_tree)
+    logger.info(f"Resumed {restored} directories from snapshot {path}")
+    return dir_tree
+
+
 def load_config():
     with open(os.path.join("server", "config.json")) as f:
         test_config = json.load(f)
@@ -171,19 +223,27 @@ def deploy_clients(clients, access):
         _run_remote_logged(client, f'{venv_path}/bin/python3 -c "import zmq; print(zmq.__version__)"')
 
 
-def run_clients(cluster, clients, export, mtype, start_vip, end_vip, locking_type):
+def run_clients(cluster, clients, export, mtype, start_vip, end_vip, locking_type, queue_depth=1,
+                fd_cache=0, direct_alignment=0):
     controller = socket.gethostbyname(socket.gethostname())
     venv_python = config.DYNAMO_PATH + '/.venv/bin/python3'
     dynamo_cmd_line = "{} {} --controller {} --server {} --export {} --mtype {} --start_vip {} --end_vip {} " \
-                      "--locking {}".format(venv_python, config.DYNAMO_BIN_PATH, controller, cluster, export, mtype,
-                                            start_vip, end_vip, locking_type)
+                      "--locking {} --queue_depth {} --fd_cache {} " \
+                      "--direct_alignment {}".format(venv_python, config.DYNAMO_BIN_PATH, controller, cluster, export,
+                                                     mtype, start_vip, end_vip, locking_type, queue_depth, fd_cache,
+                                                     direct_alignment)
     for client in clients:
         ShellUtils.run_shell_remote_command_background(client, dynamo_cmd_line)
     wait_clients_to_start(clients)
 
 
 def run_controller(event, dir_tree, test_config, clients_ready_event):
-    Controller(event, dir_tree, test_config, clients_ready_event).run()
+    controller_class = CONTROLLER_ENGINES[test_config.get('_engine', 'threaded')]
+    controller_class(event, dir_tree, test_config, clients_ready_event).run()
+
+
+def run_shard_router(event, shards, shard_stats):
+    ShardRouter(event, shards, shard_stats).run()
 
 
 def run_sub_logger(ip):
@@ -242,12 +302,14 @@ def main():
     logger.info(f"Random seed: {seed} (use --seed {seed} to reproduce)")
 
     try:
-        with open(config.FILE_NAMES_PATH, 'r') as f:
-            file_names = f.readlines()
+        file_names = NameCorpus(config.FILE_NAMES_PATH)
+        logger.info(f"{len(file_names)} file names mapped from {config.FILE_NAMES_PATH}")
     except IOError as io_error:
         if io_error.errno == errno.ENOENT:
             pass
     dir_tree = dirtree.DirTree(file_names)
+    if args.resume and args.shards == 1:
+        load_tree(dir_tree, args.resume)
     logger.debug(f"{__name__} Logger initialised {logger}")
     atexit.register(cleanup, clients=args.clients)
     clients_list = args.clients
@@ -255,6 +317,9 @@ def main():
     test_config = load_config()
     test_config['_journal'] = OperationJournal()
     test_config['_strict'] = args.strict
+    test_config['_engine'] = args.engine
+    test_config['_snapshot'] = args.resume or snapshot_path()
+    test_config['_snapshot_interval'] = args.snapshot_interval
     logger.info(f"Operation journal: {test_config['_journal'].path}")
     logger.info("Setting passwordless SSH connection")
     rsa_pub_key = ensure_ssh_key(SSH_PUB_KEY_PATH)
@@ -279,15 +344,39 @@ def main():
     time.sleep(10)
     deploy_clients(clients_list, test_config['access']['client'])
     logger.info(f"Done deploying clients: {clients_list}")
-    run_clients(args.cluster, clients_list, args.export, args.mtype, args.start_vip, args.end_vip, args.locking)
+    run_clients(args.cluster, clients_list, args.export, args.mtype, args.start_vip, args.end_vip, args.locking,
+                args.queue_depth, args.fd_cache, args.direct_alignment)
     clients_ready_event.set()
     logger.info("Dynamo started on all clients ....")
-    logger.info("Starting controller")
-    controller_process = Process(target=run_controller, name="controller",
-                                 args=(stop_event, dir_tree, test_config, clients_ready_event))
-    controller_process.start()
-    _child_processes.append(controller_process)
-    controller_process.join()
+    if args.shards == 1:
+        logger.info("Starting controller")
+        controller_process = Process(target=run_controller, name="controller",
+                                     args=(stop_event, dir_tree, test_config, clients_ready_event))
+        controller_process.start()
+        _child_processes.append(controller_process)
+        controller_process.join()
+    else:
+        logger.info(f"Starting shard router and {args.shards} controller shards")
+        shard_stats = multiprocessing.Manager().dict()
+        router_process = Process(target=run_shard_router, name="shard_router",
+                                 args=(stop_event, args.shards, shard_stats))
+        router_process.start()
+        _child_processes.append(router_process)
+        controller_processes = []
+        for index in range(args.shards):
+            shard = (index, args.shards)
+            shard_config = dict(test_config, _shard=shard, _shard_stats=shard_stats,
+                                _snapshot=shard_snapshot_path(test_config['_snapshot'], shard))
+            shard_tree = dirtree.DirTree(file_names, shard=shard)
+            if args.resume:
+                load_tree(shard_tree, shard_config['_snapshot'])
+            controller_process = Process(target=run_controller, name=f"controller-{index}",
+                                         args=(stop_event, shard_tree, shard_config, clients_ready_event))
+            controller_process.start()
+            controller_processes.append(controller_process)
+            _child_processes.append(controller_process)
+        for controller_process in controller_processes:
+            controller_process.join()
     logger.info('All done')
 
 
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+Controller and client hot path micro-benchmarks
+author: samuels
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_PATH)
+from server.helpers import timestamp_ns
+from server.scheduler import WorkerScheduler
+from utils import codec
+
+timer = timeit.default_timer
+
+WORKER_COUNTS = [32, 64, 128, 256, 512, 1024, 2048, 4096]
+
+
+def sorted_dispatch(num_workers, num_jobs, max_jobs_per_worker):
+    """Old dispatch path: sort all workers by in-flight job count on every job"""
+    client_workers = {f"worker-{i}".encode(): {} for i in range(num_workers)}
+    outstanding = []
+    start = timer()
+    for job_id in range(num_jobs):
+        worker_id, work = sorted(client_workers.items(), key=lambda x: len(x[1]))[0]
+        if len(work) >= max_jobs_per_worker:
+            done_worker, done_job = outstanding.pop(random.randrange(len(outstanding)))
+            del client_workers[done_worker][done_job]
+            continue
+        work[job_id] = None
+        outstanding.append((worker_id, job_id))
+    return num_jobs / (timer() - start)
+
+
+def heap_dispatch(num_workers, num_jobs, max_jobs_per_worker):
+    """Scheduler dispatch path: least loaded worker is kept on top of an indexed min-heap"""
+    scheduler = WorkerScheduler(max_jobs_per_worker)
+    for i in range(num_workers):
+        scheduler.add(f"worker-{i}".encode())
+    outstanding = []
+    start = timer()
+    for _ in range(num_jobs):
+        worker_id = scheduler.next_worker()
+        if worker_id is None:
+            scheduler.job_done(outstanding.pop(random.randrange(len(outstanding))))
+            continue
+        scheduler.job_dispatched(worker_id)
+        outstanding.append(worker_id)
+    return num_jobs / (timer() - start)
+
+
+def bench_scheduler(args):
+    print(f"{'workers':>8} {'sorted jobs/s':>15} {'heap jobs/s':>15} {'speedup':>8}")
+    for num_workers in WORKER_COUNTS:
+        random.seed(args.seed)
+        sorted_rate = sorted_dispatch(num_workers, args.jobs, args.max_jobs_per_worker)
+        random.seed(args.seed)
+        heap_rate = heap_dispatch(num_workers, args.jobs, args.max_jobs_per_worker)
+        print(f"{num_workers:>8} {sorted_rate:>15.0f} {heap_rate:>15.0f} {heap_rate / sorted_rate:>7.1f}x")
+
+
+def sample_messages(wire_codec):
+    """Typical job frame sent by the controller and result frame sent back by a client"""
+    job = (1234567,
+           {'action': 'write',
+            'data': {'tid': 17, 'target': '/' + 'd' * 64 + '/' + 'f' * 48, 'offset': 1048576,
+                     'data_pattern_len': 4096, 'io_type': 'sequential', 'uuid': 'a1b2c'}})
+    result = {'message': 'job_done', 'job_id': job[0],
+              'result': {'result': 'success', 'action': 'write', 'target': job[1]['data']['target'],
+                         'timestamp': wire_codec.timestamp(),
+                         'data': {'data_pattern': '1234999988884321', 'chunk_size': 256,
+                                  'hash': 11676526813513613597, 'offset': 1052672, 'uuid': 'a1b2c',
+                                  'io_type': 'sequential', 'tid': 17, 'duration': 0.000153}}}
+    return job, result
+
+
+def bench_codec(args):
+    print(f"{'codec':>8} {'job bytes':>10} {'result bytes':>13} {'encode us':>10} {'decode us':>10} "
+          f"{'timestamp us':>13} {'total us':>9}")
+    for name in codec.available_codecs():
+        wire_codec = codec.get_codec(name)
+        job, result = sample_messages(wire_codec)
+        job_frame = wire_codec.encode(job)
+        result_frame = wire_codec.encode(result)
+        start = timer()
+        for _ in range(args.messages):
+            wire_codec.encode(job)
+            wire_codec.encode(result)
+        encode = (timer() - start) / args.messages * 1e6
+        start = timer()
+        for _ in range(args.messages):
+            codec.decode(job_frame)
+            codec.decode(result_frame)
+        decode = (timer() - start) / args.messages * 1e6
+        time_stamp = result['result']['timestamp']
+        start = timer()
+        for _ in range(args.messages):
+            timestamp_ns(time_stamp)
+        parse = (timer() - start) / args.messages * 1e6
+        print(f"{name:>8} {len(job_frame):>10} {len(result_frame):>13} {encode:>10.2f} {decode:>10.2f} "
+              f"{parse:>13.2f} {encode + decode + parse:>9.2f}")
+
+
+def populated_tree(dirs=10, files_per_dir=100):
+    """DirTree with synced directories full of files on disk, so every request action has a target"""
+    from tree.dirtree import DirTree
+    dir_tree = DirTree()
+    for _ in range(dirs):
+        dir_tree.append_node()
+        node = dir_tree.last_node
+        dir_tree.add_synced_node(node.identifier, node.tag)
+        node.data.ondisk = True
+        for _ in range(files_per_dir):
+            node.data.get_file_by_name(node.data.touch()).ondisk = True
+    return dir_tree
+
+
+def bench_pipeline(args):
+    import logging
+    from server.async_controller import Job, job_ids, load_workload, weighted_choice
+    from server.job_pipeline import JobPipeline
+    from server.request_actions import request_action
+    from server.sampler import WeightedSampler
+    os.chdir(REPO_PATH)
+    logger = logging.getLogger('micro_bench')
+    workload = load_workload(args.workload)
+    file_operations = list(workload['file_ops'].items())
+    io_types = list(workload['io_types'].items())
+    ids = job_ids()
+
+    def make_job(action, io_type):
+        request_data = request_action(action, logger, dir_tree, io_type=io_type)
+        return Job(next(ids), {'action': action, 'data': request_data}) if request_data else None
+
+    print(f"{'path':>28} {'us/job':>8}")
+    random.seed(args.seed)
+    dir_tree = populated_tree()
+    start = timer()
+    made = 0
+    while made < args.jobs:
+        if make_job(weighted_choice(file_operations), weighted_choice(io_types)):
+            made += 1
+    print(f"{'inline, per job sampling':>28} {(timer() - start) / args.jobs * 1e6:>8.2f}")
+
+    random.seed(args.seed)
+    dir_tree = populated_tree()
+    stop_event = threading.Event()
+    jobs = JobPipeline(make_job, WeightedSampler(file_operations), WeightedSampler(io_types), stop_event, logger,
+                       0).jobs()
+    start = timer()
+    for _ in range(args.jobs):
+        next(jobs)
+    print(f"{'inline, chunked sampling':>28} {(timer() - start) / args.jobs * 1e6:>8.2f}")
+
+    random.seed(args.seed)
+    dir_tree = populated_tree()
+    pipeline = JobPipeline(make_job, WeightedSampler(file_operations), WeightedSampler(io_types), stop_event, logger,
+                           args.jobs)
+    jobs = pipeline.jobs()
+    while len(pipeline) < args.jobs:
+        time.sleep(0.01)
+    start = timer()
+    for _ in range(args.jobs):
+        next(jobs)
+    print(f"{'lookahead buffer, dispatch':>28} {(timer() - start) / args.jobs * 1e6:>8.2f}")
+    stop_event.set()
+
+
+def per_char_names(min_length, max_length, count):
+    """Old name generation: a random.choice() call per character"""
+    from string import ascii_letters, digits
+    start = timer()
+    for _ in range(count):
+        ''.join(random.choice(digits + ascii_letters) for _ in range(random.randint(min_length, max_length)))
+    return count / (timer() - start)
+
+
+def bulk_names(min_length, max_length, count):
+    """NameGenerator: names made a chunk at a time from one randbytes() call"""
+    from utils.shell_utils import NameGenerator
+    names = NameGenerator(min_length, max_length)
+    start = timer()
+    for _ in range(count):
+        next(names)
+    return count / (timer() - start)
+
+
+def bench_names(args):
+    print(f"{'length':>8} {'per char names/s':>17} {'bulk names/s':>13} {'speedup':>8}")
+    for min_length, max_length in ((16, 16), (16, 64), (64, 64)):
+        random.seed(args.seed)
+        per_char_rate = per_char_names(min_length, max_length, args.names)
+        random.seed(args.seed)
+        bulk_rate = bulk_names(min_length, max_length, args.names)
+        print(f"{min_length:>3}..{max_length:<3} {per_char_rate:>17.0f} {bulk_rate:>13.0f} "
+              f"{bulk_rate / per_char_rate:>7.1f}x")
+
+
+def bench_corpus(args):
+    import tracemalloc
+    from utils.name_corpus import OFFSETS_SUFFIX, NameCorpus
+    from utils.shell_utils import NameGenerator, StringUtils
+    random.seed(args.seed)
+    names = NameGenerator(64)
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'filenames.dat')
+    try:
+        with open(path, 'w') as f:
+            for _ in range(args.names):
+                f.write(next(names) + '\n')
+        print(f"{'corpus':>22} {'open s':>8} {'python MB':>10} {'names/s':>10}")
+
+        def measure(label, load, iterate):
+            start = timer()
+            load()
+            opened = timer() - start
+            tracemalloc.start()
+            loaded = load()
+            memory = tracemalloc.get_traced_memory()[0] / 2 ** 20
+            tracemalloc.stop()
+            drawn = iterate(loaded)
+            start = timer()
+            for _ in range(args.names):
+                next(drawn)
+            print(f"{label:>22} {opened:>8.2f} {memory:>10.1f} {args.names / (timer() - start):>10.0f}")
+
+        def read_lines():
+            with open(path) as f:
+                return f.readlines()
+
+        def build_index():
+            if os.path.exists(path + OFFSETS_SUFFIX):
+                os.remove(path + OFFSETS_SUFFIX)
+            return NameCorpus(path)
+
+        measure('readlines', read_lines, StringUtils.string_from_file_generator)
+        measure('mmap, index built', build_index, NameCorpus.names)
+        measure('mmap, index mapped', lambda: NameCorpus(path), NameCorpus.names)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_memory(args):
+    import tracemalloc
+    from tree.dirtree import Directory, File
+    from utils.shell_utils import StringUtils
+    directory = Directory(StringUtils.random_string_generator())
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    files = [File(name='') for _ in range(args.files)]
+    record = (tracemalloc.get_traced_memory()[0] - start) / args.files
+    del files
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(args.files):
+        directory.touch()
+    tracked = (tracemalloc.get_traced_memory()[0] - start) / args.files
+    tracemalloc.stop()
+    print(f"{'files':>10} {'record bytes':>13} {'tracked bytes':>14}")
+    print(f"{args.files:>10} {record:>13.0f} {tracked:>14.0f}")
+
+
+def success_result(action, data):
+    """Client success message for the job request data, as dynamo would send it back"""
+    result = {}
+    if action == 'mkdir':
+        result['dirsize'] = 0
+    elif action == 'truncate':
+        result['size'] = 0
+    elif action == 'write':
+        result.update(data_pattern=0, chunk_size=1, hash=0, offset=data['offset'])
+    elif action == 'read':
+        result.update(hash=data['hash'], offset=data['offset'], chunk_size=1)
+    elif action == 'rename':
+        result['rename_dest'] = data['rename_dest']
+    elif action == 'rename_exist':
+        result['rename_source'] = data['rename_source']
+        result['rename_dest'] = data['rename_dest']
+    return {'result': 'success', 'action': action, 'target': data['target'], 'timestamp': time.time_ns(),
+            'data': result}
+
+
+def contention_worker(dir_tree, file_operations, deadline, counts):
+    import logging
+    from server.request_actions import request_action
+    from server.response_actions import response_action
+    from server.sampler import WeightedSampler
+    logger = logging.getLogger('micro_bench')
+    actions = WeightedSampler(file_operations)
+    ops = 0
+    while timer() < deadline:
+        for action in actions.sample(100):
+            data = request_action(action, logger, dir_tree, io_type='sequential')
+            if data:
+                response_action(logger, success_result(action, data), dir_tree, data)
+            ops += 1
+    counts.append(ops)
+
+
+def bench_contention(args):
+    from server.async_controller import load_workload
+    os.chdir(REPO_PATH)
+    file_operations = list(load_workload(args.workload)['file_ops'].items())
+    print(f"{'threads':>8} {'ops/s':>10}")
+    for threads in args.threads:
+        random.seed(args.seed)
+        dir_tree = populated_tree()
+        dir_tree.set_layout(2, 10)
+        counts = []
+        deadline = timer() + args.duration
+        workers = [threading.Thread(target=contention_worker, args=(dir_tree, file_operations, deadline, counts))
+                   for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print(f"{threads:>8} {sum(counts) / args.duration:>10.0f}")
+
+
+def bench_response(args):
+    import logging
+    from server.request_actions import request_action
+    from server.response_actions import response_action
+    logger = logging.getLogger('micro_bench')
+    actions = ['touch', 'stat', 'delete', 'rename', 'truncate', 'write', 'read', 'rename_exist']
+    random.seed(args.seed)
+    dir_tree = populated_tree(dirs=10, files_per_dir=1000)
+    results = []
+    for i in range(args.results):
+        action = actions[i % len(actions)]
+        data = request_action(action, logger, dir_tree, io_type='sequential')
+        if data:
+            results.append((success_result(action, data), data))
+    start = timer()
+    for result, data in results:
+        response_action(logger, result, dir_tree, data)
+    print(f"{'results':>10} {'us/result':>10}")
+    print(f"{len(results):>10} {(timer() - start) / len(results) * 1e6:>10.2f}")
+
+
+def bench_write_path(args):
+    from client.response_actions import DATA_PATTERNS_LIST
+    fd, path = tempfile.mkstemp(dir=args.path)
+    print(f"{'size KB':>8} {'copy CPU us':>12} {'buffer CPU us':>14} {'speedup':>8}")
+    try:
+        for data_pattern in DATA_PATTERNS_LIST:
+            size = len(data_pattern['buffer'])
+            writes = max(1, args.megabytes * 2 ** 20 // size)
+
+            def measure(write):
+                os.ftruncate(fd, 0)
+                start = time.process_time()
+                for _ in range(writes):
+                    write()
+                return (time.process_time() - start) / writes * 1e6
+
+            copy_cpu = measure(lambda: os.pwrite(fd, data_pattern['pattern'] * data_pattern['repeats'], 0))
+            buffer_cpu = measure(lambda: os.pwrite(fd, data_pattern['buffer'], 0))
+            print(f"{size // 1024:>8} {copy_cpu:>12.1f} {buffer_cpu:>14.1f} {copy_cpu / buffer_cpu:>7.1f}x")
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def bench_read_path(args):
+    import xxhash
+    from client import response_actions
+    from client.fd_cache import OPEN_PER_OP, FdCache
+    from client.locking import FLock
+    flock = FLock(None, 'off')
+    mount_point = tempfile.mkdtemp(dir=args.path)
+    target = '/file'
+    print(f"{'size KB':>8} {'buffered GB/s':>14} {'pread GB/s':>11} {'pread cached fd GB/s':>21}")
+    try:
+        for data_pattern in response_actions.DATA_PATTERNS_LIST:
+            size = len(data_pattern['buffer'])
+            with open(mount_point + target, 'wb') as f:
+                f.write(data_pattern['buffer'])
+            reads = max(1, args.megabytes * 2 ** 20 // size)
+            data = {'target': target, 'offset': 0, 'repeats': size, 'uuid': 0, 'tid': 0}
+
+            def buffered():
+                with open(mount_point + target, 'rb') as f:
+                    f.seek(0)
+                    xxhash.xxh64(f.read(size)).intdigest()
+
+            def measure(read):
+                start = timer()
+                for _ in range(reads):
+                    read()
+                return reads * size / (timer() - start) / 2 ** 30
+
+            fd_cache = FdCache(1)
+            rates = (measure(buffered),
+                     measure(lambda: response_actions.read(mount_point, data, flock=flock, fd_cache=OPEN_PER_OP)),
+                     measure(lambda: response_actions.read(mount_point, data, flock=flock, fd_cache=fd_cache)))
+            fd_cache.close()
+            print(f"{size // 1024:>8} {rates[0]:>14.2f} {rates[1]:>11.2f} {rates[2]:>21.2f}")
+    finally:
+        shutil.rmtree(mount_point)
+
+
+def engine_client(mount_point):
+    sys.path.insert(0, os.path.join(REPO_PATH, 'client'))
+    from dynamo import Dynamo
+    Dynamo([mount_point], '127.0.0.1', 'micro_bench', 0, 0, locking_type='off').run()
+
+
+def engine_router(shards, duration):
+    from server.shard import ShardRouter
+    stop_event = multiprocessing.Event()
+    threading.Timer(duration, stop_event.set).start()
+    ShardRouter(stop_event, shards).run()
+
+
+def engine_controller(engine, workload, duration, results, shard=None):
+    from server.async_controller import Controller
+    from server.asyncio_controller import AsyncioController
+    from tree.dirtree import DirTree
+    controller_class = {'threaded': Controller, 'asyncio': AsyncioController}[engine]
+    stop_event = multiprocessing.Event()
+    clients_ready_event = multiprocessing.Event()
+    clients_ready_event.set()
+    controller = controller_class(stop_event, DirTree(shard=shard), {'workload': workload, '_shard': shard},
+                                  clients_ready_event)
+    threading.Thread(target=controller.run, daemon=True).start()
+    time.sleep(duration)
+    results.put(controller.test_stats['total'])
+    results.close()
+    results.join_thread()
+    os._exit(0)  # Collector and proxy threads don't stop on their own
+
+
+def bench_engine(args):
+    os.chdir(REPO_PATH)
+    os.makedirs('logs', exist_ok=True)
+    print(f"{'engine':>10} {'shards':>7} {'clients':>8} {'ops/s':>10}")
+    for engine in ('threaded', 'asyncio'):
+        mount_point = tempfile.mkdtemp(dir=args.path)
+        results = multiprocessing.Queue()
+        processes = []
+        if args.shards > 1:
+            processes.append(multiprocessing.Process(target=engine_router, args=(args.shards, args.duration)))
+            shards = [(index, args.shards) for index in range(args.shards)]
+        else:
+            shards = [None]
+        for shard in shards:
+            processes.append(multiprocessing.Process(target=engine_controller,
+                                                     args=(engine, args.workload, args.duration, results, shard)))
+        for process in processes:
+            process.start()
+        clients = [multiprocessing.Process(target=engine_client, args=(mount_point,), daemon=True)
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        total = sum(results.get() for _ in shards)
+        for process in processes:
+            process.join()
+        for client in clients:
+            client.kill()
+            client.join()
+        shutil.rmtree(mount_point, ignore_errors=True)
+        print(f"{engine:>10} {args.shards:>7} {args.clients:>8} {total / args.duration:>10.0f}")
+
+
+def get_args():
+    """
+    Supports the command-line arguments listed below.
+    """
+    parser = argparse.ArgumentParser(description='Controller and client hot path micro-benchmarks')
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    scheduler_parser = subparsers.add_parser('scheduler', help="Worker selection rate vs. number of workers")
+    scheduler_parser.add_argument('--jobs', type=int, default=20000, help="Jobs to dispatch per worker count")
+    scheduler_parser.add_argument('--max_jobs_per_worker', type=int, default=4,
+                                  help="In-flight jobs allowed per worker")
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    codec_parser = subparsers.add_parser('codec', help="Encode + decode cost of a job/result round trip per codec")
+    codec_parser.add_argument('--messages', type=int, default=100000, help="Round trips to measure")
+    codec_parser.set_defaults(func=bench_codec)
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="Cost of a job on the dispatch path, built inline vs. "
+                                                             "popped from the lookahead buffer")
+    pipeline_parser.add_argument('--workload', type=str, default='metadata', help="Workload name from workloads/")
+    pipeline_parser.add_argument('--jobs', type=int, default=20000, help="Jobs to generate per path")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    names_parser = subparsers.add_parser('names', help="Random file and directory name generation rate")
+    names_parser.add_argument('--names', type=int, default=200000, help="Names to generate per length")
+    names_parser.set_defaults(func=bench_names)
+
+    corpus_parser = subparsers.add_parser('corpus', help="Open cost, memory and draw rate of a file name corpus, "
+                                                         "read into a list vs. memory-mapped")
+    corpus_parser.add_argument('--names', type=int, default=1000000, help="Names in the corpus")
+    corpus_parser.set_defaults(func=bench_corpus)
+
+    memory_parser = subparsers.add_parser('memory', help="Controller memory per file of the expected state model, "
+                                                         "the File record alone and with its name and index entry")
+    memory_parser.add_argument('--files', type=int, default=200000, help="Files to create")
+    memory_parser.set_defaults(func=bench_memory)
+
+    contention_parser = subparsers.add_parser('contention', help="Ops/s of threads generating requests and "
+                                                                 "applying their results on a shared DirTree")
+    contention_parser.add_argument('--workload', type=str, default='metadata', help="Workload name from workloads/")
+    contention_parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8],
+                                   help="Thread counts to measure")
+    contention_parser.add_argument('--duration', type=float, default=5, help="Seconds to run each thread count")
+    contention_parser.set_defaults(func=bench_contention)
+
+    response_parser = subparsers.add_parser('response', help="Cost of applying a result to the expected state "
+                                                             "model, mixed file actions")
+    response_parser.add_argument('--results', type=int, default=100000, help="Results to apply")
+    response_parser.set_defaults(func=bench_response)
+
+    write_parser = subparsers.add_parser('write', help="Client CPU time per write of each data pattern size, pattern "
+                                                       "built per write vs. sliced from the shared buffer")
+    write_parser.add_argument('--megabytes', type=int, default=256, help="Data written per pattern size and path")
+    write_parser.add_argument('--path', type=str, default=None, help="Directory to write in, tmpfs keeps the "
+                                                                     "filesystem out of the way")
+    write_parser.set_defaults(func=bench_write_path)
+
+    read_parser = subparsers.add_parser('read', help="Client read throughput of each data pattern size, buffered "
+                                                     "read vs. pread into the reusable buffer")
+    read_parser.add_argument('--megabytes', type=int, default=1024, help="Data read per pattern size and path")
+    read_parser.add_argument('--path', type=str, default=None, help="Directory to read in, tmpfs keeps the "
+                                                                    "filesystem out of the way")
+    read_parser.set_defaults(func=bench_read_path)
+
+    engine_parser = subparsers.add_parser('engine', help="End to end ops/s of each controller engine against "
+                                                         "local dynamo processes")
+    engine_parser.add_argument('--workload', type=str, default='metadata', help="Workload name from workloads/")
+    engine_parser.add_argument('--clients', type=int, default=4, help="Number of local dynamo processes")
+    engine_parser.add_argument('--shards', type=int, default=1, help="Number of controller shards")
+    engine_parser.add_argument('--duration', type=float, default=10, help="Seconds to run each engine")
+    engine_parser.add_argument('--path', type=str, default=None, help="Directory to run file operations in, "
+                                                                      "tmpfs keeps the filesystem out of the way")
+    engine_parser.set_defaults(func=bench_engine)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -2,29 +2,42 @@
 Asynchronous Server logic is here
 2016 samuels (c)
 """
+import itertools
 import multiprocessing
 import queue
 import timeit
 import json
 import random
 import time
-import uuid
 import os
 import zmq
 from threading import Thread
-from config import CTRL_MSG_PORT
+from config import CTRL_MSG_PORT, MAX_FILES_PER_DIR, MEMORY_BUDGET_MB
 from logger import server_logger
 from server import helpers
 from server.CSVWriter import CSVWriter
 from server.collector import Collector
+from server.job_pipeline import STARVED_WAIT, JobPipeline
+from server.prepopulate import DEFAULT_CHUNK_FILES, Prepopulation
 from server.request_actions import request_action
-from server.response_actions import response_action
+from server.response_actions import job_dispatched, response_action
+from server.sampler import WeightedSampler
+from server.scheduler import WorkerScheduler
+from server.shard import controller_socket
+from server.snapshot import SNAPSHOT_INTERVAL, TreeSnapshot, snapshots_supported
+from tree.dirtree import DEFAULT_TREE_DEPTH, DEFAULT_TREE_WIDTH
+from utils import codec
 
 timer = timeit.default_timer
 
 MAX_DIR_SIZE = 128 * 1024
 MAX_CONTROLLER_OUTGOING_WORKERS = 4
 MAX_CONTROLLER_INCOMING_WORKERS = 16
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_WINDOW = 1000
+DEFAULT_LOOKAHEAD = 4096
+JOB_ID_SHARD_SHIFT = 56  # Job ids are 64 bit, the top 8 bits carry the shard index
+STOP_EVENT_POLL_INTERVAL = 1  # Seconds, stop_event is a multiprocessing.Event and can't be waited on with sockets
 
 
 __author__ = 'samuels'
@@ -49,10 +62,18 @@ def load_workload(name):
     return test_config
 
 
+def job_ids(shard=None):
+    """Monotonically increasing job ids of a controller, prefixed with the shard index when sharded"""
+    return itertools.count((shard[0] << JOB_ID_SHARD_SHIFT) if shard else 0)
+
+
 class Job(object):
-    def __init__(self, work):
-        self.id = uuid.uuid4().hex
+    __slots__ = ('id', 'work', 'dispatched')
+
+    def __init__(self, job_id, work):
+        self.id = job_id
         self.work = work
+        self.dispatched = 0.0  # timer() of the last dispatch, for the age of jobs in flight
 
 
 class Controller(object):
@@ -74,6 +95,8 @@ class Controller(object):
             self.config = test_config
             self._journal = test_config.get('_journal')
             self._strict = test_config.get('_strict', False)
+            self._shard = test_config.get('_shard')  # (index, count) when running as one of several shards
+            self._job_ids = job_ids(self._shard)
             self.test_stats = {'total': 0, 'success': {
                 'total': 0,
                 'mkdir': 0,
@@ -85,7 +108,10 @@ class Controller(object):
                 'delete': 0,
                 'rename': 0,
                 'rename_exist': 0,
-                'truncate': 0
+                'truncate': 0,
+                'populate': 0,
+                'read_direct': 0,
+                'write_direct': 0
 
             }, 'failed': {
                 'total': 0,
@@ -98,7 +124,10 @@ class Controller(object):
                 'delete': 0,
                 'rename': 0,
                 'rename_exist': 0,
-                'truncate': 0
+                'truncate': 0,
+                'populate': 0,
+                'read_direct': 0,
+                'write_direct': 0
 
             }}
             self.logger.info(f"Loading workload: {self.config['workload']}")
@@ -119,50 +148,115 @@ class Controller(object):
             if weights_total != 100:
                 raise ValueError(f"Bad total weight of file operations. Got {weights_total}, 100 is expected")
             self.io_types = [(k, v) for k, v in io_types.items()]
-            self.max_jobs_per_worker = 1000
+            # Jobs are shipped to batch capable workers batch_size at a time, and no worker
+            # gets more than window jobs in flight (fewer if it asked for less credits on connect)
+            dispatch = workload.get('dispatch', {})
+            self.batch_size = dispatch.get('batch_size', DEFAULT_BATCH_SIZE)
+            self.window = dispatch.get('window', DEFAULT_WINDOW)
+            if self.batch_size < 1 or self.window < self.batch_size:
+                raise ValueError(f"Bad dispatch settings. Got batch_size {self.batch_size} and window {self.window}, "
+                                 f"1 <= batch_size <= window is expected")
+            self._scheduler = WorkerScheduler(self.window)
+            # Jobs are generated ahead of dispatch by a producer thread, lookahead 0 builds them inline
+            self.lookahead = dispatch.get('lookahead', DEFAULT_LOOKAHEAD)
+            if self.lookahead < 0:
+                raise ValueError(f"Bad dispatch settings. Got lookahead {self.lookahead}, 0 or more is expected")
+            # Directories nest up to depth levels below the mount point, with at most width subdirectories each
+            layout = workload.get('dir_tree', {})
+            self._dir_tree.set_layout(layout.get('depth', DEFAULT_TREE_DEPTH), layout.get('width', DEFAULT_TREE_WIDTH))
+            # Directories turn read-only once full, and the oldest or random full ones are evicted from memory
+            # when the files of the model would outgrow the memory budget
+            self._dir_tree.set_budget(layout.get('max_files_per_dir', MAX_FILES_PER_DIR),
+                                      layout.get('memory_budget_mb', MEMORY_BUDGET_MB), layout.get('eviction', 'oldest'))
+            self._job_pipeline = JobPipeline(self._make_job, WeightedSampler(self.file_operations),
+                                             WeightedSampler(self.io_types), self.stop_event, self.logger,
+                                             self.lookahead)
+            # Directories and files built before the measured phase starts, in parallel across all workers
+            self._prepopulation = self._make_prepopulation(workload.get('prepopulate'))
+            self._batch_workers = set()  # Workers which accept 'jobs' frames and reply with 'job_done_batch'
+            self._worker_codecs = {}  # Codec negotiated with each worker on connect
             # When/if a client disconnects we'll put any unfinished work in here,
             # get_next_job() will return work from here as well.
             self._work_to_requeue = []
             self._incoming_message_queue = queue.Queue()
             self._outgoing_message_queue = queue.Queue()
             self._csv_writer_queue = multiprocessing.Queue()
+            # Time the dispatch loop spent blocked waiting for a worker with free credits
+            self.idle_stats = {'started': None, 'idle': 0.0, 'waits': 0}
             self.logger.info("Starting Collector service thread...")
             collector = Collector(self.test_stats, self.dir_tree, self.stop_event, workers=self.client_workers,
-                                  in_queue=self._incoming_message_queue, out_queue=self._outgoing_message_queue)
+                                  in_queue=self._incoming_message_queue, out_queue=self._outgoing_message_queue,
+                                  idle_stats=self.idle_stats, job_pipeline=self._job_pipeline, shard=self._shard,
+                                  shard_stats=test_config.get('_shard_stats'))
             collector_thread = Thread(target=collector.run)
             collector_thread.start()
+            if not snapshots_supported():
+                self.logger.warning("msgpack is not installed, the expected state tree won't be snapshotted")
+            elif test_config.get('_snapshot') and test_config.get('_snapshot_interval', SNAPSHOT_INTERVAL):
+                self.logger.info(f"Starting snapshot thread, writing to {test_config['_snapshot']}")
+                snapshot = TreeSnapshot(self._dir_tree, test_config['_snapshot'], self.stop_event, self.logger,
+                                        test_config.get('_snapshot_interval', SNAPSHOT_INTERVAL))
+                Thread(target=snapshot.run, name='snapshot').start()
             self.logger.info("Starting CSV writer process...")
             # csv_writer = CSVWriter(self._csv_writer_queue, self.stop_event)
             # csv_writer = Process(target=csv_writer.run)
             # csv_writer.start()
             self.logger.info("Starting Async Server....")
-            proxy_device_thread = AsyncControllerServer(self.logger, self.stop_event, self._incoming_message_queue,
-                                                        self._outgoing_message_queue)
-            proxy_device_thread.start()
+            self._start_server()
         except KeyboardInterrupt:
             stop_event.set()
         except Exception as e:
             self.logger.exception(e)
             stop_event.set()
 
+    def _start_server(self):
+        """Threaded engine: ROUTER <-> DEALER proxy with pools of incoming/outgoing worker threads, which hand
+        messages over to run() through the incoming/outgoing message queues
+        """
+        proxy_device_thread = AsyncControllerServer(self.logger, self.stop_event, self._incoming_message_queue,
+                                                    self._outgoing_message_queue, shard=self._shard)
+        proxy_device_thread.start()
+
+    def _send(self, worker_id, worker_codec, message):
+        self._outgoing_message_queue.put((worker_id, worker_codec, message))
+
     @property
     def dir_tree(self):
         return self._dir_tree
 
     @property
     def get_next_job(self):
-        while True:
-            action = weighted_choice(self.file_operations)
-            io_type = weighted_choice(self.io_types)
-            if self._work_to_requeue:
-                yield self._work_to_requeue.pop()
-            request_data = request_action(action, self.logger, self._dir_tree, io_type=io_type)
-            if not request_data:
-                continue
-            job = Job({'action': action, 'data': request_data})
-            if self._journal:
-                self._journal.record(job.id, action, request_data)
-            yield job
+        phases = [self._job_pipeline.jobs]
+        if self._prepopulation:
+            phases.insert(0, self._prepopulation.jobs)
+        for phase in phases:
+            for job in phase():
+                if self._work_to_requeue:
+                    yield self._work_to_requeue.pop()
+                yield job
+
+    def _make_prepopulation(self, settings):
+        if not settings:
+            return None
+        dirs = settings.get('dirs', 0)
+        if self._shard:
+            # Each shard builds its share of the directories
+            index, count = self._shard
+            dirs = dirs // count + (index < dirs % count)
+        if self._dir_tree.synced_nodes:
+            self.logger.info("Directory tree was resumed from a snapshot, skipping pre-population")
+            return None
+        return Prepopulation(self._dir_tree, dirs, settings.get('files_per_dir', 0), self._new_job,
+                             self.stop_event, self.logger, settings.get('chunk_files', DEFAULT_CHUNK_FILES))
+
+    def _make_job(self, action, io_type):
+        request_data = request_action(action, self.logger, self._dir_tree, io_type=io_type)
+        if not request_data:
+            return None
+        return self._new_job(action, request_data)
+
+    def _new_job(self, action, request_data):
+        return Job(next(self._job_ids), {'action': action, 'data': request_data})
 
     def collect_message_stats(self, incoming_message):
         self.test_stats['total'] += 1
@@ -173,41 +267,73 @@ class Controller(object):
         """Return the id of the next worker available to process work. Note
         that this will return None if no clients are available.
         """
-        # It isn't strictly necessary since we're limiting the amount of work
-        # we assign, but just to demonstrate that we're doing our own load
-        # balancing we'll find the worker with the least work
-        if self.client_workers:
-            worker_id, work = sorted(self.client_workers.items(),
-                                     key=lambda x: len(x[1]))[0]
-            if len(work) < self.max_jobs_per_worker:
-                return worker_id
-        # No worker is available. Our caller will have to handle this.
-        return None
+        # We're doing our own load balancing: the scheduler keeps workers in a
+        # min-heap ordered by their in-flight job count, so the least loaded
+        # worker is always on top. None means no worker is available and our
+        # caller will have to handle this.
+        return self._scheduler.next_worker()
 
     def _handle_worker_message(self, worker_id, message):
         """Handle a message from the worker identified by worker_id.
 
-        {'message': 'connect'}
+        {'message': 'connect', 'batch': True, 'credits': 64, 'codecs': ['msgpack', 'json']}
         {'message': 'disconnect'}
-        {'message': 'job_done', 'job_id': 'xxx', 'result': 'yyy'}
+        {'message': 'job_done', 'job_id': 123, 'result': 'yyy'}
+        {'message': 'job_done_batch', 'results': [[123, 'yyy'], ...]}
         """
         if message['message'] == 'connect':
             assert worker_id not in self.client_workers
+            self._scheduler.add(worker_id, message.get('credits'))
             self.client_workers[worker_id] = {}
-            self.logger.info(f'[{worker_id}]: connect')
+            if message.get('batch'):
+                self._batch_workers.add(worker_id)
+            self._worker_codecs[worker_id] = codec.negotiate(message.get('codecs'))
+            self.logger.info(f'[{worker_id}]: connect, {self._scheduler.free_credits(worker_id)} credits, '
+                             f'{self._worker_codecs[worker_id].name} codec')
         elif message['message'] == 'disconnect':
             # Remove the worker so no more work gets added, and put any
             # remaining work into _work_to_requeue
             remaining_work = self.client_workers.pop(worker_id)
+            self._scheduler.remove(worker_id)
+            self._batch_workers.discard(worker_id)
+            self._worker_codecs.pop(worker_id)
             self._work_to_requeue.extend(remaining_work.values())
             self.logger.info(f'[{worker_id}]: disconnect, {len(remaining_work)} jobs re-queued')
         elif message['message'] == 'job_done':
             result = message['result']
             job = self.client_workers[worker_id].pop(message['job_id'])
+            self._scheduler.job_done(worker_id)
             self._process_results(worker_id, job, result)
+        elif message['message'] == 'job_done_batch':
+            work = self.client_workers[worker_id]
+            self._scheduler.job_done(worker_id, len(message['results']))
+            for job_id, result in message['results']:
+                self._process_results(worker_id, work.pop(job_id), result)
         else:
             raise Exception(f"Unknown message: {message['message']}")
 
+    def _dispatch(self, worker_id, jobs):
+        """Send the jobs to the worker. Batch capable workers get all of them in
+        a single frame, others get one frame per job.
+        """
+        work = self.client_workers[worker_id]
+        now = timer()
+        for job in jobs:
+            if not job.dispatched:
+                # Re-queued jobs of a disconnected worker were booked when they were first sent
+                job_dispatched(self.dir_tree, job.work['action'], job.work['data'])
+            job.dispatched = now
+            work[job.id] = job
+            if self._journal:
+                self._journal.record(job.id, job.work['action'], job.work['data'])
+        self._scheduler.job_dispatched(worker_id, len(jobs))
+        worker_codec = self._worker_codecs[worker_id]
+        if worker_id in self._batch_workers:
+            self._send(worker_id, worker_codec, {'message': 'jobs', 'jobs': [(job.id, job.work) for job in jobs]})
+        else:
+            for job in jobs:
+                self._send(worker_id, worker_codec, (job.id, job.work))
+
     def _process_results(self, worker_id, job, incoming_message):
         """
         Result message format:
@@ -219,43 +345,60 @@ class Controller(object):
         self.logger.debug(f'[{worker_id}]: finished {job.id}, result: {formatted_message}')
         self.collect_message_stats(incoming_message)
         self._csv_writer_queue.put((worker_id, incoming_message))
-        is_critical = response_action(self.logger, incoming_message, self.dir_tree)
+        is_critical = response_action(self.logger, incoming_message, self.dir_tree, job.work['data'])
+        if job.work['action'] == 'populate':
+            self._prepopulation.job_done(job.work['data'], incoming_message)
         if is_critical and self._strict:
             self.logger.error("Strict mode: stopping on critical error")
             self.stop_event.set()
 
+    def _wait_for_worker_message(self, timeout=STOP_EVENT_POLL_INTERVAL):
+        idle_start = timer()
+        try:
+            _, (worker_id, message) = self._incoming_message_queue.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        else:
+            self._handle_worker_message(worker_id, message)
+        finally:
+            self.idle_stats['idle'] += timer() - idle_start
+            self.idle_stats['waits'] += 1
+
     def run(self):
         while not self.clients_ready_event.is_set():
             self.logger.info("Waiting for all clients to start...")
             time.sleep(1)
 
         try:
-            for job in self.get_next_job:
-                next_worker_id = None
-
-                while next_worker_id is None:
-                    # First check if there are any worker messages to process. We
-                    # do this while checking for the next available worker so that
-                    # if it takes a while to find one we're still processing
-                    # incoming messages.
-                    while not self._incoming_message_queue.empty():
-                        _, (worker_id, message) = self._incoming_message_queue.get()
-                        self._handle_worker_message(worker_id, message)
-                    next_worker_id = self._get_next_worker_id()
-                    if not next_worker_id:
-                        time.sleep(0.1)
-                # We've got a Job and an available worker_id, all we need to do
-                # is send it. Note that we're now using send_multipart(), the
-                # counterpart to recv_multipart(), to tell the ROUTER where our
-                # message goes.
-                # self.logger.debug('sending job %s to worker %s', job.id,
-                #                   next_worker_id)
-                self.client_workers[next_worker_id][job.id] = job
-                self._outgoing_message_queue.put((next_worker_id, job.id, job.work))
+            jobs = self.get_next_job
+            self.idle_stats['started'] = timer()
+            while not self.stop_event.is_set():
+                # First process all worker messages which already arrived, then
+                # look for the next available worker. If there's none, nothing
+                # can be dispatched until a result or a connect frees credits, so
+                # block on the incoming queue and handle that message the moment
+                # it arrives.
+                while not self._incoming_message_queue.empty():
+                    _, (worker_id, message) = self._incoming_message_queue.get()
+                    self._handle_worker_message(worker_id, message)
+                next_worker_id = self._get_next_worker_id()
+                if next_worker_id is None:
+                    self._wait_for_worker_message()
+                    continue
+                # We've got an available worker_id, fill as much of its free credits
+                # as a single batch allows and send them over. The outgoing workers
+                # use send_multipart(), the counterpart to recv_multipart(), to tell
+                # the ROUTER where our message goes.
+                batch_len = min(self.batch_size, self._scheduler.free_credits(next_worker_id))
+                batch = list(itertools.islice(itertools.takewhile(bool, jobs), batch_len))
+                if not batch:
+                    # Job pipeline stopped, or starved until results of jobs in flight come back. There may be
+                    # none in flight, so look at the pipeline again shortly rather than waiting for a message
+                    self._wait_for_worker_message(STARVED_WAIT)
+                    continue
+                self._dispatch(next_worker_id, batch)
                 # self.logger.info("Incoming Queue: {0} Outgoing Queue: {1}".format(
                 # self._incoming_message_queue.qsize(), self._outgoing_message_queue.qsize()))
-                if self.stop_event.is_set():
-                    break
         except KeyboardInterrupt:
             self.stop_event.set()
         except Exception as generic_error:
@@ -266,26 +409,34 @@ class Controller(object):
 
 
 class AsyncControllerServer(Thread, object):
-    def __init__(self, logger, stop_event, incoming_queue, outgoing_queue):
+    def __init__(self, logger, stop_event, incoming_queue, outgoing_queue, shard=None):
         super(AsyncControllerServer, self).__init__()
         self._stop_event = stop_event
         self._logger = logger
         self._incoming_queue = incoming_queue
         self._outgoing_queue = outgoing_queue
         self._context = zmq.Context()
-        self._frontend = self._context.socket(zmq.ROUTER)
-        self._frontend.bind("tcp://*:{0}".format(CTRL_MSG_PORT))
-        self._backend = self._context.socket(zmq.DEALER)
-        self._backend.bind('inproc://backend')
+        self._frontend = controller_socket(self._context, shard)
+        # Each incoming worker reads the frames of a fixed share of the clients from a socket of its own, so the
+        # results of a client are applied in the order it sent them
+        self._backends = []
+        for index in range(MAX_CONTROLLER_INCOMING_WORKERS):
+            backend = self._context.socket(zmq.PUSH)
+            backend.bind(f'inproc://incoming.{index}')
+            self._backends.append(backend)
+        # Outgoing workers get their own socket, if they were connected to the backend
+        # they'd get their share of incoming frames too, which they never read
+        self._outgoing = self._context.socket(zmq.PULL)
+        self._outgoing.bind('inproc://outgoing')
 
     def run(self):
         self._logger.info(
             "Async Controller Server thread {0} started".format(self.name))
         try:
             workers = []
-            for _ in range(MAX_CONTROLLER_INCOMING_WORKERS):
+            for index in range(MAX_CONTROLLER_INCOMING_WORKERS):
                 worker = IncomingAsyncControllerWorker(self._logger, self._context, self._incoming_queue,
-                                                       self._stop_event)
+                                                       self._stop_event, f'inproc://incoming.{index}')
                 workers.append(worker)
                 worker.start()
             for _ in range(MAX_CONTROLLER_OUTGOING_WORKERS):
@@ -294,7 +445,7 @@ class AsyncControllerServer(Thread, object):
                 workers.append(worker)
                 worker.start()
             self._logger.info("Starting Proxy Device...")
-            zmq.proxy(self._frontend, self._backend)
+            self._proxy()
         except zmq.ZMQError as zmq_error:
             self._logger.exception(zmq_error)
             self._stop_event.set()
@@ -307,20 +458,37 @@ class AsyncControllerServer(Thread, object):
             self._logger.info("Shutting down workers and closing sockets...")
             for w in workers:
                 w.join(timeout=5)
-            self._backend.close()
+            self._outgoing.close()
+            for backend in self._backends:
+                backend.close()
             self._frontend.close()
             self._context.term()
 
+    def _proxy(self):
+        """Forward client frames from the frontend to the incoming worker of the client, and frames of the outgoing
+        workers back to the frontend, which routes them to the client by the worker id in the first frame
+        """
+        poller = zmq.Poller()
+        poller.register(self._frontend, zmq.POLLIN)
+        poller.register(self._outgoing, zmq.POLLIN)
+        while not self._stop_event.is_set():
+            events = dict(poller.poll(STOP_EVENT_POLL_INTERVAL * 1000))
+            if self._frontend in events:
+                frames = self._frontend.recv_multipart()
+                self._backends[hash(frames[0]) % len(self._backends)].send_multipart(frames)
+            if self._outgoing in events:
+                self._frontend.send_multipart(self._outgoing.recv_multipart())
+
 
 class AsyncControllerWorker(Thread, object):
-    def __init__(self, logger, context, stop_event):
+    def __init__(self, logger, context, stop_event, socket_type, endpoint):
         super(AsyncControllerWorker, self).__init__()
         self._logger = logger
         self._context = context
         self.stop_event = stop_event
         try:
-            self._worker = self._context.socket(zmq.DEALER)
-            self._worker.connect('inproc://backend')
+            self._worker = self._context.socket(socket_type)
+            self._worker.connect(endpoint)
         except zmq.ZMQError as zmq_error:
             self._logger.exception(zmq_error)
             self.stop_event.set()
@@ -328,8 +496,8 @@ class AsyncControllerWorker(Thread, object):
 
 
 class IncomingAsyncControllerWorker(AsyncControllerWorker, object):
-    def __init__(self, logger, context, incoming_queue, stop_event):
-        super().__init__(logger, context, stop_event)
+    def __init__(self, logger, context, incoming_queue, stop_event, endpoint):
+        super().__init__(logger, context, stop_event, socket_type=zmq.PULL, endpoint=endpoint)
         self.incoming_queue = incoming_queue
 
     def run(self):
@@ -337,13 +505,17 @@ class IncomingAsyncControllerWorker(AsyncControllerWorker, object):
         while not self.stop_event.is_set():
             try:
                 # self._logger.debug("Waiting Incoming job...")
+                if not self._worker.poll(STOP_EVENT_POLL_INTERVAL * 1000):
+                    continue
                 worker_id, message = self._worker.recv_multipart()  # flags=zmq.NOBLOCK)
                 # self._logger.debug(f"Incoming job received: {worker_id}")
-                message = json.loads(message.decode('utf8'))
-                if message['message'] == 'connect' or message['message'] == 'disconnect':
-                    time_stamp = timestamp()
-                else:
+                message = codec.decode(message)
+                if message['message'] == 'job_done':
                     time_stamp = message['result']['timestamp']
+                elif message['message'] == 'job_done_batch':
+                    time_stamp = message['results'][0][1]['timestamp']
+                else:
+                    time_stamp = timestamp()
                 self.incoming_queue.put(
                     (time_stamp, (worker_id, message)))  # Putting messages to queue by timestamp priority
                 # self._logger.debug(f"Putting incoming job {worker_id} to queue")
@@ -364,7 +536,7 @@ class IncomingAsyncControllerWorker(AsyncControllerWorker, object):
 
 class OutgoingAsyncControllerWorker(AsyncControllerWorker, object):
     def __init__(self, logger, context, outgoing_queue, stop_event):
-        super().__init__(logger, context, stop_event)
+        super().__init__(logger, context, stop_event, socket_type=zmq.PUSH, endpoint='inproc://outgoing')
         self.outgoing_queue = outgoing_queue
 
     def run(self):
@@ -373,11 +545,11 @@ class OutgoingAsyncControllerWorker(AsyncControllerWorker, object):
             try:
                 #  Sending out messages from outgoing message queue
                 # self._logger.debug("Going to get outgoing job from queue...")
-                next_worker_id, job_id, job_work = self.outgoing_queue.get()
-                # self._logger.debug(f"Going to send outgoing job {job_id}")
+                next_worker_id, worker_codec, message = self.outgoing_queue.get(timeout=STOP_EVENT_POLL_INTERVAL)
+                # self._logger.debug(f"Going to send outgoing message to {next_worker_id}")
                 self._worker.send_multipart(
-                    [next_worker_id, json.dumps((job_id, job_work)).encode('utf8')])
-                # self._logger.debug(f"Outgoing job {job_id} is sent")
+                    [next_worker_id, worker_codec.encode(message)])
+                # self._logger.debug(f"Outgoing message to {next_worker_id} is sent")
             except queue.Empty:
                 pass
             except zmq.ZMQError as zmq_error:
@@ -0,0 +1,96 @@
+"""
+Single event loop controller engine built on zmq.asyncio
+2016 samuels (c)
+"""
+import asyncio
+import itertools
+import time
+
+import zmq
+import zmq.asyncio
+
+from server.async_controller import Controller, STOP_EVENT_POLL_INTERVAL, timer
+from server.job_pipeline import STARVED_WAIT
+from server.shard import controller_socket
+from utils import codec
+
+__author__ = 'samuels'
+
+
+class AsyncioController(Controller):
+    """Controller engine which reads ROUTER frames, dispatches jobs and processes results in a single asyncio
+    event loop. Unlike the threaded engine there are no proxy, worker threads or message queues in between,
+    so every message is handled without thread hand-offs.
+    """
+
+    def _start_server(self):
+        self._context = zmq.asyncio.Context()
+        self._socket = controller_socket(self._context, self._shard)
+        self._credits_available = None  # asyncio.Event, created inside the event loop
+
+    def _send(self, worker_id, worker_codec, message):
+        # ROUTER sockets never block on send, so there is nothing to wait for here
+        self._socket.send_multipart([worker_id, worker_codec.encode(message)])
+
+    def run(self):
+        while not self.clients_ready_event.is_set():
+            self.logger.info("Waiting for all clients to start...")
+            time.sleep(1)
+
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            self.stop_event.set()
+        except Exception as generic_error:
+            self.logger.error(generic_error)
+            raise generic_error
+        finally:
+            self.stop_event.set()
+            self._socket.close(linger=0)
+            self._context.term()
+
+    async def _serve(self):
+        self._credits_available = asyncio.Event()
+        self.idle_stats['started'] = timer()
+        tasks = [asyncio.ensure_future(self._receive()), asyncio.ensure_future(self._dispatch_jobs())]
+        try:
+            while not self.stop_event.is_set():
+                done, _ = await asyncio.wait(tasks, timeout=STOP_EVENT_POLL_INTERVAL,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # Re-raises whatever stopped the task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _receive(self):
+        while True:
+            worker_id, message = await self._socket.recv_multipart()
+            self._handle_worker_message(worker_id, codec.decode(message))
+            # Results and connects hand out credits, wake up the dispatcher if it's waiting for them
+            if not self._credits_available.is_set() and self._get_next_worker_id() is not None:
+                self._credits_available.set()
+
+    async def _dispatch_jobs(self):
+        jobs = self.get_next_job
+        while True:
+            next_worker_id = self._get_next_worker_id()
+            if next_worker_id is None:
+                self._credits_available.clear()
+                idle_start = timer()
+                await self._credits_available.wait()
+                self.idle_stats['idle'] += timer() - idle_start
+                self.idle_stats['waits'] += 1
+                continue
+            batch_len = min(self.batch_size, self._scheduler.free_credits(next_worker_id))
+            batch = list(itertools.islice(itertools.takewhile(bool, jobs), batch_len))
+            if not batch:
+                if self.stop_event.is_set():
+                    return  # Job pipeline stopped
+                # Starved until results of jobs in flight come back, let the receiver process them
+                await asyncio.sleep(STARVED_WAIT)
+                continue
+            self._dispatch(next_worker_id, batch)
+            # Let the receiver process results which arrived meanwhile
+            await asyncio.sleep(0)
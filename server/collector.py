@@ -4,9 +4,23 @@ Collector service provides methods for collection of test runtime results result
 2017 - samuels(c)
 """
 import time
+import timeit
 
 from logger import server_logger
 
+timer = timeit.default_timer
+
+OLDEST_WORKERS_REPORTED = 5
+
+
+def oldest_age(work, now):
+    """Seconds since the oldest job a worker has in flight was dispatched, 0 when idle.
+
+    work is the worker's job_id -> Job dict, jobs are added as they're dispatched so the first one is the oldest.
+    """
+    jobs = list(work.values())  # Copied in one go, the dispatch loop keeps changing the dict
+    return now - jobs[0].dispatched if jobs else 0.0
+
 
 class Collector:
     def __init__(self, test_stats, dir_tree, stop_event, **kwargs):
@@ -19,6 +33,11 @@ class Collector:
     def run(self):
         time.sleep(60)
         while not self.stop_event.is_set():
+            shard_stats = self.kwargs.get('shard_stats')
+            if shard_stats is not None:
+                # Snapshot for the merged view of the shard router
+                shard_stats[self.kwargs['shard'][0]] = {k: dict(v) if isinstance(v, dict) else v
+                                                        for k, v in self.test_stats.items()}
             self.logger.info("{0}".format("############################"))
             self.logger.info("{0}".format("#### Test Runtime Stats ####"))
             self.logger.info("{0}".format("############################"))
@@ -38,13 +57,36 @@ class Collector:
             self.logger.info("{0}".format("############################"))
             self.logger.info("{0}".format("#### Dir Tree Stats     ####"))
             self.logger.info("{0}".format("############################"))
-            self.logger.info("NIDs: {} SYNCED_DIRS: {}".format(len(self.dir_tree.nids),
-                                                               len(self.dir_tree.synced_nodes)))
+            self.logger.info("NIDs: {} SYNCED_DIRS: {} FULL_DIRS: {} RETIRED_DIRS: {}".format(
+                len(self.dir_tree.nids), len(self.dir_tree.synced_nodes), len(self.dir_tree.full_nodes),
+                len(self.dir_tree.retired)))
+            if self.dir_tree.memory_budget:
+                self.logger.info(f"Dir tree memory: {self.dir_tree.memory_used() / 2 ** 20:.1f} of "
+                                 f"{self.dir_tree.memory_budget / 2 ** 20:.1f} MB budget")
             self.logger.info(f"Incoming messages queue: {self.kwargs.get('in_queue').qsize()}")
             self.logger.info(f"Outgoing messages queue: {self.kwargs.get('out_queue').qsize()}")
             self.logger.info(f"Total workers: {len(self.kwargs.get('workers', {}))}")
             total_work = 0
-            for worker_id, work in self.kwargs.get('workers', {}).items():
+            now = timer()
+            in_flight = []
+            for worker_id, work in list(self.kwargs.get('workers', {}).items()):
                 total_work += len(work)
+                in_flight.append((oldest_age(work, now), len(work), worker_id))
             self.logger.info(f"Total work items: {total_work}")
+            # Workers stuck on the same jobs for long usually mean a hung mount on that client
+            for age, depth, worker_id in sorted(in_flight, reverse=True)[:OLDEST_WORKERS_REPORTED]:
+                self.logger.info(f"[{worker_id}]: {depth} jobs in flight, oldest dispatched {age:.1f}s ago")
+            job_pipeline = self.kwargs.get('job_pipeline')
+            if job_pipeline and job_pipeline.depth:
+                self.logger.info(f"Job pipeline: {len(job_pipeline)}/{job_pipeline.depth} jobs buffered, "
+                                 f"{job_pipeline.stats['produced']} produced, "
+                                 f"producer stalled {job_pipeline.stats['stalled']:.1f}s on full buffer, "
+                                 f"dispatch waited {job_pipeline.stats['starved']:.1f}s on empty buffer")
+            idle_stats = self.kwargs.get('idle_stats')
+            if idle_stats and idle_stats['started']:
+                elapsed = timer() - idle_stats['started']
+                idle = idle_stats['idle']
+                self.logger.info(f"Controller busy: {elapsed - idle:.1f}s idle: {idle:.1f}s "
+                                 f"({100 * idle / elapsed:.1f}% idle, waited for free workers "
+                                 f"{idle_stats['waits']} times)")
             time.sleep(60)
@@ -137,7 +137,7 @@ class Controller(object):
         """
         formatted_message = helpers.message_to_pretty_string(incoming_message)
         self.logger.info('[{0}]: finished {1}, result: {2}'.format(worker_id, job.id, formatted_message))
-        response_action(self.logger, incoming_message, self.dir_tree)
+        response_action(self.logger, incoming_message, self.dir_tree, job.work['target'])
 
     def run(self):
         try:
@@ -1,9 +1,30 @@
+import datetime
+
 __author__ = "samuels"
 
 """
 Controller helper methods
 """
 
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def timestamp_ns(time_stamp):
+    """
+    Client timestamps are UTC, either formatted strings (json codec) or nanoseconds since the epoch (binary codecs).
+    Returns them as nanoseconds since the epoch, the representation the expected state model keeps
+
+    Args:
+        time_stamp: str|int
+
+    Returns:
+        int
+    """
+    if isinstance(time_stamp, int):
+        return time_stamp
+    return (datetime.datetime.strptime(time_stamp, '%Y/%m/%d %H:%M:%S.%f') - EPOCH) // ONE_MICROSECOND * 1000
+
 
 def message_to_pretty_string(incoming_message):
     """
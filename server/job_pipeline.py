@@ -0,0 +1,129 @@
+"""
+Job pipeline, pre-generates controller jobs into a bounded lookahead buffer so the dispatch loop only pops them
+2016 samuels (c)
+"""
+import queue
+import timeit
+from threading import Thread
+
+from server.sampler import SAMPLE_CHUNK
+
+__author__ = 'samuels'
+
+timer = timeit.default_timer
+
+POLL_INTERVAL = 1  # Seconds, how often a blocked producer checks stop_event
+STARVED_WAIT = 0.01  # Seconds a starved producer or consumer waits before looking for work again
+
+
+class JobPipeline(object):
+    """Producer stage of the controller.
+
+    A producer thread draws actions and io types SAMPLE_CHUNK at a time from their samplers, builds jobs with
+    make_job() and puts them into a buffer of up to depth jobs. With depth 0 there's no producer thread and jobs
+    are built inline by the consumer, still with chunked sampling.
+
+    The model may have nothing to work on until results of jobs already in flight come back, e.g. every directory
+    the tree has room for is still waiting for its mkdir. The consumer is the one processing those results, so
+    instead of blocking it the pipeline hands out None right away while it's starved.
+    """
+
+    def __init__(self, make_job, actions, io_types, stop_event, logger, depth):
+        """
+        Args:
+            make_job: callable (action, io_type) -> Job or None
+            actions: WeightedSampler
+            io_types: WeightedSampler
+            stop_event: Event
+            logger: Logger
+            depth: int
+        """
+        self._make_job = make_job
+        self.actions = actions
+        self.io_types = io_types
+        self.stop_event = stop_event
+        self.logger = logger
+        self.depth = depth
+        self._buffer = queue.Queue(maxsize=depth)
+        # stalled: seconds the producer waited on a full buffer
+        # starved: seconds the consumer waited on an empty buffer
+        self.stats = {'produced': 0, 'stalled': 0.0, 'starved': 0.0}
+        self._starved_since = None
+        self._producer = Thread(target=self._produce, name='job_pipeline', daemon=True)
+
+    def __len__(self):
+        return self._buffer.qsize()
+
+    def sample(self, k=SAMPLE_CHUNK):
+        return zip(self.actions.sample(k), self.io_types.sample(k))
+
+    def generate(self):
+        """Yields jobs, and None after a whole chunk of samples that built no job"""
+        while not self.stop_event.is_set():
+            built = False
+            for action, io_type in self.sample():
+                job = self._make_job(action, io_type)
+                if job:
+                    built = True
+                    yield job
+            if not built:
+                yield None
+
+    def jobs(self):
+        """Iterator over jobs, None when there's no job ready. Ends once stop_event is set"""
+        if not self.depth:
+            return self.generate()
+        if not self._producer.is_alive():
+            self._producer.start()
+        return self._consume()
+
+    def _consume(self):
+        while not self.stop_event.is_set():
+            yield self.get()
+
+    def get(self):
+        """Next job of the buffer, None if it's empty. Never blocks, the time from the first None to the next job
+        counts as starved
+        """
+        try:
+            job = self._buffer.get_nowait()
+        except queue.Empty:
+            job = None
+        if job is None or self._starved_since is not None:
+            now = timer()
+            if self._starved_since is not None:
+                self.stats['starved'] += now - self._starved_since
+            self._starved_since = now if job is None else None
+        return job
+
+    def _put(self, job):
+        try:
+            self._buffer.put_nowait(job)
+            return True
+        except queue.Full:
+            pass
+        start = timer()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self._buffer.put(job, timeout=POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.stats['stalled'] += timer() - start
+
+    def _produce(self):
+        try:
+            for job in self.generate():
+                if job is None:
+                    # Nothing to do until results come back
+                    self.stop_event.wait(STARVED_WAIT)
+                    continue
+                if not self._put(job):
+                    break
+                self.stats['produced'] += 1
+        except Exception as generic_error:
+            self.logger.exception(generic_error)
+            self.stop_event.set()
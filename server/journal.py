@@ -1,10 +1,12 @@
 """
 Append-only operation journal for reproducibility.
 Each dispatched job is written as a single JSON line.
+Job ids restart on every run, (session, job_id) identifies a job across runs.
 """
 import json
 import os
 import time
+import uuid
 
 
 class OperationJournal:
@@ -13,14 +15,20 @@ class OperationJournal:
         ts = time.strftime("%Y-%m-%d_%H%M%S")
         self._path = os.path.join(output_dir, f"journal_{ts}.jsonl")
         self._fh = open(self._path, "a")
+        self._session = uuid.uuid4().hex
 
     @property
     def path(self):
         return self._path
 
+    @property
+    def session(self):
+        return self._session
+
     def record(self, job_id, action, data):
         entry = {
             "ts": time.strftime("%Y/%m/%d %H:%M:%S"),
+            "session": self._session,
             "job_id": job_id,
             "action": action,
             "data": data,
@@ -0,0 +1,110 @@
+"""
+Namespace pre-population, builds the directories and files of the target namespace before the measured phase
+2016 samuels (c)
+"""
+import itertools
+import timeit
+
+__author__ = 'samuels'
+
+timer = timeit.default_timer
+
+DEFAULT_CHUNK_FILES = 1000  # File names shipped in a single populate job
+
+
+class Prepopulation(object):
+    """Pre-population phase of the controller.
+
+    Directories are created with append_node() so they follow the layout of the tree, and the files of each one
+    are split into populate jobs of up to chunk_files names. A client creates the directory, if it isn't there yet,
+    and all the files of its job, and reports them back in a single result, which loads them into the model in one
+    pass. Chunks of a directory go to whichever workers are free, so a directory is created on the filer by as many
+    workers in parallel as it has chunks.
+
+    Subdirectories can only be created once their parent is on disk, so while everything the layout has room for
+    is still in flight jobs() hands out None, like the job pipeline does when it's starved.
+    """
+
+    def __init__(self, dir_tree, dirs, files_per_dir, new_job, stop_event, logger, chunk_files=DEFAULT_CHUNK_FILES):
+        """
+        Args:
+            dir_tree: DirTree
+            dirs: int, directories to create
+            files_per_dir: int, files to create in each directory
+            new_job: callable (action, request data) -> Job
+            stop_event: Event
+            logger: Logger
+            chunk_files: int, max file names per populate job
+        """
+        if dirs < 0 or files_per_dir < 0 or chunk_files < 1:
+            raise ValueError(f"Bad pre-population settings. Got dirs {dirs}, files_per_dir {files_per_dir} and "
+                             f"chunk_files {chunk_files}, 0 or more and a positive chunk_files are expected")
+        self.dir_tree = dir_tree
+        self.dirs = dirs
+        self.files_per_dir = files_per_dir
+        self.chunk_files = chunk_files
+        self._new_job = new_job
+        self.stop_event = stop_event
+        self.logger = logger
+        self.pending = 0  # Populate jobs dispatched and not completed yet
+        self._chunks_left = {}  # nid -> populate jobs of the directory not completed yet
+        self.stats = {'dirs': 0, 'files': 0, 'failed': 0, 'duration': 0.0}
+
+    def jobs(self):
+        """Iterator over populate jobs, None while waiting for results. Ends once all the jobs completed"""
+        start = timer()
+        created = 0
+        while not self.stop_event.is_set():
+            if created < self.dirs:
+                node = self.dir_tree.append_node()
+                if node is not None:
+                    # Created by its populate jobs, mkdir jobs of the measured phase don't get it
+                    self.dir_tree.remove_nid(node.identifier)
+                    created += 1
+                    self._chunks_left[node.identifier] = max(1, -(-self.files_per_dir // self.chunk_files))
+                    for chunk in self._chunks():
+                        self.pending += 1
+                        yield self._new_job('populate', {'target': node.tag, 'dir_id': node.identifier,
+                                                         'files': chunk})
+                    continue
+            if not self.pending:
+                if created < self.dirs:
+                    self.logger.warning(f"Pre-population stopped at {created} of {self.dirs} directories, "
+                                        f"the directory tree layout or memory budget has no room for more")
+                break
+            yield None
+        self.stats['duration'] = timer() - start
+        self.logger.info(f"Pre-populated {self.stats['dirs']} directories and {self.stats['files']} files in "
+                         f"{self.stats['duration']:.1f} seconds, {self.stats['failed']} failed")
+
+    def _chunks(self):
+        """File names of a new directory, chunk_files at a time. A directory without files still gets a job"""
+        names = self.dir_tree.file_names
+        remaining = self.files_per_dir
+        while True:
+            chunk_len = min(remaining, self.chunk_files)
+            yield list(itertools.islice(names, chunk_len))
+            remaining -= chunk_len
+            if remaining <= 0:
+                break
+
+    def job_done(self, request, incoming_message):
+        """Account for a completed populate job, the model itself is updated by its response action. A directory
+        none of whose jobs succeeded is dropped, so it doesn't hold a slot of its parent and memory budget for good
+        """
+        self.pending -= 1
+        nid = request['dir_id']
+        self._chunks_left[nid] -= 1
+        if not self._chunks_left[nid]:
+            del self._chunks_left[nid]
+            if self.dir_tree.dir_state(nid) is None and self.dir_tree.remove_dir(nid):
+                self.logger.warning(f"Pre-population FAILED to create directory {request['target']}, "
+                                    f"removed it from the dir tree")
+        if incoming_message['result'] != 'success':
+            self.stats['failed'] += len(request['files'])
+            return
+        failed = len(incoming_message['data']['failed'])
+        self.stats['files'] += len(request['files']) - failed
+        self.stats['failed'] += failed
+        if incoming_message['data']['mkdir']:
+            self.stats['dirs'] += 1
@@ -1,12 +1,10 @@
 import os
 
-from utils import shell_utils
-
 __author__ = "samuels"
 
 
 def request_action(action, logger, dir_tree, **kwargs):
-    return {
+    data = {
         "mkdir": mkdir_request,
         "list": list_request,
         "delete": delete_request,
@@ -16,23 +14,29 @@ def request_action(action, logger, dir_tree, **kwargs):
         "write": write_request,
         "rename": rename_request,
         "rename_exist": rename_exist_request,
-        "truncate": truncate_request
+        "truncate": truncate_request,
+        "read_direct": read_request,
+        "write_direct": write_request
     }[action](logger, dir_tree, **kwargs)
+    # Requests on a file bump its tid, touch adds one
+    if data and 'file_id' in data:
+        dir_tree.mark_dirty(data['dir_id'])
+    return data
 
 
 def mkdir_request(logger, dir_tree, **kwargs):
     data = {}
     target = 'None'
-    if len(dir_tree.synced_nodes) > 10 or len(dir_tree.nids) > 10:
+    # New directories only go under directories which are already on disk, and
+    # there's none to create once the tree reached its configured depth and width
+    if not dir_tree.append_node():
         return None
-    logger.debug(f"DEBUG NIDS: {dir_tree.nids}")
-    logger.debug(f"DEBUG SYNCED_DIRS: {dir_tree.synced_nodes}")
-    dir_tree.append_node()
     logger.debug(
         f"Controller: New dir appended to list {dir_tree.get_last_node_tag()}")
     target_dir = dir_tree.get_random_dir_not_synced()
     if target_dir:
-        target = target_dir.data.name
+        target = target_dir.tag
+        data['dir_id'] = target_dir.identifier
         logger.debug(
             f"Controller: Dir {target} current size is {dir_tree.get_last_node_data().size}")
     data['target'] = target
@@ -41,11 +45,12 @@ def mkdir_request(logger, dir_tree, **kwargs):
 
 def list_request(logger, dir_tree, **kwargs):
     data = {}
-    rdir = dir_tree.get_random_dir_synced()
+    rdir = dir_tree.get_random_dir_readable()
     if not rdir:
         return None
-    target = rdir.data.name
+    target = rdir.tag
     data['target'] = "/".join(['', target])
+    data['dir_id'] = rdir.identifier
     return data
 
 
@@ -54,15 +59,18 @@ def delete_request(logger, dir_tree, **kwargs):
     rdir = dir_tree.get_random_dir_synced()
     if not rdir:
         return None
-    file_to_delete = rdir.data.get_random_file()
-    if not file_to_delete:
+    item = rdir.data.get_random_file_item()
+    if not item:
         return None
+    file_id, file_to_delete = item
     fname = file_to_delete.name
     target = "/".join(['', rdir.tag, fname])
     uuid = file_to_delete.uuid
     file_to_delete.tid += 1
     data['tid'] = file_to_delete.tid
     data['target'] = target
+    data['dir_id'] = rdir.identifier
+    data['file_id'] = file_id
     data['uuid'] = uuid
     return data
 
@@ -72,43 +80,51 @@ def touch_request(logger, dir_tree, **kwargs):
     rdir = dir_tree.get_random_dir_synced()
     if not rdir:
         return None
-    fname = rdir.data.touch()
-    target = "/".join(['', rdir.tag, fname])
+    file_id, new_file = rdir.data.new_file()
+    target = "/".join(['', rdir.tag, new_file.name])
     data['target'] = target
+    data['dir_id'] = rdir.identifier
+    data['file_id'] = file_id
     return data
 
 
 def stat_request(logger, dir_tree, **kwargs):
     data = {}
-    rdir = dir_tree.get_random_dir_synced()
+    rdir = dir_tree.get_random_dir_readable()
     if not rdir:
         return None
-    rfile = rdir.data.get_random_file()
-    if not rfile:
+    item = rdir.data.get_random_file_item()
+    if not item:
         return None
+    file_id, rfile = item
     fname = rfile.name
     target = "/".join(['', rdir.tag, fname])
     uuid = rfile.uuid
     rfile.tid += 1
     data['tid'] = rfile.tid
     data['target'] = target
+    data['dir_id'] = rdir.identifier
+    data['file_id'] = file_id
     data['uuid'] = uuid
     return data
 
 
 def read_request(logger, dir_tree, **kwargs):
     data = {}
-    rdir = dir_tree.get_random_dir_synced()
+    rdir = dir_tree.get_random_dir_readable()
     if not rdir:
         return None
-    rfile = rdir.data.get_random_file()
-    if not rfile:
+    item = rdir.data.get_random_file_item()
+    if not item:
         return None
+    file_id, rfile = item
     fname = rfile.name
     target = "/".join(['', rdir.tag, fname])
     rfile.tid += 1
     data['tid'] = rfile.tid
     data['target'] = target
+    data['dir_id'] = rdir.identifier
+    data['file_id'] = file_id
     data['data_pattern'] = rfile.data_pattern
     data['repeats'] = rfile.data_pattern_len
     data['hash'] = rfile.data_pattern_hash
@@ -122,14 +138,17 @@ def write_request(logger, dir_tree, **kwargs):
     wdir = dir_tree.get_random_dir_synced()
     if not wdir:
         return None
-    wfile = wdir.data.get_random_file()
-    if not wfile:
+    item = wdir.data.get_random_file_item()
+    if not item:
         return None
+    file_id, wfile = item
     fname = wfile.name
     target = "/".join(['', wdir.tag, fname])
     wfile.tid += 1
     data['tid'] = wfile.tid
     data['target'] = target
+    data['dir_id'] = wdir.identifier
+    data['file_id'] = file_id
     data['offset'] = wfile.data_pattern_offset
     data['data_pattern_len'] = wfile.data_pattern_len
     data['io_type'] = kwargs['io_type']
@@ -142,17 +161,20 @@ def rename_request(logger, dir_tree, **kwargs):
     rdir = dir_tree.get_random_dir_synced()
     if not rdir:
         return None
-    file_to_rename = rdir.data.get_random_file()
-    if not file_to_rename:
+    item = rdir.data.get_random_file_item()
+    if not item:
         return None
+    file_id, file_to_rename = item
     fname = file_to_rename.name
     target = "/".join(['', rdir.tag, fname])
     uuid = file_to_rename.uuid
     file_to_rename.tid += 1
     data['tid'] = file_to_rename.tid
     data['target'] = target
+    data['dir_id'] = rdir.identifier
+    data['file_id'] = file_id
     data['uuid'] = uuid
-    data['rename_dest'] = shell_utils.StringUtils.get_random_string_nospec(64)
+    data['rename_dest'] = next(dir_tree.names)
     return data
 
 
@@ -162,10 +184,12 @@ def rename_exist_request(logger, dir_tree, **kwargs):
     rdir_dst = dir_tree.get_random_dir_synced()
     if not rdir_src or not rdir_dst:
         return None
-    src_file_to_rename = rdir_src.data.get_random_file()
-    dst_file = rdir_src.data.get_random_file()
-    if not src_file_to_rename or not dst_file:
+    src_item = rdir_src.data.get_random_file_item()
+    dst_item = rdir_dst.data.get_random_file_item()
+    if not src_item or not dst_item:
         return None
+    file_id, src_file_to_rename = src_item
+    dst_file_id, dst_file = dst_item
     src_fname = src_file_to_rename.name
     dst_fname = dst_file.name
     target = "/".join(['', rdir_src.tag, src_fname])
@@ -174,6 +198,10 @@ def rename_exist_request(logger, dir_tree, **kwargs):
     src_file_to_rename.tid += 1
     data['tid'] = src_file_to_rename.tid
     data['target'] = target
+    data['dir_id'] = rdir_src.identifier
+    data['file_id'] = file_id
+    data['dst_dir_id'] = rdir_dst.identifier
+    data['dst_file_id'] = dst_file_id
     data['uuid'] = uuid
     data['rename_source'] = target
     return data
@@ -184,14 +212,17 @@ def truncate_request(logger, dir_tree, **kwargs):
     tdir = dir_tree.get_random_dir_synced()
     if not tdir:
         return None
-    file_to_truncate = tdir.data.get_random_file()
-    if not file_to_truncate:
+    item = tdir.data.get_random_file_item()
+    if not item:
         return None
+    file_id, file_to_truncate = item
     fname = file_to_truncate.name
     target = "/".join(['', tdir.tag, fname])
     uuid = file_to_truncate.uuid
     file_to_truncate.tid += 1
     data['tid'] = file_to_truncate.tid
     data['target'] = target
+    data['dir_id'] = tdir.identifier
+    data['file_id'] = file_id
     data['uuid'] = uuid
     return data
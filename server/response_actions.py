@@ -1,31 +1,29 @@
 import os
 
-import datetime
-import xxhash
-
 import errno
-import uuid
-
-from treelib.tree import NodeIDAbsentError
 
-from config import error_codes, MAX_FILES_PER_DIR
+from config import error_codes
+from server.helpers import timestamp_ns
+from tree.dirtree import EMPTY_HASH, File, file_id, new_file_uuid
 
 __author__ = "samuels"
 
 
-def generic_error_handler(logger, incoming_message):
+def failed_target(incoming_message, request):
+    """Failure messages carry the path on the client, <mount point>/<target>, and mount points may have any number
+    of levels. Strip the mount point off it, it's whatever comes before the target of the job.
+    """
+    path = incoming_message['target']
+    target = request.get('target')
+    return target if target and path.endswith(target) else path
+
+
+def generic_error_handler(logger, incoming_message, request):
     """Log an unexpected error. Returns True to signal a critical failure."""
-    rdir_name = incoming_message['target'].split('/')[3]
-    try:
-        rfile_name = incoming_message['target'].split('/')[4]
-    except IndexError:
-        logger.error(
-            f"Operation {incoming_message['action']} FAILED UNEXPECTEDLY "
-            f"on Directory {rdir_name} due to {incoming_message['error_message']}")
-    else:
-        logger.error(
-            f"Operation {incoming_message['action']} FAILED UNEXPECTEDLY "
-            f"on File {rdir_name}/{rfile_name} due to {incoming_message['error_message']}")
+    kind = 'Directory' if incoming_message['action'] in ('mkdir', 'populate', 'list') else 'File'
+    logger.error(
+        f"Operation {incoming_message['action']} FAILED UNEXPECTEDLY "
+        f"on {kind} {failed_target(incoming_message, request)} due to {incoming_message['error_message']}")
     return True
 
 
@@ -34,15 +32,30 @@ Response action methods which will be called on arrived client message
 """
 
 
-def response_action(logger, incoming_message, dir_tree):
+def response_action(logger, incoming_message, dir_tree, request):
     """Process a client response message. Returns True if a critical
     (unexpected) error was detected -- used by strict mode to stop the test.
+
+    request is the data of the job the response is for, its dir_id and file_id
+    address the directory and file without hashing the target path again.
     """
     if incoming_message['result'] == 'success':
-        success_response_actions(incoming_message['action'])(logger, incoming_message, dir_tree)
-        return False
+        success_response_actions(incoming_message['action'])(logger, incoming_message, dir_tree, request)
+        critical = False
     else:
-        return failed_response_actions(incoming_message['action'])(logger, incoming_message, dir_tree)
+        critical = failed_response_actions(incoming_message['action'])(logger, incoming_message, dir_tree, request)
+    _mark_dirty(dir_tree, request)
+    return critical
+
+
+def _mark_dirty(dir_tree, request):
+    """Mark the directories the result was applied to for the next snapshot, after the changes are done"""
+    if not request:
+        return
+    if 'dir_id' in request:
+        dir_tree.mark_dirty(request['dir_id'])
+    if 'dst_dir_id' in request:
+        dir_tree.mark_dirty(request['dst_dir_id'])
 
 
 def success_response_actions(action):
@@ -56,6 +69,7 @@ def success_response_actions(action):
     """
     return {
         'mkdir': mkdir_success,
+        'populate': populate_success,
         'touch': touch_success,
         'list': list_success,
         'stat': stat_success,
@@ -64,108 +78,133 @@ def success_response_actions(action):
         'delete': delete_success,
         'rename': rename_success,
         'rename_exist': rename_exist_success,
-        'truncate': truncate_success
+        'truncate': truncate_success,
+        'read_direct': read_success,
+        'write_direct': write_success
     }[action]
 
 
-def mkdir_success(logger, incoming_message, dir_tree):
-    syncdir = dir_tree.get_dir_by_name(incoming_message['target'])
+def mkdir_success(logger, incoming_message, dir_tree, request):
+    syncdir = dir_tree.get_dir(request['dir_id'])
     syncdir.data.size = int(incoming_message['data']['dirsize'])
     syncdir.data.ondisk = True
-    syncdir.creation_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                       '%Y/%m/%d %H:%M:%S.%f')
-    dir_hash = xxhash.xxh64(syncdir.data.name).hexdigest()
-    dir_tree.add_synced_node(dir_hash, syncdir.data.name)
+    syncdir.creation_time = timestamp_ns(incoming_message['timestamp'])
+    dir_tree.add_synced_node(syncdir.identifier, syncdir.tag)
     logger.debug(
         f"Directory {syncdir.data.name} was created at: {syncdir.creation_time}")
     logger.debug(
         f"Directory {syncdir.data.name} is synced. Size is {int(incoming_message['data']['dirsize'])} bytes")
 
 
-def touch_success(logger, incoming_message, dir_tree):
-    logger.debug(f"Successful touch arrived {incoming_message['target']}")
-    path = incoming_message['target'].split('/')[1:]  # folder:file
-    syncdir = dir_tree.get_dir_by_name(path[0])
-    dir_index = xxhash.xxh64(path[0]).hexdigest()
+def touch_success(logger, incoming_message, dir_tree, request):
+    target = incoming_message['target']
+    logger.debug(f"Successful touch arrived {target}")
+    dir_index = request['dir_id']
+    syncdir = dir_tree.get_dir(dir_index)
     if not syncdir:
         logger.debug(
-            f"Directory {path[0]} already removed from active dirs list, dropping touch {path[1]}")
+            f"Directory of {target} already removed from active dirs list, dropping touch")
         return
     # There might be a raise when successful mkdir message will arrive after successful touch message
     # So we won't check here if dir is already synced
 
-    f = syncdir.data.get_file_by_name(path[1])
+    f = syncdir.data.get_file(request['file_id'])
     #  Now, when we got reply from client that file was created,
     #  we can mark it as synced
     syncdir.data.size += 1
-    f.ondisk = True
-    f.creation_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                 '%Y/%m/%d %H:%M:%S.%f')
-    f.uuid = uuid.uuid4().hex[-5:]  # Unique session ID, will be modified on each file modify action
-    logger.debug(
-        f"File {path[0]}/{path[1]} was created at: {f.creation_time}")
-    logger.debug(
-        f"File {path[0]}/{path[1]} is synced. Directory size updated to {syncdir.data.size} bytes")
-    if syncdir.data.size > MAX_FILES_PER_DIR:
-        try:
-            logger.debug(f"Directory {path[0]} going to be removed from dir tree")
-            dir_tree.remove_dir_by_name(path[0])
-            dir_tree.remove_synced_node(dir_index)
-            dir_tree.remove_nid(dir_index)
-            logger.debug(
-                f"Directory {path[0]} is reached its size limit and removed from active dirs list")
-        except (NodeIDAbsentError, KeyError):
-            logger.debug(
-                f"Directory {path[0]} already removed from active dirs list, skipping....")
-
-
-def list_success(logger, incoming_message, dir_tree):
+    if f.creation_time:
+        # Results of different workers arrive in any order, a delete or rename of the file came first
+        logger.debug(f"File {target} was already deleted or renamed, leaving it off disk")
+    else:
+        f.ondisk = True
+        f.creation_time = timestamp_ns(incoming_message['timestamp'])
+        f.uuid = new_file_uuid()  # Unique session ID, will be modified on each file modify action
+        logger.debug(
+            f"File {target} was created at: {f.creation_time}")
+        logger.debug(
+            f"File {target} is synced. Directory size updated to {syncdir.data.size} bytes")
+    if syncdir.data.size > dir_tree.max_files_per_dir and dir_tree.mark_full(dir_index):
+        logger.debug(
+            f"Directory {syncdir.tag} is reached its size limit and is read-only from now on")
+
+
+def populate_success(logger, incoming_message, dir_tree, request):
+    """A chunk of a pre-populated directory is on disk, load its files into the model in one pass"""
+    dir_index = request['dir_id']
+    popdir = dir_tree.get_node(dir_index)
+    if not popdir:
+        logger.debug(f"Directory {incoming_message['target']} already removed from dir tree, dropping populate")
+        return
+    created = timestamp_ns(incoming_message['timestamp'])
+    if not popdir.data.ondisk:
+        popdir.data.ondisk = True
+        popdir.creation_time = created
+        dir_tree.add_synced_node(dir_index, popdir.tag)
+    failed = incoming_message['data']['failed']
+    for name, error_code in failed:
+        logger.error(f"Populate FAILED to create file {popdir.tag}/{name} due to {os.strerror(error_code)}")
+    failed_names = {name for name, _ in failed}
+    files = []
+    for name in request['files']:
+        if name in failed_names:
+            continue
+        f = File(name=name)
+        f.ondisk = True
+        f.creation_time = created
+        files.append(f)
+    dir_tree.load_files(dir_index, files)
+    logger.debug(f"Directory {popdir.tag} is populated with {len(files)} more files, {popdir.data.size} in total")
+    if popdir.data.size > dir_tree.max_files_per_dir and dir_tree.mark_full(dir_index):
+        logger.debug(
+            f"Directory {popdir.tag} is reached its size limit and is read-only from now on")
+
+
+def list_success(logger, incoming_message, dir_tree, request):
     pass
 
 
-def stat_success(logger, incoming_message, dir_tree):
+def stat_success(logger, incoming_message, dir_tree, request):
     pass
 
 
-def truncate_success(logger, incoming_message, dir_tree):
-    path = incoming_message['target'].split('/')[1:]  # folder:file
-    writedir = dir_tree.get_dir_by_name(path[0])
+def truncate_success(logger, incoming_message, dir_tree, request):
+    target = incoming_message['target']
+    writedir = dir_tree.get_dir(request['dir_id'])
     if not writedir:
         logger.debug(
-            f"Directory {path[0]} already removed from active dirs list, skipping....")
+            f"Directory of {target} already removed from active dirs list, skipping....")
     else:
-        logger.debug(f"Directory exists {writedir.data.name}, going to truncate file {path[1]}")
+        logger.debug(f"Directory exists {writedir.data.name}, going to truncate file {target}")
         if writedir.data.ondisk:
-            wfile = writedir.data.get_file_by_name(path[1])
+            wfile = writedir.data.get_file(request['file_id'])
             if wfile and wfile.ondisk:
-                logger.debug(f"File {path[0]}/{path[1]} is found, truncating")
-                wfile.modify_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                               '%Y/%m/%d %H:%M:%S.%f')
+                logger.debug(f"File {target} is found, truncating")
+                wfile.modify_time = timestamp_ns(incoming_message['timestamp'])
                 wfile.size = incoming_message['data']['size']
                 # recalculating the offset after truncate:
                 if wfile.data_pattern_offset + wfile.data_pattern_len >= wfile.size:
                     wfile.data_pattern_offset = wfile.size
-                    wfile.data_pattern_hash = 'ef46db3751d8e999'
+                    wfile.data_pattern_hash = EMPTY_HASH
                     wfile.data_pattern_len = 0
-                logger.debug(f"Truncating file {path[0]}/{path[1]} to {wfile.size} bytes")
+                logger.debug(f"Truncating file {target} to {wfile.size} bytes")
             else:
-                logger.debug(f"File {path[0]}/{path[1]} is not on disk, nothing to update")
+                logger.debug(f"File {target} is not on disk, nothing to update")
         else:
             logger.debug(f"Directory {writedir.data.name} is not on disk, nothing to update")
 
 
-def read_success(logger, incoming_message, dir_tree):
-    path = incoming_message['target'].split('/')[1:]  # folder:file
-    readdir = dir_tree.get_dir_by_name(path[0])
+def read_success(logger, incoming_message, dir_tree, request):
+    target = incoming_message['target']
+    readdir = dir_tree.get_dir(request['dir_id'])
     if not readdir:
         logger.debug(
-            f"Directory {path[0]} already removed from active dirs list, skipping....")
+            f"Directory of {target} already removed from active dirs list, skipping....")
     else:
-        logger.debug(f"Directory exists {readdir.data.name}, going to check file {path[1]} integrity")
+        logger.debug(f"Directory exists {readdir.data.name}, going to check file {target} integrity")
         if readdir.data.ondisk:
-            rfile = readdir.data.get_file_by_name(path[1])
+            rfile = readdir.data.get_file(request['file_id'])
             if rfile and rfile.ondisk:
-                read_time = datetime.datetime.strptime(incoming_message['timestamp'], '%Y/%m/%d %H:%M:%S.%f')
+                read_time = timestamp_ns(incoming_message['timestamp'])
                 if rfile.data_pattern_hash != incoming_message['data']['hash'] and read_time < rfile.modify_time:
                     logger.error(
                         f"Hash mismatch on Read! File {rfile.name} - "
@@ -174,26 +213,25 @@ def read_success(logger, incoming_message, dir_tree):
                         f"offset: {incoming_message['data']['offset']} "
                         f"chunk size: {incoming_message['data']['chunk_size']} ")
             else:
-                logger.debug(f"File {path[0]}/{path[1]} is not on disk, nothing to update")
+                logger.debug(f"File {target} is not on disk, nothing to update")
         else:
             logger.debug(f"Directory {readdir.data.name} is not on disk, nothing to update")
 
 
-def write_success(logger, incoming_message, dir_tree):
-    path = incoming_message['target'].split('/')[1:]  # folder:file
-    writedir = dir_tree.get_dir_by_name(path[0])
+def write_success(logger, incoming_message, dir_tree, request):
+    target = incoming_message['target']
+    writedir = dir_tree.get_dir(request['dir_id'])
     if not writedir:
         logger.debug(
-            f"Directory {path[0]} already removed from active dirs list, skipping....")
+            f"Directory of {target} already removed from active dirs list, skipping....")
     else:
-        logger.debug(f"Directory exists {writedir.data.name}, going to update file {path[1]}")
+        logger.debug(f"Directory exists {writedir.data.name}, going to update file {target}")
         if writedir.data.ondisk:
-            wfile = writedir.data.get_file_by_name(path[1])
+            wfile = writedir.data.get_file(request['file_id'])
             if wfile and wfile.ondisk:
-                logger.debug(f"File {path[0]}/{path[1]} is found, writing")
+                logger.debug(f"File {target} is found, writing")
                 wfile.ondisk = True
-                wfile.modify_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                               '%Y/%m/%d %H:%M:%S.%f')
+                wfile.modify_time = timestamp_ns(incoming_message['timestamp'])
                 wfile.data_pattern = incoming_message['data']['data_pattern']
                 wfile.data_pattern_len = incoming_message['data']['chunk_size']
                 wfile.data_pattern_hash = incoming_message['data']['hash']
@@ -201,122 +239,153 @@ def write_success(logger, incoming_message, dir_tree):
                 # recalculating file size
                 if wfile.size < wfile.data_pattern_offset + wfile.data_pattern_len:
                     wfile.size = wfile.data_pattern_offset + wfile.data_pattern_len
-                logger.debug(f"Write to file {path[0]}/{path[1]} at {wfile.data_pattern_offset}")
-            # In case there is raise and write arrived before touch we'll sync the file here
-            elif wfile:
-                logger.debug(f"File {path[0]}/{path[1]} Write OP arrived before touch, syncing...")
+                logger.debug(f"Write to file {target} at {wfile.data_pattern_offset}")
+            # In case there is raise and write arrived before touch we'll sync the file here, unless it was
+            # deleted or renamed after the write
+            elif wfile and timestamp_ns(incoming_message['timestamp']) > wfile.creation_time:
+                logger.debug(f"File {target} Write OP arrived before touch, syncing...")
                 wfile.ondisk = True
                 wfile.data_pattern = incoming_message['data']['data_pattern']
                 wfile.data_pattern_len = incoming_message['data']['chunk_size']
                 wfile.data_pattern_hash = incoming_message['data']['hash']
                 wfile.data_pattern_offset = incoming_message['data']['offset']
-                wfile.creation_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                                 '%Y/%m/%d %H:%M:%S.%f')
+                wfile.creation_time = timestamp_ns(incoming_message['timestamp'])
                 wfile.modify_time = wfile.creation_time
                 # recalculating file size
                 if wfile.size < wfile.data_pattern_offset + wfile.data_pattern_len:
                     wfile.size = wfile.data_pattern_offset + wfile.data_pattern_len
-                logger.debug(f"Write to file {path[0]}/{path[1]} at {wfile.data_pattern_offset}")
+                logger.debug(f"Write to file {target} at {wfile.data_pattern_offset}")
             else:
-                logger.debug(f"File {path[0]}/{path[1]} is not on disk, nothing to update")
+                logger.debug(f"File {target} is not on disk, nothing to update")
         else:
             logger.debug(f"Directory {writedir.data.name} is not on disk, nothing to update")
 
 
-def delete_success(logger, incoming_message, dir_tree):
-    path = incoming_message['target'].split('/')[1:]  # folder:file
-    deldir = dir_tree.get_dir_by_name(path[0])
+def _removed(rfile, incoming_message):
+    """Book a successful delete or rename of the file, returns True if it took the file off disk.
+
+    Results of different workers are applied in any order, their client timestamps tell which came first on disk.
+    A removal older than the file hit the one a rename replaced with it, the file stays. Otherwise the removal
+    time is kept in creation_time, so a touch or a rename over the name which came before it but whose result
+    arrives after doesn't put the file back on disk.
+    """
+    rfile.removals_done += 1
+    removed = timestamp_ns(incoming_message['timestamp'])
+    if removed < rfile.creation_time:
+        return False
+    ondisk = rfile.ondisk
+    rfile.ondisk = False
+    rfile.creation_time = removed
+    return ondisk
+
+
+def _renamed_to(directory, source_id, dest_name, incoming_message):
+    """Book a successful rename of the file source_id to dest_name in directory, returns the renamed file.
+
+    If dest_name was removed after the rename on disk, by a result applied before this one, the renamed file went
+    with it and stays off disk.
+    """
+    created = timestamp_ns(incoming_message['timestamp'])
+    replaced = directory.get_file(file_id(dest_name))
+    renamed = directory.rename_file_id(source_id, dest_name)
+    if replaced is not None and not replaced.ondisk and replaced.creation_time > created:
+        renamed.creation_time = replaced.creation_time
+    else:
+        renamed.ondisk = True
+        renamed.creation_time = created
+    return renamed
+
+
+def delete_success(logger, incoming_message, dir_tree, request):
+    target = incoming_message['target']
+    deldir = dir_tree.get_dir(request['dir_id'])
     if not deldir:
         logger.debug(
-            f"Directory {path[0]} already removed from active dirs list, skipping....")
+            f"Directory of {target} already removed from active dirs list, skipping....")
     else:
-        logger.debug(f"Directory exists {deldir.data.name}, going to delete {path[1]}")
+        logger.debug(f"Directory exists {deldir.data.name}, going to delete {target}")
         if deldir.data.ondisk:
-            rfile = deldir.data.get_file_by_name(path[1])
-            if rfile and rfile.ondisk:
-                logger.debug(f"File {path[0]}/{path[1]} is found, removing")
-                rfile.ondisk = False
-                logger.debug(f"File {path[0]}/{path[1]} is removed form disk")
+            rfile = deldir.data.get_file(request['file_id'])
+            if rfile and _removed(rfile, incoming_message):
+                logger.debug(f"File {target} is removed form disk")
             else:
-                logger.debug(f"File {path[0]}/{path[1]} is not on disk, nothing to update")
+                logger.debug(f"File {target} is not on disk, nothing to update")
         else:
             logger.debug(f"Directory {deldir.data.name} is not on disk, nothing to update")
 
 
-def rename_success(logger, incoming_message, dir_tree):
-    path = incoming_message['target'].split('/')[1:]  # folder:file
-    rename_dir = dir_tree.get_dir_by_name(path[0])
+def rename_success(logger, incoming_message, dir_tree, request):
+    target = incoming_message['target']
+    rename_dir = dir_tree.get_dir(request['dir_id'])
     if not rename_dir:
         logger.debug(
-            f"Directory {path[0]} already removed from active dirs list, skipping....")
+            f"Directory of {target} already removed from active dirs list, skipping....")
         return
 
-    logger.debug(f"Directory exists {path[0]}, going to rename {path[1]}")
+    logger.debug(f"Directory exists {rename_dir.tag}, going to rename {target}")
     if rename_dir.data.ondisk:
-        rfile = rename_dir.data.get_file_by_name(path[1])
+        rfile = rename_dir.data.get_file(request['file_id'])
         if rfile:
-            logger.debug(f"File {path[0]}/{path[1]} is found, renaming")
-            rfile = rename_dir.data.rename_file(rfile.name, incoming_message['data']['rename_dest'])
-            rfile.ondisk = True
-            rfile.creation_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                             '%Y/%m/%d %H:%M:%S.%f')
-            logger.debug(f"File {path[0]}/{path[1]} is renamed to {rfile.name}")
+            logger.debug(f"File {target} is found, renaming")
+            replaced = not _removed(rfile, incoming_message) and rfile.ondisk
+            renamed = _renamed_to(rename_dir.data, request['file_id'], incoming_message['data']['rename_dest'],
+                                  incoming_message)
+            if replaced:
+                # The rename moved the file another rename later replaced with this one
+                rfile.ondisk = True
+            logger.debug(f"File {target} is renamed to {renamed.name}")
         else:
-            logger.debug(f"File {path[0]}/{path[1]} is not on disk, nothing to update")
+            logger.debug(f"File {target} is not on disk, nothing to update")
     else:
         logger.debug(
             f"Directory {rename_dir.data.name} is not on disk, nothing to update")
 
 
-def rename_exist_success(logger, incoming_message, dir_tree):
-    src_path = incoming_message['data']['rename_source'].split('/')[1:]  # folder:file
-    dst_path = incoming_message['data']['rename_dest'].split('/')[1:]  # folder:file
-    src_rename_dir = dir_tree.get_dir_by_name(src_path[0])
-    dst_rename_dir = dir_tree.get_dir_by_name(dst_path[0])
+def rename_exist_success(logger, incoming_message, dir_tree, request):
+    src_target = incoming_message['data']['rename_source']
+    dst_target = incoming_message['data']['rename_dest']
+    src_rename_dir = dir_tree.get_dir(request['dir_id'])
+    dst_rename_dir = dir_tree.get_dir(request['dst_dir_id'])
     if not src_rename_dir:
         logger.debug(
-            f"Source directory {src_path[0]} already removed from active dirs list, skipping....")
+            f"Source directory of {src_target} already removed from active dirs list, skipping....")
         return
     logger.debug(
-        f"Directory exists {src_path[0]}, going to delete renamed file {src_path[1]} from directory")
+        f"Directory exists {src_rename_dir.tag}, going to delete renamed file {src_target} from directory")
     #  Firs we delete the source file
     if src_rename_dir.data.ondisk:
-        file_to_delete = src_rename_dir.data.get_file_by_name(src_path[1])
-        if file_to_delete and file_to_delete.ondisk:
-            logger.debug(f"File {src_path[0]}/{src_path[1]} is found, removing")
-            file_to_delete.ondisk = False
-            logger.debug(f"File {src_path[0]}/{src_path[1]} is removed form disk")
+        file_to_delete = src_rename_dir.data.get_file(request['file_id'])
+        if file_to_delete and _removed(file_to_delete, incoming_message):
+            logger.debug(f"File {src_target} is removed form disk")
         else:
-            logger.debug(f"File {src_path[0]}/{src_path[1]} is not on disk, nothing to update")
+            logger.debug(f"File {src_target} is not on disk, nothing to update")
     else:
         logger.debug(
-            f"Directory {src_path[0]} is not on disk, nothing to update")
+            f"Directory {src_rename_dir.tag} is not on disk, nothing to update")
 
     # Actual rename of destination file
     if not dst_rename_dir:
         logger.debug(
-            f"Directory {dst_path[0]} already removed from active dirs list, skipping....")
+            f"Directory of {dst_target} already removed from active dirs list, skipping....")
         return
 
-    logger.debug(f"Directory exists {dst_path[0]}, going to rename {src_path[1]} to {dst_path[1]}")
+    logger.debug(f"Directory exists {dst_rename_dir.tag}, going to rename {src_target} to {dst_target}")
     if dst_rename_dir.data.ondisk:
-        file_to_rename = dst_rename_dir.data.get_file_by_name(dst_path[1])
+        file_to_rename = dst_rename_dir.data.get_file(request['dst_file_id'])
         if file_to_rename:
-            logger.debug(f"File {dst_path[0]}/{dst_path[1]} is found, renaming")
-            file_to_rename = dst_rename_dir.data.rename_file(file_to_rename.name, dst_path[1])
-            file_to_rename.ondisk = True
-            file_to_rename.creation_time = datetime.datetime.strptime(incoming_message['timestamp'],
-                                                                      '%Y/%m/%d %H:%M:%S.%f')
-            logger.debug(f"File {src_path[0]}/{src_path[1]} is renamed to {dst_path[1]}")
+            logger.debug(f"File {dst_target} is found, renaming")
+            _renamed_to(dst_rename_dir.data, request['dst_file_id'], file_to_rename.name, incoming_message)
+            logger.debug(f"File {src_target} is renamed to {dst_target}")
         else:
-            logger.debug(f"File {dst_path[0]}/{dst_path[1]} is not on disk, nothing to update")
+            logger.debug(f"File {dst_target} is not on disk, nothing to update")
     else:
         logger.debug(
-            f"Directory {dst_path[0]} is not on disk, nothing to update")
+            f"Directory {dst_rename_dir.tag} is not on disk, nothing to update")
 
 
 BENIGN_ERRORS = {
     'mkdir':        {error_codes.NO_TARGET, errno.EEXIST},
+    'populate':     {error_codes.NO_TARGET},
     'touch':        {error_codes.NO_TARGET, errno.EEXIST, error_codes.MAX_DIR_SIZE},
     'list':         {error_codes.NO_TARGET, errno.EEXIST, errno.ENOENT},
     'stat':         {error_codes.NO_TARGET, errno.EEXIST, errno.ESTALE},
@@ -326,52 +395,84 @@ BENIGN_ERRORS = {
     'rename':       {error_codes.NO_TARGET, errno.EEXIST, errno.ESTALE},
     'rename_exist': {error_codes.NO_TARGET, errno.EEXIST, errno.ESTALE, error_codes.SAMEFILE},
     'truncate':     {error_codes.NO_TARGET, errno.EEXIST, errno.ESTALE, errno.EAGAIN},
+    'read_direct':  {error_codes.NO_TARGET, errno.EEXIST, error_codes.ZERO_SIZE, errno.ESTALE},
+    'write_direct': {error_codes.NO_TARGET, errno.EEXIST, errno.ESTALE, errno.EAGAIN},
 }
 
 
-def _verify_enoent_file(logger, incoming_message, dir_tree):
+def _mkdir_failed(logger, dir_tree, request):
+    """Drop the directory of a failed mkdir, or it would take a slot of its parent and memory budget for good"""
+    nid = request.get('dir_id')
+    if nid is not None and dir_tree.dir_state(nid) is None and dir_tree.remove_dir(nid):
+        logger.debug(f"Directory {request['target']} was not created, removed it from the dir tree")
+
+
+REMOVALS = ('delete', 'rename', 'rename_exist')  # Jobs after which the file is gone from its path
+
+
+def job_dispatched(dir_tree, action, request):
+    """A delete or rename is in flight once it's sent to a worker, not while it waits in the lookahead buffer. Jobs
+    on its file failing with ENOENT from now on until its result is applied are expected to.
+    """
+    if action not in REMOVALS:
+        return
+    rdir = dir_tree.get_node(request['dir_id'])
+    rfile = rdir.data.get_file(request['file_id']) if rdir else None
+    if rfile:
+        rfile.removals_issued += 1
+
+
+def _removal_failed(dir_tree, request):
+    """A failed delete or rename is no longer in flight either, jobs failing with ENOENT later on are verified again"""
+    rdir = dir_tree.get_node(request['dir_id'])
+    rfile = rdir.data.get_file(request['file_id']) if rdir else None
+    if rfile:
+        rfile.removals_done += 1
+
+
+def _verify_enoent_file(logger, incoming_message, dir_tree, request):
     """Common ENOENT verification for file-level operations.
     Checks whether the file was expected on disk and invalidates if so.
     Returns True if the error was an unexpected verification failure.
-    """
-    rdir_name = incoming_message['target'].split('/')[3]
-    rfile_name = incoming_message['target'].split('/')[4]
 
-    rdir = dir_tree.get_dir_by_name(rdir_name)
+    Results of different workers, and of one worker through the incoming threads, are applied in any order. A job
+    can only fail with ENOENT because of a delete or rename after that was issued, so while one is in flight the
+    failure is expected. Once it's applied the file is no longer on disk in the model.
+    """
+    rdir = dir_tree.get_dir(request['dir_id'])
     if not rdir:
-        logger.debug(f"Result verify OK: Directory {rdir_name} is not on disk")
+        logger.debug(f"Result verify OK: Directory of {failed_target(incoming_message, request)} is not on disk")
         return False
 
-    rfile = rdir.data.get_file_by_name(rfile_name)
-    if rfile and rfile.ondisk:
-        error_time = datetime.datetime.strptime(incoming_message['timestamp'], '%Y/%m/%d %H:%M:%S.%f')
+    rfile = rdir.data.get_file(request['file_id'])
+    if rfile and rfile.ondisk and rfile.removal_in_flight():
+        logger.debug(f"Result verify OK: File {failed_target(incoming_message, request)} is being deleted or renamed")
+    elif rfile and rfile.ondisk:
+        error_time = timestamp_ns(incoming_message['timestamp'])
         if error_time > rfile.creation_time:
             logger.error(
                 f"Result Verify FAILED: Operation {incoming_message['action']} "
-                f"failed on file {rdir_name}/{rfile_name} which is on disk. Invalidating")
+                f"failed on file {failed_target(incoming_message, request)} which is on disk. Invalidating")
             rfile.ondisk = False
             return True
     else:
-        logger.debug(f"Result verify OK: File {rfile_name} is not on disk")
+        logger.debug(f"Result verify OK: File {failed_target(incoming_message, request)} is not on disk")
     return False
 
 
-def _verify_enoent_touch(logger, incoming_message, dir_tree):
+def _verify_enoent_touch(logger, incoming_message, dir_tree, request):
     """ENOENT verification for touch -- checks directory level only since
     touch creates a new file."""
-    rdir_name = incoming_message['target'].split('/')[3]
-    rfile_name = incoming_message['target'].split('/')[4]
-
-    rdir = dir_tree.get_dir_by_name(rdir_name)
+    rdir = dir_tree.get_dir(request['dir_id'])
     if rdir and rdir.data.ondisk:
-        error_time = datetime.datetime.strptime(incoming_message['timestamp'], '%Y/%m/%d %H:%M:%S.%f')
+        error_time = timestamp_ns(incoming_message['timestamp'])
         if error_time > rdir.creation_time:
             logger.error(
                 f"Result Verify FAILED: Operation {incoming_message['action']} "
-                f"failed on {rdir_name}/{rfile_name} which is on disk")
+                f"failed on {failed_target(incoming_message, request)} which is on disk")
             return True
         else:
-            logger.debug(f"Result verify OK: Directory {rdir_name} is not on disk")
+            logger.debug(f"Result verify OK: Directory {rdir.tag} is not on disk")
     return False
 
 
@@ -379,17 +480,21 @@ def failed_response_actions(action):
     """Returns the unified fail handler for all actions.
     The handler returns True if a critical (unexpected) error was detected.
     """
-    def _fail(logger, incoming_message, dir_tree):
+    def _fail(logger, incoming_message, dir_tree, request):
         code = incoming_message['error_code']
+        if action == 'mkdir':
+            _mkdir_failed(logger, dir_tree, request)
+        elif action in REMOVALS:
+            _removal_failed(dir_tree, request)
         if code in BENIGN_ERRORS.get(action, set()):
             return False
         if code == errno.ENOENT:
             if action == 'touch':
-                return _verify_enoent_touch(logger, incoming_message, dir_tree)
-            elif action == 'mkdir':
-                return generic_error_handler(logger, incoming_message)
+                return _verify_enoent_touch(logger, incoming_message, dir_tree, request)
+            elif action in ('mkdir', 'populate'):
+                return generic_error_handler(logger, incoming_message, request)
             else:
-                return _verify_enoent_file(logger, incoming_message, dir_tree)
+                return _verify_enoent_file(logger, incoming_message, dir_tree, request)
         else:
-            return generic_error_handler(logger, incoming_message)
+            return generic_error_handler(logger, incoming_message, request)
     return _fail
@@ -0,0 +1,47 @@
+"""
+Weighted sampling of workload file operations and io types
+2016 samuels (c)
+"""
+import itertools
+import random
+
+__author__ = 'samuels'
+
+SAMPLE_CHUNK = 1024
+
+
+class WeightedSampler(object):
+    """Draws values of a [(value, weight), ...] list, built once per workload.
+
+    Cumulative weights are computed up front, so every random.choices() call is a bisect per draw done in C,
+    and draws are made in chunks of SAMPLE_CHUNK instead of one call per job. The sampler has its own random
+    generator seeded from the global one when it's built, so with --seed the sequence it produces doesn't depend
+    on how many random numbers the rest of the controller consumed meanwhile.
+    """
+
+    def __init__(self, choices, chunk=SAMPLE_CHUNK):
+        """
+        Args:
+            choices: list of (value, weight)
+            chunk: int
+        """
+        self.values, weights = zip(*choices)
+        self.cum_weights = list(itertools.accumulate(weights))
+        if self.cum_weights[-1] <= 0:
+            raise ValueError(f"Bad weights {weights}, total weight must be positive")
+        self.chunk = chunk
+        self._random = random.Random(random.getrandbits(64))
+        self._drawn = iter(())
+
+    def sample(self, k):
+        return self._random.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._drawn)
+        except StopIteration:
+            self._drawn = iter(self.sample(self.chunk))
+            return next(self._drawn)
@@ -0,0 +1,110 @@
+"""
+Least-loaded worker scheduler for the controller dispatch loop
+2016 samuels (c)
+"""
+
+__author__ = 'samuels'
+
+
+class WorkerScheduler:
+    """Indexed min-heap of client workers keyed by their in-flight job count.
+
+    Every dispatch, job completion and disconnect updates a single heap entry,
+    so picking the least loaded worker is O(1) and each update is O(log W)
+    instead of sorting all W workers on every dispatched job.
+
+    Each worker gets a window of credits (default_credits unless the worker
+    asked for fewer on connect). Dispatching a job consumes a credit and a
+    finished job returns it, so a worker never has more than its window of
+    jobs in flight.
+    """
+
+    def __init__(self, default_credits):
+        self.default_credits = default_credits
+        # [in-flight - credits, seq, worker_id] entries, seq is unique so worker ids are never compared
+        self._heap = []
+        self._index = {}  # worker_id -> position in self._heap
+        self._credits = {}  # worker_id -> window size
+        self._seq = 0  # tie breaker, keeps equally loaded workers in round-robin order
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, worker_id):
+        return worker_id in self._index
+
+    def add(self, worker_id, credits=None):
+        if worker_id in self._index:
+            raise KeyError(f"Worker {worker_id} is already scheduled")
+        credits = self.default_credits if credits is None else min(credits, self.default_credits)
+        self._credits[worker_id] = credits
+        self._heap.append([-credits, self._next_seq(), worker_id])
+        self._index[worker_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def remove(self, worker_id):
+        pos = self._index.pop(worker_id)
+        del self._credits[worker_id]
+        last = self._heap.pop()
+        if pos < len(self._heap):
+            self._heap[pos] = last
+            self._index[last[2]] = pos
+            self._sift_down(pos)
+            self._sift_up(pos)
+
+    def load(self, worker_id):
+        return self._heap[self._index[worker_id]][0] + self._credits[worker_id]
+
+    def free_credits(self, worker_id):
+        return -self._heap[self._index[worker_id]][0]
+
+    def next_worker(self):
+        """Return the worker with most free credits, or None if every worker has used up its window."""
+        if self._heap and self._heap[0][0] < 0:
+            return self._heap[0][2]
+        return None
+
+    def job_dispatched(self, worker_id, count=1):
+        pos = self._index[worker_id]
+        entry = self._heap[pos]
+        entry[0] += count
+        entry[1] = self._next_seq()
+        self._sift_down(pos)
+
+    def job_done(self, worker_id, count=1):
+        pos = self._index[worker_id]
+        self._heap[pos][0] -= count
+        self._sift_up(pos)
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._index[heap[i][2]] = i
+        self._index[heap[j][2]] = j
+
+    def _sift_up(self, pos):
+        heap = self._heap
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if heap[pos] < heap[parent]:
+                self._swap(pos, parent)
+                pos = parent
+            else:
+                break
+
+    def _sift_down(self, pos):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            smallest = pos
+            for child in (2 * pos + 1, 2 * pos + 2):
+                if child < size and heap[child] < heap[smallest]:
+                    smallest = child
+            if smallest == pos:
+                break
+            self._swap(pos, smallest)
+            pos = smallest
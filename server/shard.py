@@ -0,0 +1,136 @@
+"""
+Sharded controller mode: the directory tree is partitioned across several controller processes, and a front
+router spreads client (dynamo) workers across them
+2016 samuels (c)
+"""
+import time
+
+import zmq
+
+from config import CTRL_MSG_PORT, SHARD_BASE_PORT
+from logger import server_logger
+
+__author__ = 'samuels'
+
+STATS_INTERVAL = 60  # Seconds between merged stats reports, same as the Collector of each shard
+
+
+def shard_endpoint(index):
+    return "tcp://127.0.0.1:{0}".format(SHARD_BASE_PORT + index)
+
+
+def _unlimited_hwm(sock):
+    # Outstanding messages are already bounded by worker credits, and a blocking send on
+    # either side of a router <-> shard link could deadlock both of them
+    sock.sndhwm = 0
+    sock.rcvhwm = 0
+
+
+def controller_socket(context, shard=None):
+    """Socket the controller engines exchange [worker_id, payload] frames with clients through.
+
+    A stand alone controller binds a ROUTER on the control port. A shard connects a DEALER to its link of the
+    front router instead, which forwards frames untouched, so the engines see the same frames either way.
+
+    Args:
+        context: zmq.Context
+        shard: tuple (index, count) or None
+    """
+    if shard is None:
+        sock = context.socket(zmq.ROUTER)
+        sock.bind("tcp://*:{0}".format(CTRL_MSG_PORT))
+    else:
+        sock = context.socket(zmq.DEALER)
+        _unlimited_hwm(sock)
+        sock.connect(shard_endpoint(shard[0]))
+    return sock
+
+
+def merge_stats(shard_stats):
+    """Sum test_stats dicts of all shards into a single one of the same layout"""
+    merged = {}
+    for stats in shard_stats:
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                section = merged.setdefault(key, {})
+                for op, count in value.items():
+                    section[op] = section.get(op, 0) + count
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+class ShardRouter(object):
+    """Front ROUTER on the control port. Each worker is pinned to a shard, round-robin on its first frame, and all
+    its frames are forwarded to that shard. Frames of each shard are routed back by the worker id they carry.
+    """
+
+    def __init__(self, stop_event, shards, shard_stats=None):
+        """
+        Args:
+            stop_event: Event
+            shards: int
+            shard_stats: dict shard index -> test_stats snapshot, shared with the shard Collectors
+        """
+        self.stop_event = stop_event
+        self.shards = shards
+        self.shard_stats = shard_stats
+        self.logger = server_logger.StatsLogger('__ShardRouter__').logger
+        self.worker_shards = {}  # worker_id -> shard index
+        self._next_shard = 0
+
+    def assign(self, worker_id):
+        try:
+            return self.worker_shards[worker_id]
+        except KeyError:
+            shard = self.worker_shards[worker_id] = self._next_shard
+            self._next_shard = (self._next_shard + 1) % self.shards
+            return shard
+
+    def run(self):
+        context = zmq.Context()
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind("tcp://*:{0}".format(CTRL_MSG_PORT))
+        backends = []
+        for index in range(self.shards):
+            backend = context.socket(zmq.DEALER)
+            _unlimited_hwm(backend)
+            backend.bind(shard_endpoint(index))
+            backends.append(backend)
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        for backend in backends:
+            poller.register(backend, zmq.POLLIN)
+        next_report = time.time() + STATS_INTERVAL
+        try:
+            while not self.stop_event.is_set():
+                events = dict(poller.poll(1000))
+                if frontend in events:
+                    frames = frontend.recv_multipart()
+                    backends[self.assign(frames[0])].send_multipart(frames)
+                for backend in backends:
+                    if backend in events:
+                        frontend.send_multipart(backend.recv_multipart())
+                if time.time() >= next_report:
+                    self.report()
+                    next_report += STATS_INTERVAL
+        finally:
+            for backend in backends:
+                backend.close(linger=0)
+            frontend.close(linger=0)
+            context.term()
+
+    def report(self):
+        if not self.shard_stats:
+            return
+        merged = merge_stats(self.shard_stats.values())
+        self.logger.info("{0}".format("############################"))
+        self.logger.info("{0}".format("#### All Shards Stats   ####"))
+        self.logger.info("{0}".format("############################"))
+        self.logger.info(f"Shards reporting: {len(self.shard_stats)}/{self.shards} "
+                         f"workers: {len(self.worker_shards)}")
+        self.logger.info(f"Total file operations executed: {merged['total']}")
+        self.logger.info(f"Total file operations succeeded: {merged['success']['total']}")
+        self.logger.info(f"Total file operations failed: {merged['failed']['total']}")
+        for shard, stats in sorted(self.shard_stats.items()):
+            self.logger.info(f"Shard {shard}: {stats['total']}")
@@ -0,0 +1,180 @@
+"""
+Incremental snapshots of the controller's expected state tree, so a run can be resumed after the controller died
+2016 samuels (c)
+"""
+import operator
+import os
+import time
+import timeit
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from tree.dirtree import File, dir_nid
+
+__author__ = 'samuels'
+
+timer = timeit.default_timer
+
+SNAPSHOT_INTERVAL = 60  # Seconds between snapshots
+SNAPSHOT_BATCH = 64  # Directories serialized between yields of the GIL to the dispatch loop
+COMPACT_RATIO = 2  # Rewrite the whole snapshot once appended records are this many times its size
+SNAPSHOT_VERSION = 3  # 2: directory nids are integers, 3: full directories
+
+HEADER_RECORD = 0  # [0, version, created]
+DIR_RECORD = 1  # [1, path, ondisk, size, creation_time, [file fields, ...], full]
+REMOVED_RECORD = 2  # [2, nid], removed or retired
+
+FILE_FIELDS = ('name', 'ondisk', 'tid', 'uuid', 'size', 'data_pattern', 'data_pattern_len', 'data_pattern_hash',
+               'data_pattern_offset', 'creation_time', 'modify_time')
+file_fields = operator.attrgetter(*FILE_FIELDS)
+
+
+def snapshots_supported():
+    """Snapshots are msgpack record streams, without msgpack installed the controller runs without them"""
+    return msgpack is not None
+
+
+def snapshot_path(output_dir="logs"):
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, f"snapshot_{time.strftime('%Y-%m-%d_%H%M%S')}.msgpack")
+
+
+def shard_snapshot_path(path, shard):
+    """Each controller shard keeps its own snapshot next to the others"""
+    return path if shard is None else f"{path}.{shard[0]}"
+
+
+class TreeSnapshot(object):
+    """Writes the expected state of a DirTree to a msgpack record stream every interval seconds.
+
+    The first snapshot is a full one, later ones append records of the directories marked dirty since, and of
+    those which were removed. Once the appended records outgrow the last full snapshot COMPACT_RATIO times a new
+    full snapshot replaces the file. A directory is serialized under its own lock only, never the tree's, and the
+    snapshot thread yields every SNAPSHOT_BATCH directories, so dispatch and result processing keep going.
+    """
+
+    def __init__(self, dir_tree, path, stop_event, logger, interval=SNAPSHOT_INTERVAL):
+        """
+        Args:
+            dir_tree: DirTree
+            path: str
+            stop_event: Event
+            logger: Logger
+            interval: int
+        """
+        self.dir_tree = dir_tree
+        self.path = path
+        self.stop_event = stop_event
+        self.logger = logger
+        self.interval = interval
+        self._packer = msgpack.Packer()
+        self._full_size = 0
+        self._appended = 0
+
+    def run(self):
+        self._write_logged()
+        while not self.stop_event.wait(self.interval):
+            self._write_logged()
+        self._write_logged()
+
+    def _write_logged(self):
+        """A failed write (disk full, ...) is logged and the next interval retries with a full snapshot, since the
+        dirty directories it took are lost
+        """
+        try:
+            self.write()
+        except Exception as generic_error:
+            self._full_size = 0
+            self.logger.exception(generic_error)
+
+    def write(self):
+        if not self._full_size or self._appended > COMPACT_RATIO * self._full_size:
+            self.write_full()
+        else:
+            self.write_incremental()
+
+    def write_full(self):
+        start = timer()
+        self.dir_tree.take_dirty()
+        nids = list(self.dir_tree.synced_nodes.keys()) + list(self.dir_tree.full_nodes.keys())
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._packer.pack([HEADER_RECORD, SNAPSHOT_VERSION, time.time_ns()]))
+            written = self._write_dirs(f, nids)
+            f.flush()
+            os.fsync(f.fileno())
+            self._full_size = f.tell()
+        os.replace(tmp_path, self.path)
+        self._appended = 0
+        self.logger.info(f"Snapshot: {written} directories, {self._full_size} bytes written to {self.path} "
+                         f"in {timer() - start:.2f}s")
+
+    def write_incremental(self):
+        start = timer()
+        nids = self.dir_tree.take_dirty()
+        if not nids:
+            return
+        with open(self.path, 'ab') as f:
+            offset = f.tell()
+            written = self._write_dirs(f, nids)
+            f.flush()
+            os.fsync(f.fileno())
+            self._appended += f.tell() - offset
+        self.logger.info(f"Snapshot: {written} of {len(nids)} dirty directories appended to {self.path} "
+                         f"in {timer() - start:.2f}s")
+
+    def _write_dirs(self, f, nids):
+        """Write a record per directory, returns the number of directories still in the tree"""
+        written = 0
+        synced_nodes = self.dir_tree.synced_nodes
+        full_nodes = self.dir_tree.full_nodes
+        for i, nid in enumerate(nids):
+            if i % SNAPSHOT_BATCH == SNAPSHOT_BATCH - 1:
+                time.sleep(0)
+            node = self.dir_tree.get_node(nid)
+            full = nid in full_nodes
+            if node is None or not (full or nid in synced_nodes):
+                f.write(self._packer.pack([REMOVED_RECORD, nid]))
+                continue
+            directory = node.data
+            files = [file_fields(snapshot_file) for snapshot_file in directory.list_files()]
+            f.write(self._packer.pack([DIR_RECORD, node.tag, directory.ondisk, directory.size, node.creation_time,
+                                       files, full]))
+            written += 1
+        return written
+
+
+def load_snapshot(path, dir_tree):
+    """Restore the active and full directories and their files of a snapshot into an empty DirTree.
+
+    A record cut short by a crash in the middle of a write is dropped.
+
+    Returns:
+        int, number of directories restored
+    """
+    dirs = {}
+    with open(path, 'rb') as f:
+        records = msgpack.Unpacker(f, raw=False)
+        header = next(records, None)
+        if not isinstance(header, list) or header[:2] != [HEADER_RECORD, SNAPSHOT_VERSION]:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} tree snapshot")
+        for record in records:
+            if record[0] == DIR_RECORD:
+                dirs[dir_nid(record[1])] = record
+            else:
+                dirs.pop(record[1], None)
+    # Parents first, so subdirectories are counted against their parent's width
+    for _, dir_path, ondisk, size, creation_time, files, full in sorted(dirs.values(),
+                                                                       key=lambda r: r[1].count('/')):
+        node = dir_tree.restore_dir(dir_path, ondisk, size, creation_time)
+        for fields in files:
+            restored_file = File(name=fields[0])
+            for field, value in zip(FILE_FIELDS[1:], fields[1:]):
+                setattr(restored_file, field, value)
+            node.data.add_file(restored_file)
+        if full:
+            dir_tree.mark_full(node.identifier)
+    return len(dirs)
@@ -0,0 +1,52 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import time
+import pytest
+from tree.dirtree import DirTree
+
+
+def make_success_result(action, data):
+    """Client success message for the job request data, as dynamo would send it back"""
+    result = {}
+    if action == 'mkdir':
+        result['dirsize'] = 0
+    elif action == 'truncate':
+        result['size'] = 0
+    elif action == 'write':
+        result.update(data_pattern=0, chunk_size=1, hash=0, offset=data['offset'])
+    elif action == 'read':
+        result.update(hash=data['hash'], offset=data['offset'], chunk_size=1)
+    elif action == 'rename':
+        result['rename_dest'] = data['rename_dest']
+    elif action == 'rename_exist':
+        result['rename_source'] = data['rename_source']
+        result['rename_dest'] = data['rename_dest']
+    return {'result': 'success', 'action': action, 'target': data['target'], 'timestamp': time.time_ns(),
+            'data': result}
+
+
+def make_populated_tree(dirs=10, files_per_dir=100):
+    """DirTree with synced directories full of files on disk, so every request action has a target"""
+    dir_tree = DirTree()
+    for _ in range(dirs):
+        dir_tree.append_node()
+        node = dir_tree.last_node
+        dir_tree.add_synced_node(node.identifier, node.tag)
+        node.data.ondisk = True
+        for _ in range(files_per_dir):
+            node.data.get_file_by_name(node.data.touch()).ondisk = True
+    return dir_tree
+
+
+@pytest.fixture
+def success_result():
+    """success_result(action, data) builds the client success message of a job"""
+    return make_success_result
+
+
+@pytest.fixture
+def populated_tree():
+    """populated_tree(dirs, files_per_dir) builds a DirTree where every request action has a target"""
+    return make_populated_tree
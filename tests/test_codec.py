@@ -0,0 +1,45 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from server.helpers import timestamp_ns
+from utils import codec
+
+JOB = ('9f3c2a51', {'action': 'stat', 'data': {'tid': 3, 'target': '/dir/file', 'uuid': 'a1b2c'}})
+RESULT = {'message': 'job_done_batch',
+          'results': [['9f3c2a51', {'result': 'success', 'action': 'stat', 'target': '/dir/file',
+                                    'timestamp': 1700000000123456789, 'data': {'hash': 2 ** 63 + 5}}]]}
+
+
+@pytest.mark.parametrize('name', codec.available_codecs())
+def test_round_trip(name):
+    wire_codec = codec.get_codec(name)
+    assert codec.decode(wire_codec.encode(RESULT)) == RESULT
+    job_id, work = codec.decode(wire_codec.encode(JOB))
+    assert (job_id, work) == JOB
+
+
+@pytest.mark.parametrize('name', codec.available_codecs())
+def test_detect(name):
+    wire_codec = codec.get_codec(name)
+    assert codec.detect(wire_codec.encode(JOB)) is wire_codec
+
+
+def test_json_frames_are_plain_json():
+    assert codec.JsonCodec.encode({'message': 'connect'}) == b'{"message": "connect"}'
+
+
+def test_negotiate_picks_first_supported():
+    assert codec.negotiate(['brotli', 'json']) is codec.JsonCodec
+    assert codec.negotiate(None) is codec.DEFAULT_CODEC
+    assert codec.negotiate([]) is codec.DEFAULT_CODEC
+
+
+def test_json_is_least_preferred():
+    assert codec.available_codecs()[-1] == 'json'
+
+
+def test_timestamp_ns_string_and_epoch_ns_agree():
+    assert timestamp_ns('2023/11/14 22:13:20.123456') == 1700000000123456000
+    assert timestamp_ns(1700000000123456789) == 1700000000123456789
@@ -0,0 +1,75 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ctypes
+import errno
+import mmap
+import pytest
+import xxhash
+from client import response_actions
+from client.locking import FLock
+
+FLOCK = FLock(None, 'off')
+
+
+@pytest.fixture
+def mount_point(tmp_path):
+    try:
+        os.close(os.open(str(tmp_path / 'probe'), os.O_RDWR | os.O_CREAT | os.O_DIRECT))
+    except OSError as e:
+        if e.errno == errno.EINVAL:
+            pytest.skip("O_DIRECT isn't supported on the temporary directory")
+        raise
+    return str(tmp_path)
+
+
+def test_buffers_page_aligned():
+    for kind in ('read', 'write'):
+        buf = response_actions.direct_buffer(kind, 3 * mmap.PAGESIZE)
+        assert ctypes.addressof(ctypes.c_char.from_buffer(buf)) % mmap.PAGESIZE == 0
+        assert len(buf) == 3 * mmap.PAGESIZE
+    assert response_actions.direct_buffer('write', 64) == response_actions.PATTERN * 4
+
+
+def test_write_direct_then_read_direct(mount_point):
+    alignment = response_actions.direct_alignment(mount_point)
+    written = response_actions.write_direct(mount_point, {'io_type': 'sequential', 'offset': 100,
+                                                          'data_pattern_len': 10, 'uuid': 1, 'tid': 1,
+                                                          'target': '/f'}, flock=FLOCK)
+    assert written['offset'] == alignment
+    assert written['chunk_size'] % alignment == 0
+    with open(os.path.join(mount_point, 'f'), 'rb') as f:
+        f.seek(written['offset'])
+        assert xxhash.xxh64(f.read()).intdigest() == written['hash']
+    read = response_actions.read_direct(mount_point, {'offset': written['offset'], 'repeats': written['chunk_size'],
+                                                      'uuid': 1, 'tid': 2, 'target': '/f'}, flock=FLOCK)
+    assert read['hash'] == written['hash']
+
+
+def test_read_direct_unaligned_range(mount_point):
+    data = bytes(range(256)) * 64
+    with open(os.path.join(mount_point, 'f'), 'wb') as f:
+        f.write(data)
+    for offset, chunk_size in ((100, 5000), (16384 - 100, 1024), (0, 0)):
+        read = response_actions.read_direct(mount_point, {'offset': offset, 'repeats': chunk_size, 'uuid': 1,
+                                                          'tid': 1, 'target': '/f'}, flock=FLOCK)
+        assert read['hash'] == xxhash.xxh64(data[offset:offset + chunk_size]).intdigest()
+
+
+def test_alignment_override(mount_point):
+    alignment = 4 * mmap.PAGESIZE
+    written = response_actions.write_direct(mount_point, {'io_type': 'sequential', 'offset': 100,
+                                                          'data_pattern_len': 10, 'uuid': 1, 'tid': 1,
+                                                          'target': '/f'}, flock=FLOCK, direct_alignment=alignment)
+    assert written['offset'] == alignment
+    assert written['chunk_size'] % alignment == 0
+    read = response_actions.read_direct(mount_point, {'offset': written['offset'] + 100, 'repeats': 100, 'uuid': 1,
+                                                      'tid': 2, 'target': '/f'}, flock=FLOCK,
+                                        direct_alignment=alignment)
+    assert read['hash'] == xxhash.xxh64((response_actions.PATTERN * alignment)[100:200]).intdigest()
+
+
+def test_alignment_not_the_filesystem_block_size(mount_point):
+    # statvfs() reports wsize on NFS, the logical block size of a device is at most a few pages
+    assert response_actions.direct_alignment(mount_point) <= mmap.PAGESIZE
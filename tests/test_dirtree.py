@@ -2,8 +2,15 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+import errno
+import logging
+import random
 import threading
-from tree.dirtree import DirTree, Directory, File
+import time
+import pytest
+from config import MEMORY_BUDGET_MB
+from server.request_actions import request_action
+from tree.dirtree import TRACKED_FILE_BYTES, DirTree, Directory, File, IndexedDict, file_id, split_target
 
 
 def test_append_and_get_size():
@@ -123,3 +130,448 @@ def test_thread_safety_append():
         t.join()
     assert not errors, f"Thread safety errors: {errors}"
     assert dt.get_size() > 1
+
+
+def test_thread_safety_requests_and_results(success_result):
+    """Requests and their results applied from several threads at once, as the job producer and result
+    processing do, on a tree which grows, fills up and drops directories meanwhile."""
+    from server.response_actions import response_action
+    dt = DirTree()
+    dt.set_layout(2, 4)
+    logger = logging.getLogger('test')
+    actions = ['mkdir', 'touch', 'touch', 'stat', 'delete', 'rename', 'rename_exist', 'truncate']
+    errors = []
+
+    def run():
+        try:
+            for _ in range(2000):
+                action = random.choice(actions)
+                data = request_action(action, logger, dt, io_type='sequential')
+                if data:
+                    response_action(logger, success_result(action, data), dt, data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, f"Thread safety errors: {errors}"
+    assert len(dt.synced_nodes) > 0
+
+
+def test_sharded_tree_only_creates_owned_dirs():
+    from tree.dirtree import shard_of
+    for index in range(3):
+        dt = DirTree(shard=(index, 3))
+        for _ in range(20):
+            dt.append_node()
+        assert all(shard_of(nid, 3) == index for nid in dt.nids)
+        assert dt.owns(dt.last_node.identifier)
+
+
+def sync_dirs(dt, count):
+    """Create up to count directories and mark them on disk, like mkdir_request followed by mkdir_success"""
+    for _ in range(count):
+        node = dt.append_node()
+        if node is None:
+            break
+        dt.add_synced_node(dt.get_random_dir_not_synced().identifier, node.tag)
+
+
+def test_nested_tree_layout():
+    dt = DirTree(depth=3, width=2)
+    sync_dirs(dt, 100)
+    dirs = [dt.get_dir_by_name(path) for path in dt.synced_nodes.values()]
+    assert len(dirs) == 2 + 4 + 8
+    assert dt.append_node() is None
+    for node in dirs:
+        assert node.tag.count('/') == node.level - 1
+        assert node.children <= 2
+        if node.level > 1:
+            parent_path, name = node.tag.rsplit('/', 1)
+            assert dt.get_dir_by_name(parent_path).identifier == node.parent
+            assert name == node.data.name
+
+
+def test_flat_tree_width_limit():
+    dt = DirTree()
+    dt.set_layout(1, 10)
+    sync_dirs(dt, 100)
+    assert len(dt.synced_nodes) == 10
+    assert all('/' not in path for path in dt.synced_nodes.values())
+
+
+def test_removed_dir_frees_parent_slot():
+    dt = DirTree(depth=1, width=1)
+    sync_dirs(dt, 1)
+    path = dt.last_node.tag
+    assert dt.append_node() is None
+    dt.remove_dir_by_name(path)
+    assert dt.append_node() is not None
+
+
+def test_subdirs_need_parent_on_disk():
+    dt = DirTree(depth=2, width=5)
+    parent = dt.append_node()
+    assert all(dt.append_node().parent == 'root' for _ in range(4))
+    assert dt.append_node() is None
+    dt.add_synced_node(parent.identifier, parent.tag)
+    child = dt.append_node()
+    assert child.parent == parent.identifier
+    assert child.tag.startswith(parent.tag + '/')
+
+
+def test_split_target():
+    from tree.dirtree import split_target
+    assert split_target('/a/f') == ('a', 'f')
+    assert split_target('/a/b/c/f') == ('a/b/c', 'f')
+    assert split_target('a/b') == ('a', 'b')
+
+
+def test_nested_request_response_roundtrip():
+    from server.response_actions import response_action
+    random.seed(5)
+    logger = logging.getLogger('test')
+    dt = DirTree()
+    dt.set_layout(3, 3)
+    for _ in range(30):
+        data = request_action('mkdir', logger, dt)
+        if data:
+            response_action(logger, {'result': 'success', 'action': 'mkdir', 'target': data['target'],
+                                     'timestamp': 0, 'data': {'dirsize': 0}}, dt, data)
+    assert max(path.count('/') for path in dt.synced_nodes.values()) == 2
+    for _ in range(50):
+        data = request_action('touch', logger, dt)
+        response_action(logger, {'result': 'success', 'action': 'touch', 'target': data['target'],
+                                 'timestamp': 1, 'data': {}}, dt, data)
+    ondisk = [f for path in dt.synced_nodes.values() for f in dt.get_dir_by_name(path).data.files_dict.values()
+              if f.ondisk]
+    assert len(ondisk) == 50
+
+
+def test_request_ids_address_targets(populated_tree):
+    from tree.dirtree import split_target
+    random.seed(6)
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=5, files_per_dir=20)
+    for action in ['touch', 'stat', 'read', 'write', 'delete', 'rename', 'rename_exist', 'truncate']:
+        data = request_action(action, logger, dt, io_type='sequential')
+        dir_path, name = split_target(data['target'])
+        rdir = dt.get_dir(data['dir_id'])
+        assert rdir.tag == dir_path
+        assert rdir.data.get_file(data['file_id']).name == name
+    data = request_action('rename_exist', logger, dt, io_type='sequential')
+    dst_path, dst_name = split_target(data['rename_dest'])
+    assert dt.get_dir(data['dst_dir_id']).tag == dst_path
+    assert dt.get_dir(data['dst_dir_id']).data.get_file(data['dst_file_id']).name == dst_name
+
+
+def test_rename_result_by_file_id(populated_tree, success_result):
+    from server.response_actions import response_action
+    random.seed(7)
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=1, files_per_dir=5)
+    data = request_action('rename', logger, dt, io_type='sequential')
+    response_action(logger, success_result('rename', data), dt, data)
+    rdir = dt.get_dir(data['dir_id'])
+    assert not rdir.data.get_file(data['file_id']).ondisk
+    assert rdir.data.get_file_by_name(data['rename_dest']).ondisk
+
+
+def test_rename_exist_result_across_dirs(populated_tree, success_result):
+    from server.response_actions import response_action
+    random.seed(9)
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=5, files_per_dir=5)
+    data = request_action('rename_exist', logger, dt)
+    while data['dst_dir_id'] == data['dir_id']:
+        data = request_action('rename_exist', logger, dt)
+    dst_dir = dt.get_dir(data['dst_dir_id'])
+    dst_before = set(dst_dir.data.files_dict.keys())
+    response_action(logger, success_result('rename_exist', data), dt, data)
+    assert not dt.get_dir(data['dir_id']).data.get_file(data['file_id']).ondisk
+    assert dst_dir.data.get_file(data['dst_file_id']).ondisk
+    assert set(dst_dir.data.files_dict.keys()) == dst_before
+
+
+def failure_result(action, data, error_code):
+    """Client failure message for the job request data, the target carries the mount point"""
+    return {'result': 'failed', 'action': action, 'target': '/mnt/vfs' + data['target'], 'error_code': error_code,
+            'error_message': os.strerror(error_code), 'timestamp': time.time_ns(), 'data': {}}
+
+
+def test_failed_mkdir_frees_its_slot():
+    from server.response_actions import response_action
+    logger = logging.getLogger('test')
+    dt = DirTree(width=10)
+    for _ in range(20):
+        data = request_action('mkdir', logger, dt)
+        assert data
+        assert not response_action(logger, failure_result('mkdir', data, errno.EEXIST), dt, data)
+    assert dt.get_size() == 1
+    assert dt.memory_used() == 0
+
+
+def test_failed_target_strips_mount_point():
+    from server.response_actions import failed_target
+    data = {'target': '/a/b/f'}
+    for mount_point in ('/mnt', '/mnt/VFS_STRESS_10.0.0.1', '/'):
+        assert failed_target({'target': '/'.join([mount_point, data['target']])}, data) == '/a/b/f'
+
+
+def test_enoent_racing_with_delete_is_expected(populated_tree, success_result):
+    from server.response_actions import job_dispatched, response_action
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=1, files_per_dir=1)
+    stat = request_action('stat', logger, dt)
+    delete = request_action('delete', logger, dt)
+    job_dispatched(dt, 'delete', delete)
+    # The stat ran after the delete, its result is applied first
+    assert not response_action(logger, failure_result('stat', stat, errno.ENOENT), dt, stat)
+    rfile = dt.get_dir(delete['dir_id']).data.get_file(delete['file_id'])
+    assert rfile.ondisk
+    response_action(logger, success_result('delete', delete), dt, delete)
+    assert not rfile.ondisk
+
+
+def test_enoent_without_removal_in_flight_fails(populated_tree, success_result):
+    from server.response_actions import job_dispatched, response_action
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=1, files_per_dir=1)
+    rename = request_action('rename', logger, dt)
+    job_dispatched(dt, 'rename', rename)
+    response_action(logger, failure_result('rename', rename, errno.EIO), dt, rename)
+    stat = request_action('stat', logger, dt)
+    # The failed rename is no longer in flight, the file should be there
+    assert response_action(logger, failure_result('stat', stat, errno.ENOENT), dt, stat)
+    assert not dt.get_dir(stat['dir_id']).data.get_file(stat['file_id']).ondisk
+
+
+def test_enoent_with_removal_not_dispatched_fails(populated_tree):
+    from server.response_actions import response_action
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=1, files_per_dir=1)
+    stat = request_action('stat', logger, dt)
+    # Still in the lookahead buffer, the delete can't have raced with the stat
+    request_action('delete', logger, dt)
+    assert response_action(logger, failure_result('stat', stat, errno.ENOENT), dt, stat)
+
+
+def test_touch_result_after_delete_result(populated_tree, success_result):
+    from server.response_actions import response_action
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=1, files_per_dir=0)
+    touch = request_action('touch', logger, dt)
+    delete = request_action('delete', logger, dt)
+    assert delete['file_id'] == touch['file_id']
+    # Another worker deleted the file before the touch result arrived
+    response_action(logger, success_result('delete', delete), dt, delete)
+    response_action(logger, success_result('touch', touch), dt, touch)
+    rdir = dt.get_dir(touch['dir_id'])
+    assert not rdir.data.get_file(touch['file_id']).ondisk
+    assert rdir.data.size == 1
+
+
+@pytest.mark.parametrize('delete_first', [True, False])
+@pytest.mark.parametrize('delete_result_first', [True, False])
+def test_rename_over_a_name_crossing_its_delete(delete_first, delete_result_first, populated_tree, success_result):
+    from server.response_actions import response_action
+    logger = logging.getLogger('test')
+    dt = populated_tree(dirs=1, files_per_dir=2)
+    nid = dt.synced_nodes.random_key()
+    node = dt.get_dir(nid)
+    source, dest = node.data.list_files()
+    source_id, dest_id = file_id(source.name), file_id(dest.name)
+    rename = {'target': f'/{node.tag}/{source.name}', 'dir_id': nid, 'file_id': source_id, 'dst_dir_id': nid,
+              'dst_file_id': dest_id, 'rename_source': f'/{node.tag}/{source.name}',
+              'rename_dest': f'/{node.tag}/{dest.name}'}
+    delete = {'target': f'/{node.tag}/{dest.name}', 'dir_id': nid, 'file_id': dest_id}
+    # One worker renamed a file over dest, another deleted dest, their results may arrive in either order
+    now = time.time_ns()
+    results = [(dict(success_result('delete', delete), timestamp=now + (0 if delete_first else 2)), delete),
+               (dict(success_result('rename_exist', rename), timestamp=now + 1), rename)]
+    for result, request in (results if delete_result_first else results[::-1]):
+        response_action(logger, result, dt, request)
+    assert not node.data.get_file(source_id).ondisk
+    # Only a rename after the delete leaves a file at dest
+    assert node.data.get_file(dest_id).ondisk == delete_first
+
+
+def fill_tree(dt, touches, success_result):
+    from server.response_actions import response_action
+    logger = logging.getLogger('test')
+    for _ in range(touches):
+        for action in ('mkdir', 'touch'):
+            data = request_action(action, logger, dt, io_type='sequential')
+            if data:
+                response_action(logger, success_result(action, data), dt, data)
+
+
+def test_full_dirs_are_read_only(success_result):
+    random.seed(8)
+    logger = logging.getLogger('test')
+    dt = DirTree(width=2)
+    dt.set_budget(5)
+    fill_tree(dt, 100, success_result)
+    assert dt.full_nodes
+    assert len(dt.synced_nodes) <= 2
+    for nid in dt.full_nodes.keys():
+        assert dt.dir_state(nid) == 'full'
+        assert dt.get_dir(nid).data.size == 6
+    full_targets = {dt.get_dir(nid).tag for nid in dt.full_nodes.keys()}
+    for _ in range(200):
+        for action in ('touch', 'write', 'delete', 'rename', 'truncate'):
+            data = request_action(action, logger, dt, io_type='sequential')
+            if data:
+                assert split_target(data['target'])[0] not in full_targets
+    readable = {split_target(request_action('stat', logger, dt)['target'])[0] for _ in range(200)}
+    assert readable & full_targets
+
+
+def test_eviction_keeps_memory_within_budget(success_result):
+    random.seed(9)
+    dt = DirTree(width=3)
+    dt.set_budget(5, memory_budget_mb=40 * TRACKED_FILE_BYTES / 2 ** 20)
+    filled = []
+    mark_full = dt.mark_full
+    dt.mark_full = lambda nid: filled.append(nid) or mark_full(nid)
+    fill_tree(dt, 300, success_result)
+    assert dt.retired
+    assert dt.memory_used() <= dt.memory_budget
+    # Oldest filled directories go first
+    assert list(dt.retired) == filled[:len(dt.retired)]
+    retired = next(iter(dt.retired.values()))
+    assert retired.files >= retired.ondisk_files == 6
+    assert dt.get_dir_by_name(retired.path) is None
+
+
+def test_budget_bounds_active_dirs():
+    random.seed(10)
+    dt = DirTree()
+    dt.set_budget(5, memory_budget_mb=20 * TRACKED_FILE_BYTES / 2 ** 20, eviction='random')
+    for _ in range(10):
+        dt.append_node()
+    assert dt.get_size() - 1 == 4
+
+
+def test_full_dir_files_given_back_as_counted():
+    """Files added to a directory after it filled up weren't counted against the budget, retiring it must not
+    give them back"""
+    dt = synced_dir_with_files(6)
+    dt.set_budget(5)
+    nid = dt.last_node.identifier
+    directory = dt.last_node.data
+    dt.mark_full(nid)
+    assert dt._full_files == 6
+    # A rename result and a touch generated before the directory filled up
+    source_id = file_id(directory.list_files()[0].name)
+    directory.rename_file_id(source_id, 'renamed')
+    directory.new_file()
+    with dt._lock:
+        dt._retire(nid)
+    assert dt._full_files == 0
+    assert dt.retired[nid].files == 8
+
+
+def test_default_budget_bounds_memory():
+    dt = DirTree()
+    assert dt.memory_budget == MEMORY_BUDGET_MB * 2 ** 20
+
+
+def test_bad_budget():
+    dt = DirTree()
+    with pytest.raises(ValueError):
+        dt.set_budget(0)
+    with pytest.raises(ValueError):
+        dt.set_budget(10, eviction='lru')
+
+
+def test_indexed_dict_matches_dict():
+    random.seed(3)
+    indexed = IndexedDict()
+    reference = {}
+    for i in range(5000):
+        key = random.randrange(500)
+        if key in reference and random.random() < 0.5:
+            del indexed[key]
+            del reference[key]
+        else:
+            indexed[key] = i
+            reference[key] = i
+        assert len(indexed) == len(reference)
+    assert dict(indexed.items()) == reference
+    assert sorted(indexed) == sorted(reference)
+    assert all(indexed[key] == value for key, value in reference.items())
+    assert indexed.random_key() in reference
+    assert indexed.random_value() in reference.values()
+
+
+def test_indexed_dict_empty():
+    indexed = IndexedDict({'a': 1})
+    assert indexed.popitem() == ('a', 1)
+    with pytest.raises(KeyError):
+        indexed.popitem()
+    with pytest.raises(IndexError):
+        indexed.random_key()
+    with pytest.raises(KeyError):
+        del indexed['a']
+    assert indexed.get('a') is None
+
+
+def synced_dir_with_files(num_files):
+    dt = DirTree()
+    dt.append_node()
+    node = dt.last_node
+    dt.add_synced_node(node.identifier, node.tag)
+    for _ in range(num_files):
+        node.data.get_file_by_name(node.data.touch()).ondisk = True
+    return dt
+
+
+class CountingIndexedDict(IndexedDict):
+    """IndexedDict counting the calls which walk or copy all its entries"""
+
+    def __init__(self, mapping=None):
+        self.walks = 0
+        super().__init__(mapping)
+
+    def __iter__(self):
+        self.walks += 1
+        return super().__iter__()
+
+    def keys(self):
+        self.walks += 1
+        return super().keys()
+
+    def values(self):
+        self.walks += 1
+        return super().values()
+
+    def items(self):
+        self.walks += 1
+        return super().items()
+
+
+def test_job_generation_does_not_walk_the_directory():
+    """Picking a random file must not copy the directory's files, so a stat job costs the same in a directory
+    with 100 or 10000 files"""
+    logger = logging.getLogger(__name__)
+    dt = synced_dir_with_files(10000)
+    directory = dt.last_node.data
+    directory.files_dict = CountingIndexedDict(directory.files_dict)
+    for _ in range(100):
+        assert request_action('stat', logger, dt, io_type='sequential')
+    assert directory.files_dict.walks == 0
+
+
+def test_file_record_is_compact():
+    import xxhash
+    from tree.dirtree import EMPTY_HASH
+    f = File(name='file_a')
+    assert not hasattr(f, '__dict__')
+    assert f.data_pattern_hash == EMPTY_HASH == xxhash.xxh64(b'').intdigest()
+    assert isinstance(f.uuid, int) and isinstance(f.modify_time, int)
+    with pytest.raises(AttributeError):
+        f.last_actions = []
@@ -0,0 +1,136 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import json
+import queue
+import threading
+import time
+import pytest
+import zmq
+from server import async_controller, asyncio_controller
+from server.async_controller import Controller
+from server.asyncio_controller import AsyncioController
+from tree.dirtree import DirTree
+from utils import codec
+
+WORKLOAD = {'file_ops': {'mkdir': 40, 'touch': 60}, 'io_types': {'sequential': 100},
+            'dispatch': {'batch_size': 4, 'window': 8, 'lookahead': 64}, 'dir_tree': {'depth': 2, 'width': 4}}
+
+
+class Journal(object):
+    def __init__(self):
+        self.job_ids = []
+
+    def record(self, job_id, action, data):
+        self.job_ids.append(job_id)
+
+
+class NoCollector(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def run(self):
+        pass
+
+
+@pytest.fixture
+def make_controller(tmp_path, monkeypatch):
+    """Controllers of the given engine class running the WORKLOAD, logging to tmp_path/logs"""
+    (tmp_path / 'logs').mkdir()
+    (tmp_path / 'workloads').mkdir()
+    (tmp_path / 'workloads' / 'test.json').write_text(json.dumps(WORKLOAD))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(async_controller, 'Collector', NoCollector)
+    controllers = []
+
+    def make(controller_class, **test_config):
+        clients_ready_event = threading.Event()
+        clients_ready_event.set()
+        controller = controller_class(threading.Event(), DirTree(), dict(test_config, workload='test'),
+                                      clients_ready_event)
+        controllers.append(controller)
+        return controller
+
+    yield make
+    for controller in controllers:
+        controller.stop_event.set()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def run_worker(send, receive, batches, success_result):
+    """Fake batch capable worker, replies success to every job of batches job frames. Returns the job ids"""
+    send({'message': 'connect', 'batch': True, 'credits': 8})
+    job_ids = []
+    for _ in range(batches):
+        message = receive()
+        assert message['message'] == 'jobs'
+        results = []
+        for job_id, work in message['jobs']:
+            job_ids.append(job_id)
+            results.append((job_id, success_result(work['action'], work['data'])))
+        send({'message': 'job_done_batch', 'results': results})
+    return job_ids
+
+
+def test_threaded_engine_journals_dispatched_jobs(make_controller, monkeypatch, success_result):
+    # No proxy, the worker talks to run() through the message queues the proxy threads would feed
+    monkeypatch.setattr(Controller, '_start_server', lambda self: None)
+    journal = Journal()
+    controller = make_controller(Controller, _journal=journal)
+    run = threading.Thread(target=controller.run)
+    run.start()
+    job_ids = run_worker(lambda message: controller._incoming_message_queue.put((0, (b'worker', message))),
+                         lambda: controller._outgoing_message_queue.get(timeout=5)[2], 20, success_result)
+    wait_for(lambda: controller.test_stats['success']['total'] == len(job_ids))
+    controller.stop_event.set()
+    run.join(5)
+    assert not run.is_alive()
+    while True:
+        try:
+            job_ids.extend(job_id for job_id, _ in controller._outgoing_message_queue.get_nowait()[2]['jobs'])
+        except queue.Empty:
+            break
+    # Jobs still in the lookahead buffer were never sent, so they aren't in the journal
+    assert journal.job_ids == job_ids
+    assert controller._job_pipeline.stats['produced'] > len(job_ids)
+
+
+def test_asyncio_engine_with_a_dealer_worker(make_controller, monkeypatch, success_result):
+    endpoints = []
+
+    def controller_socket(context, shard=None):
+        sock = context.socket(zmq.ROUTER)
+        sock.bind('tcp://127.0.0.1:*')
+        endpoints.append(sock.last_endpoint.decode())
+        return sock
+
+    monkeypatch.setattr(asyncio_controller, 'controller_socket', controller_socket)
+    controller = make_controller(AsyncioController)
+    run = threading.Thread(target=controller.run)
+    run.start()
+    context = zmq.Context()
+    worker = context.socket(zmq.DEALER)
+    worker.connect(endpoints[0])
+    worker.rcvtimeo = 5000
+    try:
+        job_ids = run_worker(lambda message: worker.send(codec.JsonCodec.encode(message)),
+                             lambda: codec.decode(worker.recv()), 20, success_result)
+        wait_for(lambda: controller.test_stats['success']['total'] == len(job_ids))
+    finally:
+        controller.stop_event.set()
+        run.join(5)
+        worker.close(linger=0)
+        context.term()
+    assert not run.is_alive()
+    assert len(set(job_ids)) == len(job_ids)
+    # Results were applied to the model: mkdir results synced directories, touch results put files on disk
+    assert controller.dir_tree.synced_nodes
+    assert any(f.ondisk for path in controller.dir_tree.synced_nodes.values()
+               for f in controller.dir_tree.get_dir_by_name(path).data.list_files())
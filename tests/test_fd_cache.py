@@ -0,0 +1,143 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+import xxhash
+from client import response_actions
+from client.fd_cache import FdCache
+from client.locking import FLock
+
+FLOCK = FLock(None, 'off')
+
+
+def make_file(tmp_path, name, data=b''):
+    (tmp_path / name).write_bytes(data)
+    return '/' + name
+
+
+def test_descriptor_reused(tmp_path):
+    cache = FdCache(4)
+    target = make_file(tmp_path, 'a')
+    with cache.open(str(tmp_path), target, os.O_RDONLY) as fd:
+        first = fd
+    with cache.open(str(tmp_path), target, os.O_RDONLY) as fd:
+        assert fd == first
+    assert cache.stats == {'hits': 1, 'misses': 1, 'evictions': 0, 'stale': 0}
+    cache.close()
+
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = FdCache(2)
+    mount_point = str(tmp_path)
+    for name in ('a', 'b', 'a', 'c'):
+        with cache.open(mount_point, make_file(tmp_path, name), os.O_RDONLY):
+            pass
+    assert len(cache) == 2
+    assert cache.stats['evictions'] == 1
+    with cache.open(mount_point, '/a', os.O_RDONLY):
+        pass
+    assert cache.stats['hits'] == 2
+
+
+def test_descriptor_in_use_not_evicted(tmp_path):
+    cache = FdCache(1)
+    mount_point = str(tmp_path)
+    with cache.open(mount_point, make_file(tmp_path, 'a', b'data'), os.O_RDONLY) as fd:
+        with cache.open(mount_point, make_file(tmp_path, 'b'), os.O_RDONLY):
+            pass
+        assert os.pread(fd, 4, 0) == b'data'
+    cache.close()
+
+
+def test_invalidate_on_all_mount_points(tmp_path):
+    cache = FdCache(4)
+    target = make_file(tmp_path, 'a')
+    os.symlink(tmp_path, tmp_path / 'mount2')
+    mount_points = [str(tmp_path), str(tmp_path / 'mount2')]
+    for mount_point in mount_points:
+        with cache.open(mount_point, target, os.O_RDONLY):
+            pass
+    assert len(cache) == 2
+    with cache.open(mount_points[0], target, os.O_RDONLY) as fd:
+        cache.invalidate(target)
+        assert not len(cache)
+        os.fstat(fd)  # Closed once it's no longer used
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+def test_write_then_read_through_cache(tmp_path):
+    cache = FdCache(4)
+    mount_point = str(tmp_path)
+    target = make_file(tmp_path, 'f')
+    written = response_actions.write(mount_point, {'io_type': 'sequential', 'offset': 0, 'data_pattern_len': 0,
+                                                   'uuid': 1, 'tid': 1, 'target': target},
+                                     flock=FLOCK, fd_cache=cache)
+    pattern_len = len(response_actions.PATTERN) * written['chunk_size']
+    read = response_actions.read(mount_point, {'offset': written['offset'], 'repeats': pattern_len,
+                                               'uuid': 1, 'tid': 2, 'target': target},
+                                 flock=FLOCK, fd_cache=cache)
+    assert cache.stats['hits'] == 1
+    assert read['hash'] == written['hash']
+    # Deleting drops the descriptor, a later read doesn't see the removed file through it
+    response_actions.delete(mount_point, {'uuid': 1, 'tid': 3, 'target': target}, flock=FLOCK, fd_cache=cache)
+    assert not len(cache)
+    with pytest.raises(FileNotFoundError):
+        response_actions.read(mount_point, {'offset': 0, 'repeats': 1, 'uuid': 1, 'tid': 4, 'target': target},
+                              flock=FLOCK, fd_cache=cache)
+
+
+def test_file_deleted_by_another_worker(tmp_path):
+    cache = FdCache(4)
+    mount_point = str(tmp_path)
+    target = make_file(tmp_path, 'f', b'data')
+    with cache.open(mount_point, target, os.O_RDONLY) as fd:
+        stale = fd
+    # Deleted by another worker, this one's descriptor isn't invalidated
+    os.unlink(tmp_path / 'f')
+    with pytest.raises(FileNotFoundError):
+        response_actions.read(mount_point, {'offset': 0, 'repeats': 4, 'uuid': 1, 'tid': 2, 'target': target},
+                              flock=FLOCK, fd_cache=cache)
+    assert not len(cache)
+    with pytest.raises(OSError):
+        os.fstat(stale)
+    # A write recreates it, like it would without the cache
+    response_actions.write(mount_point, {'io_type': 'sequential', 'offset': 0, 'data_pattern_len': 0,
+                                         'uuid': 1, 'tid': 3, 'target': target}, flock=FLOCK, fd_cache=cache)
+    assert os.path.getsize(tmp_path / 'f')
+    assert cache.stats == {'hits': 0, 'misses': 2, 'evictions': 0, 'stale': 1}
+    cache.close()
+
+
+def test_open_per_op_by_default(tmp_path):
+    target = make_file(tmp_path, 'f', b'x' * 16)
+    read = response_actions.read(str(tmp_path), {'offset': 0, 'repeats': 16, 'uuid': 1, 'tid': 1, 'target': target},
+                                 flock=FLOCK)
+    assert read['chunk_size'] == 16
+
+
+def test_bad_capacity():
+    with pytest.raises(ValueError):
+        FdCache(0)
+
+
+def test_data_patterns_share_one_buffer():
+    for data_pattern in response_actions.DATA_PATTERNS_LIST:
+        pattern = data_pattern['pattern'] * data_pattern['repeats']
+        assert data_pattern['buffer'] == pattern
+        assert data_pattern['buffer'].obj is response_actions.PATTERN_BUFFER.obj
+        assert data_pattern['checksum'] == xxhash.xxh64(pattern).intdigest()
+
+
+def test_reads_reuse_the_thread_buffer(tmp_path):
+    target = make_file(tmp_path, 'f', bytes(range(256)) * 64)
+    first = response_actions.read(str(tmp_path), {'offset': 0, 'repeats': 4096, 'uuid': 1, 'tid': 1,
+                                                  'target': target}, flock=FLOCK)
+    buffer = response_actions.read_buffer(1).obj
+    # Short read at the end of the file hashes only what was read
+    tail = response_actions.read(str(tmp_path), {'offset': 16384 - 100, 'repeats': 1024, 'uuid': 1, 'tid': 2,
+                                                 'target': target}, flock=FLOCK)
+    assert response_actions.read_buffer(1).obj is buffer
+    assert first['hash'] == xxhash.xxh64(bytes(range(256)) * 16).intdigest()
+    assert tail['hash'] == xxhash.xxh64((bytes(range(256)) * 64)[-100:]).intdigest()
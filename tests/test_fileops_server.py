@@ -25,6 +25,11 @@ class TestGetArgs:
         assert args.locking == 'native'
         assert args.seed is None
         assert args.strict is False
+        assert args.engine == 'threaded'
+        assert args.shards == 1
+        assert args.queue_depth == 1
+        assert args.fd_cache == 0
+        assert args.direct_alignment == 0
 
     def test_all_args(self, monkeypatch):
         monkeypatch.setattr('sys.argv', [
@@ -38,6 +43,8 @@ class TestGetArgs:
             '-l', 'application',
             '--seed', '42',
             '--strict',
+            '--engine', 'asyncio',
+            '--shards', '4',
         ])
         args = get_args()
         assert args.cluster == 'cluster01'
@@ -50,6 +57,8 @@ class TestGetArgs:
         assert args.locking == 'application'
         assert args.seed == 42
         assert args.strict is True
+        assert args.engine == 'asyncio'
+        assert args.shards == 4
 
     def test_invalid_mtype_rejected(self, monkeypatch):
         monkeypatch.setattr('sys.argv', ['fileops_server.py', 'c', '-m', 'cifs'])
@@ -61,6 +70,38 @@ class TestGetArgs:
         with pytest.raises(SystemExit):
             get_args()
 
+    def test_invalid_engine_rejected(self, monkeypatch):
+        monkeypatch.setattr('sys.argv', ['fileops_server.py', 'c', '--engine', 'gevent'])
+        with pytest.raises(SystemExit):
+            get_args()
+
+    def test_invalid_queue_depth_rejected(self, monkeypatch):
+        monkeypatch.setattr('sys.argv', ['fileops_server.py', 'c', '--queue_depth', '0'])
+        with pytest.raises(SystemExit):
+            get_args()
+
+    def test_invalid_shards_rejected(self, monkeypatch):
+        monkeypatch.setattr('sys.argv', ['fileops_server.py', 'c', '--shards', '0'])
+        with pytest.raises(SystemExit):
+            get_args()
+
+    def test_resume_args(self, monkeypatch, tmp_path):
+        snapshot = tmp_path / 'snapshot.msgpack'
+        snapshot.write_bytes(b'')
+        monkeypatch.setattr('sys.argv', ['fileops_server.py', 'c', '--resume', str(snapshot),
+                                         '--snapshot_interval', '30'])
+        args = get_args()
+        assert args.resume == str(snapshot)
+        assert args.snapshot_interval == 30
+
+    def test_missing_resume_snapshot_rejected(self, monkeypatch, tmp_path):
+        snapshot = tmp_path / 'snapshot.msgpack'
+        snapshot.write_bytes(b'')
+        # Shards resume from their own snapshots, snapshot.msgpack.<index>
+        monkeypatch.setattr('sys.argv', ['fileops_server.py', 'c', '--resume', str(snapshot), '--shards', '2'])
+        with pytest.raises(SystemExit):
+            get_args()
+
     def test_missing_cluster_rejected(self, monkeypatch):
         monkeypatch.setattr('sys.argv', ['fileops_server.py'])
         with pytest.raises(SystemExit):
@@ -156,6 +197,20 @@ class TestOperationJournal:
         assert entry["action"] == "mkdir"
         assert entry["data"]["target"] == "/d1"
 
+    def test_records_carry_session(self, tmp_path):
+        from server.journal import OperationJournal
+        first = OperationJournal(output_dir=str(tmp_path))
+        second = OperationJournal(output_dir=str(tmp_path))
+        assert first.session != second.session
+        for journal in (first, second):
+            journal.record(0, "mkdir", {"target": "/d1"})
+            journal.close()
+        sessions = set()
+        for journal in (first, second):
+            with open(journal.path) as f:
+                sessions.update((entry["session"], entry["job_id"]) for entry in map(json.loads, f))
+        assert len(sessions) == 2
+
     def test_journal_path_contains_timestamp(self, tmp_path):
         from server.journal import OperationJournal
         journal = OperationJournal(output_dir=str(tmp_path))
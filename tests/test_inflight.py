@@ -0,0 +1,25 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.async_controller import Job
+from server.collector import oldest_age
+
+
+def dispatch(work, job_id, now):
+    job = Job(job_id, {})
+    job.dispatched = now
+    work[job_id] = job
+
+
+def test_oldest_age():
+    work = {}
+    assert oldest_age(work, 100.0) == 0.0
+    dispatch(work, 1, 10.0)
+    dispatch(work, 2, 20.0)
+    assert oldest_age(work, 25.0) == 15.0
+    del work[1]
+    assert oldest_age(work, 25.0) == 5.0
+    # A re-queued job is dispatched again, after the ones already in flight
+    dispatch(work, 1, 24.0)
+    assert oldest_age(work, 25.0) == 5.0
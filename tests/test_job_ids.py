@@ -0,0 +1,20 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import itertools
+from server.async_controller import JOB_ID_SHARD_SHIFT, job_ids
+
+
+def test_job_ids_increase():
+    ids = list(itertools.islice(job_ids(), 1000))
+    assert ids == list(range(1000))
+
+
+def test_shard_prefix_keeps_shards_apart():
+    shards = 4
+    ids = [list(itertools.islice(job_ids((index, shards)), 100)) for index in range(shards)]
+    assert len(set(itertools.chain(*ids))) == shards * 100
+    for index, shard_ids in enumerate(ids):
+        assert all(job_id >> JOB_ID_SHARD_SHIFT == index for job_id in shard_ids)
+        assert all(job_id < 2 ** 64 for job_id in shard_ids)
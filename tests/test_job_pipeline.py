@@ -0,0 +1,81 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import itertools
+import logging
+import threading
+import time
+from server.job_pipeline import JobPipeline
+from server.sampler import WeightedSampler
+
+FILE_OPERATIONS = [('touch', 70), ('stat', 30), ('delete', 0)]
+IO_TYPES = [('sequential', 100)]
+
+
+def make_pipeline(depth, make_job=None):
+    stop_event = threading.Event()
+    make_job = make_job or (lambda action, io_type: (action, io_type))
+    pipeline = JobPipeline(make_job, WeightedSampler(FILE_OPERATIONS), WeightedSampler(IO_TYPES), stop_event,
+                           logging.getLogger(__name__), depth)
+    return pipeline, stop_event
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_sample_respects_weights():
+    pipeline, _ = make_pipeline(0)
+    actions = [action for action, _ in pipeline.sample(10000)]
+    assert 6500 < actions.count('touch') < 7500
+    assert 'delete' not in actions
+
+
+def test_inline_jobs_skip_empty_requests():
+    pipeline, _ = make_pipeline(0, make_job=lambda action, io_type: action if action == 'stat' else None)
+    assert set(itertools.islice(pipeline.jobs(), 100)) == {'stat'}
+
+
+def test_starved_pipeline_yields_none():
+    for depth in (0, 16):
+        pipeline, stop_event = make_pipeline(depth, make_job=lambda action, io_type: None)
+        assert next(pipeline.jobs()) is None
+        stop_event.set()
+
+
+def test_starved_time_counts_until_the_next_job():
+    pipeline, stop_event = make_pipeline(16)
+    # Producer not started, the buffer stays empty
+    assert pipeline.get() is None
+    time.sleep(0.02)
+    assert pipeline.get() is None
+    pipeline._buffer.put('job')
+    assert pipeline.get() == 'job'
+    starved = pipeline.stats['starved']
+    assert starved >= 0.02
+    assert pipeline.get() is None
+    assert pipeline.stats['starved'] == starved
+    stop_event.set()
+
+
+def test_buffer_is_bounded():
+    pipeline, stop_event = make_pipeline(64)
+    jobs = pipeline.jobs()
+    wait_for(lambda: len(pipeline) == 64)
+    time.sleep(0.05)
+    assert len(pipeline) == 64
+    assert len(list(itertools.islice(filter(None, jobs), 100))) == 100
+    assert pipeline.stats['produced'] >= 100
+    stop_event.set()
+
+
+def test_jobs_end_on_stop():
+    pipeline, stop_event = make_pipeline(16, make_job=lambda action, io_type: None)
+    jobs = pipeline.jobs()
+    threading.Timer(0.1, stop_event.set).start()
+    assert not any(jobs)
+    assert pipeline.stats['starved'] > 0
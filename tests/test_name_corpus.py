@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import itertools
+import pickle
+from tree.dirtree import DirTree, SharedIterator
+from utils.name_corpus import OFFSETS_SUFFIX, NameCorpus
+
+
+def write_corpus(tmp_path, text):
+    path = str(tmp_path / 'filenames.dat')
+    with open(path, 'w', newline='') as f:
+        f.write(text)
+    return path
+
+
+def test_names_match_lines(tmp_path):
+    lines = [f"name{i}" for i in range(1000)]
+    corpus = NameCorpus(write_corpus(tmp_path, '\n'.join(lines) + '\n'))
+    assert len(corpus) == 1000
+    assert [corpus[i] for i in range(len(corpus))] == lines
+    assert corpus[-1] == 'name999'
+
+
+def test_blank_lines_and_line_ends(tmp_path):
+    corpus = NameCorpus(write_corpus(tmp_path, 'a\n\nb\r\n\r\nc'))
+    assert list(itertools.islice(corpus.names(), 3)) == ['a', 'b', 'c']
+
+
+def test_names_wrap_around(tmp_path):
+    corpus = NameCorpus(write_corpus(tmp_path, 'a\nb\nc\n'))
+    assert list(itertools.islice(corpus.names(start=2), 5)) == ['c', 'a', 'b', 'c', 'a']
+
+
+def test_offsets_reused_until_corpus_changes(tmp_path):
+    path = write_corpus(tmp_path, 'a\nb\n')
+    NameCorpus(path)
+    offsets_path = path + OFFSETS_SUFFIX
+    assert os.path.getsize(offsets_path) == 2 * 8
+    # A stale index which would be wrong for the corpus isn't used once the corpus is rewritten
+    with open(path, 'a') as f:
+        f.write('c\n')
+    os.utime(path, ns=(os.stat(offsets_path).st_mtime_ns + 1,) * 2)
+    corpus = NameCorpus(path)
+    assert [corpus[i] for i in range(len(corpus))] == ['a', 'b', 'c']
+    assert NameCorpus(path)[2] == 'c'
+
+
+def test_empty_corpus(tmp_path):
+    corpus = NameCorpus(write_corpus(tmp_path, ''))
+    assert not corpus
+    assert not isinstance(DirTree(corpus).file_names, SharedIterator)
+
+
+def test_pickle_maps_again(tmp_path):
+    corpus = NameCorpus(write_corpus(tmp_path, 'a\nb\n'))
+    copy = pickle.loads(pickle.dumps(corpus))
+    assert copy.path == corpus.path
+    assert copy[1] == 'b'
+
+
+def test_dir_tree_draws_file_names_from_corpus(tmp_path):
+    corpus = NameCorpus(write_corpus(tmp_path, 'a\nb\nc\n'))
+    dir_tree = DirTree(corpus)
+    dir_tree.append_node()
+    directory = dir_tree.last_node.data
+    assert [directory.touch() for _ in range(4)] == ['a', 'b', 'c', 'a']
@@ -0,0 +1,66 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import collections
+import logging
+import random
+import threading
+from server.request_actions import request_action
+from tree.dirtree import DirTree
+from utils.shell_utils import NAME_CHARS, NameGenerator
+
+
+def test_lengths_and_alphabet():
+    random.seed(0)
+    names = NameGenerator(16, 64)
+    drawn = [next(names) for _ in range(5000)]
+    assert min(map(len, drawn)) == 16
+    assert max(map(len, drawn)) == 64
+    assert set(''.join(drawn)) == set(NAME_CHARS)
+
+
+def test_fixed_length():
+    random.seed(0)
+    names = NameGenerator(64, chunk=10)
+    assert all(len(next(names)) == 64 for _ in range(25))
+
+
+def test_characters_are_uniform():
+    random.seed(1)
+    names = NameGenerator(64)
+    counts = collections.Counter(''.join(next(names) for _ in range(10000)))
+    expected = 64 * 10000 / len(NAME_CHARS)
+    assert all(abs(count - expected) < 0.05 * expected for count in counts.values())
+
+
+def test_same_seed_same_names():
+    logger = logging.getLogger('test')
+
+    def run():
+        random.seed(7)
+        dir_tree = DirTree()
+        dir_tree.append_node()
+        node = dir_tree.last_node
+        dir_tree.add_synced_node(node.identifier, node.tag)
+        node.data.ondisk = True
+        return [request_action(action, logger, dir_tree)['target'] for action in ['touch', 'touch', 'mkdir']]
+
+    assert run() == run()
+
+
+def test_shared_between_threads():
+    random.seed(2)
+    names = NameGenerator(16, chunk=100)
+    drawn = []
+
+    def draw():
+        drawn.extend(next(names) for _ in range(1000))
+
+    threads = [threading.Thread(target=draw) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(drawn) == 4000
+    assert all(len(name) == 16 for name in drawn)
@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import select
+import threading
+import time
+import pytest
+from client.pipeline import KeyedExecutor, job_paths
+
+
+def wait_results(executor, count, timeout=5):
+    results = []
+    deadline = time.time() + timeout
+    while len(results) < count:
+        assert time.time() < deadline
+        select.select([executor.fileno()], [], [], 0.1)
+        results.extend(executor.results())
+    return results
+
+
+def test_same_key_runs_in_order():
+    executor = KeyedExecutor(8)
+    order = []
+
+    def job(key, i):
+        time.sleep(0.001 * (i % 3))
+        order.append((key, i))
+        return i
+
+    for i in range(30):
+        for key in ('a', 'b', 'c'):
+            executor.submit((key,), (key, i), job, key, i)
+    results = wait_results(executor, 90)
+    executor.shutdown()
+    assert sorted(handle for handle, _ in results) == sorted((key, i) for i in range(30) for key in 'abc')
+    for key in 'abc':
+        assert [i for k, i in order if k == key] == list(range(30))
+    assert executor.stats['max_depth'] <= 3
+
+
+def test_different_keys_run_concurrently():
+    executor = KeyedExecutor(4)
+    barrier = threading.Barrier(4, timeout=5)
+    for key in range(4):
+        executor.submit((key,), key, barrier.wait)
+    wait_results(executor, 4)
+    executor.shutdown()
+    assert executor.stats['max_depth'] == 4
+    assert executor.average_depth() > 1
+
+
+def test_depth_bounds_running_jobs():
+    executor = KeyedExecutor(2)
+    for key in range(20):
+        executor.submit((key,), key, time.sleep, 0.002)
+    assert len(wait_results(executor, 20)) == 20
+    executor.shutdown()
+    assert executor.stats['jobs'] == 20
+    assert executor.stats['max_depth'] <= 2
+
+
+def test_rename_exist_then_write_to_its_destination():
+    executor = KeyedExecutor(4)
+    order = []
+    rename_started = threading.Event()
+
+    def rename():
+        rename_started.set()
+        time.sleep(0.05)
+        order.append('rename_exist')
+
+    rename_exist = {'target': '/d1/src', 'rename_source': '/d1/src', 'rename_dest': '/d2/dst'}
+    write = {'target': '/d2/dst', 'offset': 0}
+    executor.submit(job_paths(rename_exist), 1, rename)
+    rename_started.wait(5)
+    executor.submit(job_paths(write), 2, order.append, 'write')
+    # Nothing in common with either of them, doesn't wait
+    executor.submit(job_paths({'target': '/d3/other'}), 3, order.append, 'stat')
+    wait_results(executor, 3)
+    executor.shutdown()
+    assert order == ['stat', 'rename_exist', 'write']
+
+
+def test_job_waits_for_each_of_its_keys():
+    executor = KeyedExecutor(4)
+    order = []
+    release = {key: threading.Event() for key in 'ab'}
+
+    def job(key):
+        release[key].wait(5)
+        order.append(key)
+
+    executor.submit(('a',), 'a', job, 'a')
+    executor.submit(('b',), 'b', job, 'b')
+    executor.submit(('a', 'b'), 'ab', order.append, 'ab')
+    release['b'].set()
+    time.sleep(0.02)
+    assert order == ['b']
+    release['a'].set()
+    wait_results(executor, 3)
+    executor.shutdown()
+    assert order == ['b', 'a', 'ab']
+
+
+def test_rename_paths():
+    assert job_paths({'target': '/d1/f'}) == ('/d1/f',)
+    assert job_paths({'target': '/d1/f', 'rename_dest': 'g'}) == ('/d1/f', '/d1/g')
+    assert job_paths({'target': '/d1/f', 'rename_dest': '/d2/g'}) == ('/d1/f', '/d2/g')
+
+
+def test_bad_depth():
+    with pytest.raises(ValueError):
+        KeyedExecutor(0)
@@ -0,0 +1,122 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import errno
+import itertools
+import logging
+import random
+import threading
+import time
+import pytest
+from client import response_actions as client_actions
+from server.prepopulate import Prepopulation
+from server.request_actions import request_action
+from server.response_actions import response_action
+from tree.dirtree import TRACKED_FILE_BYTES, DirTree
+
+logger = logging.getLogger('test')
+
+
+def populate(dir_tree, mount_point, dirs, files_per_dir, chunk_files=4):
+    """Run a pre-population against a local directory, results come back once every job handed out so far ran"""
+    populator = Prepopulation(dir_tree, dirs, files_per_dir, lambda action, data: (action, data), threading.Event(),
+                              logger, chunk_files)
+    in_flight = []
+
+    def complete():
+        for action, data in in_flight:
+            result = client_actions.response_action(action, mount_point, data)
+            message = {'result': 'success', 'action': action, 'target': data['target'],
+                       'timestamp': time.time_ns(), 'data': result}
+            response_action(logger, message, dir_tree, data)
+            populator.job_done(data, message)
+        in_flight.clear()
+
+    for job in populator.jobs():
+        if job is None:
+            complete()
+        else:
+            in_flight.append(job)
+    assert not in_flight
+    return populator
+
+
+def test_prepopulate_builds_namespace(tmp_path):
+    random.seed(1)
+    dir_tree = DirTree(depth=2, width=3)
+    populator = populate(dir_tree, str(tmp_path), 10, 9)
+    assert populator.stats['dirs'] == 10
+    assert populator.stats['files'] == 90
+    assert len(dir_tree.synced_nodes) == 10
+    for nid, path in dir_tree.synced_nodes.items():
+        directory = dir_tree.get_dir(nid).data
+        assert directory.ondisk and directory.size == 9
+        assert sorted(f.name for f in directory.list_files()) == sorted(
+            entry.name for entry in os.scandir(tmp_path / path) if entry.is_file())
+        assert all(f.ondisk for f in directory.list_files())
+    # Subdirectories were created once their parents were on disk
+    assert any('/' in path for path in dir_tree.synced_nodes.values())
+    # Pre-populated directories aren't mkdir targets of the measured phase
+    assert not dir_tree.nids
+
+
+def test_prepopulated_files_are_operated_on(tmp_path):
+    random.seed(2)
+    dir_tree = DirTree(width=4)
+    populate(dir_tree, str(tmp_path), 4, 10)
+    data = request_action('stat', logger, dir_tree)
+    assert os.path.isfile(str(tmp_path) + data['target'])
+
+
+def test_prepopulate_stops_when_layout_is_full(tmp_path):
+    random.seed(3)
+    dir_tree = DirTree(width=2)
+    populator = populate(dir_tree, str(tmp_path), 5, 1)
+    assert populator.stats['dirs'] == 2
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_prepopulate_fills_directories(tmp_path):
+    random.seed(4)
+    dir_tree = DirTree(width=2)
+    dir_tree.set_budget(5)
+    populate(dir_tree, str(tmp_path), 4, 8, chunk_files=3)
+    assert len(dir_tree.full_nodes) == 4
+    assert dir_tree.memory_used() >= 4 * 8 * TRACKED_FILE_BYTES
+
+
+def test_failed_populate_frees_its_slot():
+    dir_tree = DirTree(width=2)
+    populator = Prepopulation(dir_tree, 2, 5, lambda action, data: (action, data), threading.Event(), logger,
+                              chunk_files=2)
+    jobs = populator.jobs()
+    in_flight = list(itertools.takewhile(bool, jobs))
+    assert len(in_flight) == 6
+    for i, (action, data) in enumerate(in_flight):
+        message = {'result': 'failed', 'action': action, 'target': '/mnt/' + data['target'], 'error_code': errno.EIO,
+                   'error_message': 'Input/output error', 'timestamp': time.time_ns(), 'data': {}}
+        response_action(logger, message, dir_tree, data)
+        populator.job_done(data, message)
+        # A directory is dropped once the last of its 3 chunks failed
+        assert (dir_tree.get_node(data['dir_id']) is None) == (i % 3 == 2)
+    assert next(jobs, None) is None
+    assert dir_tree.get_size() == 1
+    assert dir_tree.memory_used() == 0
+    assert populator.stats['failed'] == 10
+
+
+def test_populate_reports_failed_files(tmp_path):
+    data = {'target': 'dir', 'files': ['a', 'missing/b', 'c']}
+    result = client_actions.populate(str(tmp_path), data)
+    assert result['mkdir']
+    assert [name for name, _ in result['failed']] == ['missing/b']
+    # A re-queued job finds the directory and its files already there
+    result = client_actions.populate(str(tmp_path), data)
+    assert not result['mkdir']
+    assert [name for name, _ in result['failed']] == ['missing/b']
+
+
+def test_bad_prepopulate():
+    with pytest.raises(ValueError):
+        Prepopulation(DirTree(), 1, 1, None, threading.Event(), logger, chunk_files=0)
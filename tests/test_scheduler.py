@@ -0,0 +1,125 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import random
+import pytest
+from server.scheduler import WorkerScheduler
+
+
+def test_empty_scheduler_has_no_worker():
+    scheduler = WorkerScheduler(10)
+    assert scheduler.next_worker() is None
+
+
+def test_picks_least_loaded_worker():
+    scheduler = WorkerScheduler(10)
+    for worker_id in (b'a', b'b', b'c'):
+        scheduler.add(worker_id)
+    scheduler.job_dispatched(b'a')
+    scheduler.job_dispatched(b'a')
+    scheduler.job_dispatched(b'b')
+    assert scheduler.next_worker() == b'c'
+    scheduler.job_dispatched(b'c')
+    scheduler.job_dispatched(b'c')
+    assert scheduler.next_worker() == b'b'
+    scheduler.job_done(b'a')
+    scheduler.job_done(b'a')
+    assert scheduler.next_worker() == b'a'
+
+
+def test_equally_loaded_workers_round_robin():
+    scheduler = WorkerScheduler(10)
+    for worker_id in (b'a', b'b', b'c'):
+        scheduler.add(worker_id)
+    picked = []
+    for _ in range(6):
+        worker_id = scheduler.next_worker()
+        scheduler.job_dispatched(worker_id)
+        picked.append(worker_id)
+    assert sorted(picked[:3]) == [b'a', b'b', b'c']
+    assert picked[:3] == picked[3:]
+
+
+def test_none_when_all_workers_full():
+    scheduler = WorkerScheduler(2)
+    scheduler.add(b'a')
+    scheduler.job_dispatched(b'a')
+    scheduler.job_dispatched(b'a')
+    assert scheduler.next_worker() is None
+    scheduler.job_done(b'a')
+    assert scheduler.next_worker() == b'a'
+
+
+def test_remove_worker():
+    scheduler = WorkerScheduler(10)
+    for worker_id in (b'a', b'b', b'c'):
+        scheduler.add(worker_id)
+    scheduler.remove(b'a')
+    assert b'a' not in scheduler
+    assert len(scheduler) == 2
+    with pytest.raises(KeyError):
+        scheduler.job_dispatched(b'a')
+
+
+def test_duplicate_add_rejected():
+    scheduler = WorkerScheduler(10)
+    scheduler.add(b'a')
+    with pytest.raises(KeyError):
+        scheduler.add(b'a')
+
+
+def test_matches_sorted_selection_under_random_load():
+    """Heap selection must always return a worker with the minimal load."""
+    random.seed(1)
+    scheduler = WorkerScheduler(1000)
+    loads = {}
+    for i in range(64):
+        scheduler.add(i)
+        loads[i] = 0
+    for _ in range(5000):
+        op = random.random()
+        if op < 0.05 and len(loads) > 1:
+            victim = random.choice(list(loads))
+            scheduler.remove(victim)
+            del loads[victim]
+        elif op < 0.6:
+            worker_id = scheduler.next_worker()
+            assert loads[worker_id] == min(loads.values())
+            scheduler.job_dispatched(worker_id)
+            loads[worker_id] += 1
+        else:
+            busy = [w for w, load in loads.items() if load]
+            if busy:
+                worker_id = random.choice(busy)
+                scheduler.job_done(worker_id)
+                loads[worker_id] -= 1
+        for worker_id, load in loads.items():
+            assert scheduler.load(worker_id) == load
+
+
+def test_worker_credits_capped_by_window():
+    scheduler = WorkerScheduler(8)
+    scheduler.add(b'a', credits=4)
+    scheduler.add(b'b', credits=100)
+    scheduler.add(b'c')
+    assert scheduler.free_credits(b'a') == 4
+    assert scheduler.free_credits(b'b') == 8
+    assert scheduler.free_credits(b'c') == 8
+
+
+def test_batch_dispatch_consumes_credits():
+    scheduler = WorkerScheduler(8)
+    scheduler.add(b'a', credits=4)
+    scheduler.add(b'b')
+    scheduler.job_dispatched(b'b', 6)
+    # b has 2 free credits left, a still has all 4 of its own
+    assert scheduler.next_worker() == b'a'
+    scheduler.job_dispatched(b'a', 4)
+    assert scheduler.next_worker() == b'b'
+    scheduler.job_dispatched(b'b', 2)
+    assert scheduler.next_worker() is None
+    scheduler.job_done(b'a', 3)
+    assert scheduler.next_worker() == b'a'
+    assert scheduler.load(b'a') == 1
+    assert scheduler.free_credits(b'a') == 3
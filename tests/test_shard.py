@@ -0,0 +1,39 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import zmq
+from server.shard import controller_socket, merge_stats, shard_endpoint
+
+
+def test_merge_stats():
+    shard_stats = [
+        {'total': 3, 'success': {'total': 2, 'mkdir': 2}, 'failed': {'total': 1, 'mkdir': 1}},
+        {'total': 5, 'success': {'total': 5, 'mkdir': 1, 'touch': 4}, 'failed': {'total': 0, 'mkdir': 0}},
+    ]
+    assert merge_stats(shard_stats) == {'total': 8,
+                                        'success': {'total': 7, 'mkdir': 3, 'touch': 4},
+                                        'failed': {'total': 1, 'mkdir': 1}}
+
+
+def test_merge_stats_empty():
+    assert merge_stats([]) == {}
+
+
+def test_shard_socket_sees_router_frames():
+    """A shard gets the same [worker_id, payload] frames the router forwards, and replies the same way"""
+    context = zmq.Context()
+    router_link = context.socket(zmq.DEALER)
+    router_link.bind(shard_endpoint(0))
+    shard_socket = controller_socket(context, (0, 2))
+    try:
+        router_link.send_multipart([b'worker-1', b'payload'])
+        assert shard_socket.poll(5000)
+        assert shard_socket.recv_multipart() == [b'worker-1', b'payload']
+        shard_socket.send_multipart([b'worker-1', b'reply'])
+        assert router_link.poll(5000)
+        assert router_link.recv_multipart() == [b'worker-1', b'reply']
+    finally:
+        shard_socket.close(linger=0)
+        router_link.close(linger=0)
+        context.term()
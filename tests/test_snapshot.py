@@ -0,0 +1,176 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import logging
+import random
+import threading
+import pytest
+from server.request_actions import request_action
+from server.response_actions import response_action
+from server.snapshot import FILE_FIELDS, TreeSnapshot, file_fields, load_snapshot
+from tree.dirtree import DirTree, dir_nid
+
+logger = logging.getLogger('test')
+
+
+@pytest.fixture
+def run_jobs(success_result):
+    """run_jobs(dir_tree, count) requests count random jobs and applies their success results"""
+    actions = ['mkdir', 'touch', 'touch', 'touch', 'stat', 'delete', 'rename', 'truncate']
+
+    def run(dir_tree, count):
+        for _ in range(count):
+            action = random.choice(actions)
+            data = request_action(action, logger, dir_tree, io_type='sequential')
+            if data:
+                response_action(logger, success_result(action, data), dir_tree, data)
+    return run
+
+
+def tree_state(dir_tree):
+    return {path: (node.data.ondisk, node.data.size, node.creation_time,
+                   sorted(file_fields(f) for f in node.data.list_files()))
+            for path, node in ((path, dir_tree.get_dir_by_name(path)) for path in dir_tree.synced_nodes.values())}
+
+
+def make_snapshot(dir_tree, path):
+    return TreeSnapshot(dir_tree, str(path), threading.Event(), logger)
+
+
+def test_full_snapshot_roundtrip(tmp_path, run_jobs):
+    random.seed(1)
+    dir_tree = DirTree(depth=2, width=3)
+    run_jobs(dir_tree, 500)
+    make_snapshot(dir_tree, tmp_path / 'snapshot').write_full()
+    restored = DirTree(depth=2, width=3)
+    assert load_snapshot(str(tmp_path / 'snapshot'), restored) == len(dir_tree.synced_nodes)
+    assert tree_state(restored) == tree_state(dir_tree)
+    assert 'tid' in FILE_FIELDS
+
+
+def test_incremental_snapshots(tmp_path, run_jobs):
+    random.seed(2)
+    dir_tree = DirTree(depth=2, width=3)
+    snapshot = make_snapshot(dir_tree, tmp_path / 'snapshot')
+    snapshot.write_full()
+    for _ in range(5):
+        run_jobs(dir_tree, 200)
+        # Directories dropped from the model must be dropped on restore as well
+        path = dir_tree.synced_nodes.random_value()
+        dir_tree.remove_dir_by_name(path)
+        dir_tree.remove_synced_node(dir_nid(path))
+        snapshot.write_incremental()
+    restored = DirTree(depth=2, width=3)
+    load_snapshot(str(tmp_path / 'snapshot'), restored)
+    assert tree_state(restored) == tree_state(dir_tree)
+    # Restored tree keeps growing within its layout
+    run_jobs(restored, 200)
+
+
+def test_full_dirs_roundtrip(tmp_path, run_jobs):
+    random.seed(4)
+    dir_tree = DirTree(depth=1, width=3)
+    dir_tree.set_budget(5)
+    run_jobs(dir_tree, 300)
+    assert dir_tree.full_nodes
+    make_snapshot(dir_tree, tmp_path / 'snapshot').write_full()
+    restored = DirTree(depth=1, width=3)
+    load_snapshot(str(tmp_path / 'snapshot'), restored)
+    assert sorted(restored.full_nodes.keys()) == sorted(dir_tree.full_nodes.keys())
+    assert tree_state(restored) == tree_state(dir_tree)
+    full_files = [sorted(file_fields(f) for f in dir_tree.get_node(nid).data.list_files())
+                  for nid in sorted(dir_tree.full_nodes.keys())]
+    assert full_files == [sorted(file_fields(f) for f in restored.get_node(nid).data.list_files())
+                          for nid in sorted(restored.full_nodes.keys())]
+
+
+def test_compaction(tmp_path, run_jobs):
+    random.seed(3)
+    dir_tree = DirTree(depth=1, width=2)
+    snapshot = make_snapshot(dir_tree, tmp_path / 'snapshot')
+    run_jobs(dir_tree, 100)
+    snapshot.write_full()
+    full_writes = []
+    write_full = snapshot.write_full
+    snapshot.write_full = lambda: full_writes.append(write_full())
+    for _ in range(10):
+        run_jobs(dir_tree, 20)
+        snapshot.write()
+    assert full_writes
+    assert os.path.getsize(tmp_path / 'snapshot') == snapshot._full_size + snapshot._appended
+    restored = DirTree()
+    load_snapshot(str(tmp_path / 'snapshot'), restored)
+    assert tree_state(restored) == tree_state(dir_tree)
+
+
+def test_truncated_snapshot(tmp_path, run_jobs):
+    random.seed(4)
+    dir_tree = DirTree(depth=1, width=2)
+    run_jobs(dir_tree, 200)
+    snapshot = make_snapshot(dir_tree, tmp_path / 'snapshot')
+    snapshot.write_full()
+    state = tree_state(dir_tree)
+    run_jobs(dir_tree, 50)
+    snapshot.write_incremental()
+    with open(tmp_path / 'snapshot', 'r+b') as f:
+        f.truncate(snapshot._full_size + 10)
+    restored = DirTree()
+    load_snapshot(str(tmp_path / 'snapshot'), restored)
+    assert tree_state(restored) == state
+
+
+def test_not_a_snapshot(tmp_path):
+    (tmp_path / 'journal').write_text('{"job_id": 1}\n')
+    with pytest.raises(ValueError):
+        load_snapshot(str(tmp_path / 'journal'), DirTree())
+
+
+def test_dirs_marked_dirty_after_the_change(run_jobs, success_result):
+    random.seed(5)
+    dir_tree = DirTree(depth=1, width=3)
+    run_jobs(dir_tree, 100)
+    dir_tree.take_dirty()
+    # Looking a directory up doesn't change it
+    dir_tree.get_dir(dir_tree.synced_nodes.random_key())
+    assert not dir_tree.take_dirty()
+    data = request_action('touch', logger, dir_tree)
+    assert dir_tree.take_dirty() == {data['dir_id']}
+    response_action(logger, success_result('touch', data), dir_tree, data)
+    assert dir_tree.take_dirty() == {data['dir_id']}
+
+
+def test_failed_write_is_retried_in_full(tmp_path, run_jobs):
+    random.seed(6)
+    dir_tree = DirTree(depth=1, width=3)
+    run_jobs(dir_tree, 200)
+    snapshot = make_snapshot(dir_tree, tmp_path / 'missing' / 'snapshot')
+    snapshot._write_logged()
+    assert snapshot._full_size == 0
+    (tmp_path / 'missing').mkdir()
+    run_jobs(dir_tree, 50)
+    snapshot._write_logged()
+    restored = DirTree()
+    load_snapshot(str(tmp_path / 'missing' / 'snapshot'), restored)
+    assert tree_state(restored) == tree_state(dir_tree)
+
+
+def test_touch_after_resume_keeps_restored_files(tmp_path, run_jobs):
+    random.seed(7)
+    names = [f'name{i}' for i in range(1000)]
+    dir_tree = DirTree(file_names=names)
+    run_jobs(dir_tree, 300)
+    make_snapshot(dir_tree, tmp_path / 'snapshot').write_full()
+    # The resumed run replays the same names
+    restored = DirTree(file_names=names)
+    load_snapshot(str(tmp_path / 'snapshot'), restored)
+
+    def files_of(tree):
+        return {f'/{path}/{f.name}': file_fields(f) for path in tree.synced_nodes.values()
+                for f in tree.get_dir_by_name(path).data.list_files()}
+    restored_files = files_of(restored)
+    assert any(fields[1] for fields in restored_files.values())
+    touched = {request_action('touch', logger, restored)['target'] for _ in range(50)}
+    assert not touched & set(restored_files)
+    after = files_of(restored)
+    assert {target: after[target] for target in restored_files} == restored_files
@@ -2,8 +2,11 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+import itertools
 import random
+import pytest
 from server.async_controller import weighted_choice
+from server.sampler import SAMPLE_CHUNK, WeightedSampler
 
 
 def test_single_option():
@@ -33,3 +36,51 @@ def test_no_index_error_many_iterations():
     for _ in range(10000):
         result = weighted_choice(choices)
         assert result in ('a', 'b')
+
+
+def test_sampler_distribution_matches_weights():
+    random.seed(42)
+    choices = [('mkdir', 5), ('touch', 30), ('stat', 30), ('delete', 10), ('rename', 25), ('list', 0)]
+    draws = 100000
+    results = list(itertools.islice(WeightedSampler(choices), draws))
+    for value, weight in choices:
+        expected = draws * weight / 100
+        # Well within 5 standard deviations of the binomial count
+        tolerance = 5 * (draws * weight / 100 * (1 - weight / 100)) ** 0.5
+        assert abs(results.count(value) - expected) <= tolerance, value
+
+
+def test_sampler_reproducible_with_seed():
+    choices = [('a', 20), ('b', 30), ('c', 50)]
+    random.seed(7)
+    first = WeightedSampler(choices).sample(1000)
+    random.seed(7)
+    sampler = WeightedSampler(choices)
+    random.random()  # Other users of the global generator don't shift the sampler
+    assert sampler.sample(1000) == first
+
+
+def test_sampler_rejects_zero_total_weight():
+    with pytest.raises(ValueError):
+        WeightedSampler([('a', 0), ('b', 0)])
+
+
+def test_sampler_draws_in_chunks():
+    """Draws come from one random.choices() call per chunk on the precomputed cumulative weights, instead of a call
+    per draw"""
+    random.seed(0)
+    choices = [('mkdir', 5), ('touch', 30), ('stat', 30), ('delete', 10), ('rename', 10), ('rename_exist', 10),
+               ('truncate', 5)]
+    draws = 50000
+    sampler = WeightedSampler(choices)
+    calls = []
+    sample = sampler._random.choices
+
+    def counting_choices(population, cum_weights, k):
+        assert cum_weights is sampler.cum_weights
+        calls.append(k)
+        return sample(population, cum_weights=cum_weights, k=k)
+
+    sampler._random.choices = counting_choices
+    assert len(list(itertools.islice(sampler, draws))) == draws
+    assert calls == [SAMPLE_CHUNK] * -(-draws // SAMPLE_CHUNK)
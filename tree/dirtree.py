@@ -1,13 +1,33 @@
-import datetime
+import collections
 import threading
+import time
 import xxhash
 import random
 
-import uuid
-
 import treelib
 
-from utils.shell_utils import StringUtils
+from config import MAX_FILES_PER_DIR, MEMORY_BUDGET_MB
+from utils.name_corpus import NameCorpus
+from utils.shell_utils import NameGenerator, StringUtils
+
+
+EMPTY_HASH = 0xef46db3751d8e999  # xxhash64 of no data
+FILE_UUID_BITS = 20
+DEFAULT_TREE_DEPTH = 1
+DEFAULT_TREE_WIDTH = 10
+
+# Directory lifecycle
+DIR_ACTIVE = 'active'  # Synced, target of every file operation and parent of new directories
+DIR_FULL = 'full'  # Reached max_files_per_dir, read-only: read, stat, list and verification of failures
+DIR_RETIRED = 'retired'  # Evicted from memory to stay within the memory budget, only a RetiredDir summary is left
+EVICTION_POLICIES = ('oldest', 'random')
+TRACKED_FILE_BYTES = 421  # Controller memory per file, File record with its name and index entry, see micro_bench memory
+
+RetiredDir = collections.namedtuple('RetiredDir', ['path', 'files', 'ondisk_files', 'ondisk_bytes'])
+
+
+def new_file_uuid():
+    return random.getrandbits(FILE_UUID_BITS)
 
 
 class TreeNode:
@@ -16,6 +36,9 @@ class TreeNode:
         self.identifier = identifier
         self.data = data
         self.parent = parent
+        self.level = 0  # Nesting level, directories right under the root are level 1
+        self.children = 0  # Subdirectories created under this directory
+        self.creation_time = 0
 
 
 class Tree:
@@ -43,58 +66,453 @@ class Tree:
         return len(self._nodes)
 
 
+class IndexedDict(object):
+    """Dict which also keeps its keys and values in dense lists, so a random entry can be picked in O(1).
+
+    Deleting moves the last entry into the freed position (swap-remove), so insert, delete and random
+    selection are all O(1) and nothing is copied to pick an entry. Iteration order is not insertion order
+    once entries were deleted.
+    """
+
+    def __init__(self, mapping=None):
+        self._index = {}  # key -> position in _keys and _values
+        self._keys = []
+        self._values = []
+        if mapping:
+            for key, value in mapping.items():
+                self[key] = value
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key, value):
+        try:
+            self._values[self._index[key]] = value
+        except KeyError:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._values.append(value)
+
+    def __delitem__(self, key):
+        pos = self._index.pop(key)
+        last_key = self._keys.pop()
+        last_value = self._values.pop()
+        if pos < len(self._keys):
+            self._keys[pos] = last_key
+            self._values[pos] = last_value
+            self._index[last_key] = pos
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def popitem(self):
+        """Remove and return the most recently added entry, unless deletes reordered the entries"""
+        if not self._keys:
+            raise KeyError('popitem(): dictionary is empty')
+        key = self._keys.pop()
+        value = self._values.pop()
+        del self._index[key]
+        return key, value
+
+    def random_key(self):
+        """Raises IndexError when empty"""
+        return random.choice(self._keys)
+
+    def random_value(self):
+        return random.choice(self._values)
+
+    def random_item(self):
+        if not self._keys:
+            raise IndexError("random_item() of an empty IndexedDict")
+        i = random.randrange(len(self._keys))
+        return self._keys[i], self._values[i]
+
+    def sample_values(self, k):
+        return random.sample(self._values, k)
+
+    def sample_keys(self, k):
+        return random.sample(self._keys, k)
+
+
+class SharedIterator(object):
+    """Iterator which can be advanced from several threads, generators raise ValueError when they are"""
+
+    def __init__(self, iterable):
+        self._lock = threading.Lock()
+        self._iterator = iter(iterable)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._iterator)
+
+
+def shard_of(nid, shards):
+    """Index of the controller shard which owns the directory with this nid"""
+    return nid % shards
+
+
+def dir_nid(path):
+    """Directories are indexed by the integer hash of their path relative to the mount point. It's computed once
+    when the directory is created and travels with its jobs as dir_id, results are looked up by it directly.
+    """
+    return xxhash.xxh64_intdigest(path)
+
+
+def file_id(name):
+    """Files are keyed by the integer hash of their name in their directory, and travel with jobs as file_id"""
+    return xxhash.xxh64_intdigest(name)
+
+
+def split_target(target):
+    """
+    Args:
+        target: str, '/<dir path>/<file name>', the dir path may have any number of levels
+
+    Returns:
+        tuple (dir path, file name)
+    """
+    dir_path, _, name = target.lstrip('/').rpartition('/')
+    return dir_path, name
+
+
 class DirTree(object):
-    def __init__(self, file_names=None):
-        self._lock = threading.RLock()
+    def __init__(self, file_names=None, shard=None, depth=DEFAULT_TREE_DEPTH, width=None):
+        """
+        Args:
+            file_names: NameCorpus or list, names of new files, random ones when None or empty
+            shard: tuple (index, count), the tree only creates directories owned by this shard
+            depth: int, max nesting level of directories, 1 keeps all of them right under the root
+            width: int, max subdirectories created under each directory, None for no limit
+        """
+        # Writers serialize on the lock, readers don't take it. Lookups are single dict reads, and a random
+        # pick which races with a removal gets an IndexError or a node which was just removed, the same outcomes
+        # as picking from an empty tree or a moment earlier.
+        self._lock = threading.Lock()
+        self.shard = shard
         self._dir_tree = Tree()
         self._tree_base = self._dir_tree.create_node('Root', 'root')
         self._last_node = self._tree_base
-        if file_names:
-            self.file_names = StringUtils.string_from_file_generator(file_names)
+        # File names are drawn by all directories of the tree, from whichever thread touches a file
+        if isinstance(file_names, NameCorpus) and file_names:
+            self.file_names = SharedIterator(file_names.names())
+        elif file_names:
+            self.file_names = SharedIterator(StringUtils.string_from_file_generator(file_names))
         else:
             self.file_names = StringUtils.random_string_generator()
-        self._nids = {}
-        self.synced_nodes = {}
+        # Names of new directories and of rename destinations
+        self.names = NameGenerator(64)
+        self._nids = IndexedDict()
+        self.synced_nodes = IndexedDict()
+        # Directories changed by a request or a result since the last snapshot, see mark_dirty() and take_dirty()
+        self._dirty = set()
+        # Directories new directories can be created in: on disk, below max depth and with less than width children
+        self._open_dirs = IndexedDict()
+        self.set_layout(depth, width)
+        # Lifecycle, synced_nodes are the active directories
+        self.full_nodes = IndexedDict()
+        self._filled = collections.deque()  # nids in the order their directories filled up, for 'oldest' eviction
+        self.retired = {}  # nid -> RetiredDir
+        self._full_files = 0  # Files held by full directories
+        self._full_counts = {}  # nid -> files of a full directory counted in _full_files
+        self.set_budget(MAX_FILES_PER_DIR)
+
+    def set_layout(self, depth, width):
+        if depth < 1 or (width is not None and width < 1):
+            raise ValueError(f"Bad directory tree layout. Got depth {depth} and width {width}, 1 or more is expected")
+        with self._lock:
+            self.depth = depth
+            self.width = width
+            self._update_open(self._tree_base)
+            for nid in self.synced_nodes.keys():
+                node = self._dir_tree.get_node(nid)
+                if node is not None:
+                    self._update_open(node)
+
+    def set_budget(self, max_files_per_dir, memory_budget_mb=MEMORY_BUDGET_MB, eviction='oldest'):
+        """
+        Args:
+            max_files_per_dir: int, files after which a directory is full
+            memory_budget_mb: int, memory for the files of the model, None keeps every full directory
+            eviction: str, which full directory is retired first, one of EVICTION_POLICIES
+        """
+        if max_files_per_dir < 1 or (memory_budget_mb is not None and memory_budget_mb <= 0) or \
+                eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Bad directory tree budget. Got max_files_per_dir {max_files_per_dir}, memory_budget_mb "
+                             f"{memory_budget_mb} and eviction {eviction}, positive values and one of "
+                             f"{EVICTION_POLICIES} are expected")
+        with self._lock:
+            self.max_files_per_dir = max_files_per_dir
+            self.memory_budget = memory_budget_mb * 2 ** 20 if memory_budget_mb else None
+            self.eviction = eviction
+
+    def memory_used(self):
+        """Bytes the budget accounts for: the files of full directories, and room for active directories and those
+        waiting for their mkdir to fill up
+        """
+        active_dirs = self._dir_tree.size() - 1 - len(self.full_nodes)
+        return (self._full_files + active_dirs * self.max_files_per_dir) * TRACKED_FILE_BYTES
+
+    def _evict(self, needed=0):
+        """Retire full directories until needed more bytes fit in the budget.
+
+        Returns:
+            bool, False when it can't be done
+        """
+        if self.memory_budget is None:
+            return True
+        while self.memory_used() + needed > self.memory_budget:
+            if not self.full_nodes:
+                return False
+            if self.eviction == 'oldest' and self._filled:
+                nid = self._filled.popleft()
+                if nid not in self.full_nodes:
+                    continue  # Removed meanwhile
+            else:
+                nid = self.full_nodes.random_key()
+            self._retire(nid)
+        return True
+
+    def _retire(self, nid):
+        path = self.full_nodes[nid]
+        del self.full_nodes[nid]
+        self._dirty.add(nid)
+        node = self._dir_tree.get_node(nid)
+        files = node.data.list_files()
+        self._full_files -= self._full_counts.pop(nid)
+        ondisk = [f for f in files if f.ondisk]
+        self.retired[nid] = RetiredDir(path, len(files), len(ondisk), sum(f.size for f in ondisk))
+        self._dir_tree.remove_node(nid)
+
+    def dir_state(self, nid):
+        """Lifecycle state of a synced directory, None for directories the model doesn't know or still creates"""
+        if nid in self.synced_nodes:
+            return DIR_ACTIVE
+        if nid in self.full_nodes:
+            return DIR_FULL
+        if nid in self.retired:
+            return DIR_RETIRED
+        return None
+
+    def mark_full(self, nid):
+        """Move an active directory to the read-only full state. It no longer counts against the width of its
+        parent, so a new directory takes its place, and may be retired to make room within the memory budget.
+
+        Returns:
+            bool, False if the directory isn't active
+        """
+        with self._lock:
+            if nid not in self.synced_nodes:
+                return False
+            self._dirty.add(nid)
+            path = self.synced_nodes[nid]
+            del self.synced_nodes[nid]
+            if nid in self._open_dirs:
+                del self._open_dirs[nid]
+            node = self._dir_tree.get_node(nid)
+            self.full_nodes[nid] = path
+            if self.eviction == 'oldest':
+                self._filled.append(nid)
+            # Touches generated before it filled up and renames may still add files, the budget counts those
+            # taken now, and exactly as many are given back when it's retired or removed
+            self._full_counts[nid] = len(node.data.files_dict)
+            self._full_files += self._full_counts[nid]
+            parent = self._dir_tree.get_node(node.parent)
+            if parent is not None:
+                parent.children -= 1
+                self._update_open(parent)
+            self._evict()
+            return True
+
+    def _update_open(self, node):
+        if node.level < self.depth and (self.width is None or node.children < self.width) and \
+                (node is self._tree_base or node.identifier in self.synced_nodes):
+            self._open_dirs[node.identifier] = None
+        elif node.identifier in self._open_dirs:
+            del self._open_dirs[node.identifier]
 
     def append_node(self):
+        """Create a directory under a random open directory
+
+        Returns:
+            TreeNode, None when the tree is full or the memory budget has no room for another directory
+        """
         with self._lock:
-            directory = Directory(self.file_names)
-            name = directory.name
-            nid = xxhash.xxh64(name).hexdigest()
-            self._nids[nid] = name
-            new_node = self._dir_tree.create_node(name, nid, parent=self._tree_base.identifier, data=directory)
+            try:
+                parent = self._dir_tree.get_node(self._open_dirs.random_key())
+            except IndexError:
+                return None
+            # A new directory may fill up, full directories are retired to make room for it
+            if not self._evict(self.max_files_per_dir * TRACKED_FILE_BYTES):
+                return None
+            while True:
+                directory = Directory(self.file_names, name=next(self.names))
+                path = '/'.join([parent.tag, directory.name]) if parent.level else directory.name
+                nid = dir_nid(path)
+                if self.owns(nid):
+                    break
+            self._nids[nid] = path
+            new_node = self._dir_tree.create_node(path, nid, parent=parent.identifier, data=directory)
+            new_node.level = parent.level + 1
+            parent.children += 1
+            self._update_open(parent)
             self._last_node = new_node
+            return new_node
+
+    def owns(self, nid):
+        return self.shard is None or shard_of(nid, self.shard[1]) == self.shard[0]
 
     @property
     def last_node(self):
-        with self._lock:
-            return self._last_node
+        return self._last_node
 
     @property
     def nids(self):
         with self._lock:
-            return dict(self._nids)
+            return dict(self._nids.items())
 
     @nids.setter
     def nids(self, value):
         with self._lock:
-            self._nids = value
+            self._nids = IndexedDict(value)
 
     def get_size(self):
-        with self._lock:
-            return self._dir_tree.size()
+        return self._dir_tree.size()
 
     def get_last_node_tag(self):
+        return self._last_node.tag
+
+    def get_dir_by_name(self, path):
+        """Directory node by its path relative to the mount point"""
+        return self.get_dir(dir_nid(path))
+
+    def get_dir(self, nid):
+        """Directory node by its nid, the dir_id its jobs carry"""
+        return self._dir_tree.get_node(nid)
+
+    def get_node(self, nid):
+        return self._dir_tree.get_node(nid)
+
+    def mark_dirty(self, nid):
+        """Record that a request or a result changed the directory or its files, once the change is done.
+
+        Marked under the directory's lock, so a snapshot serializing the directory either sees the change or leaves
+        the mark for the next one. Removed directories are marked by remove_dir() and _retire().
+        """
+        node = self._dir_tree.get_node(nid)
+        if node is None:
+            return
+        with node.data._lock:
+            self._dirty.add(nid)
+
+    def take_dirty(self):
+        """Return the nids of directories which changed since the last call.
+
+        The nids are popped one by one rather than swapping the set, a mark_dirty() running meanwhile holds no
+        tree lock and would otherwise add to the set already handed out.
+        """
+        dirty = set()
+        pop = self._dirty.pop
         with self._lock:
-            return self._last_node.tag
+            try:
+                while True:
+                    dirty.add(pop())
+            except KeyError:
+                return dirty
 
-    def get_dir_by_name(self, name):
-        with self._lock:
-            return self._dir_tree.get_node(xxhash.xxh64(name).hexdigest())
+    def restore_dir(self, path, ondisk, size, creation_time):
+        """Add a synced directory of a snapshot. Parents have to be restored before their subdirectories.
 
-    def remove_dir_by_name(self, name):
+        Returns:
+            TreeNode
+        """
         with self._lock:
-            return self._dir_tree.remove_node(xxhash.xxh64(name).hexdigest())
+            parent_path, _, name = path.rpartition('/')
+            parent = self._dir_tree.get_node(dir_nid(parent_path)) if parent_path else self._tree_base
+            nid = dir_nid(path)
+            directory = Directory(self.file_names, name=name)
+            directory.ondisk = ondisk
+            directory.size = size
+            node = self._dir_tree.create_node(path, nid, parent=parent.identifier if parent else dir_nid(parent_path),
+                                              data=directory)
+            node.level = path.count('/') + 1
+            node.creation_time = creation_time
+            self.synced_nodes[nid] = path
+            self._update_open(node)
+            if parent is not None:
+                parent.children += 1
+                self._update_open(parent)
+            self._last_node = node
+            return node
+
+    def load_files(self, nid, files):
+        """Add files created outside of touch jobs, e.g. by pre-population, to a directory in one pass.
+
+        Returns:
+            TreeNode, None if the directory is no longer in the model
+        """
+        with self._lock:
+            self._dirty.add(nid)
+            node = self._dir_tree.get_node(nid)
+            if node is None:
+                return None
+            node.data.add_files(files)
+            node.data.size += len(files)
+            if nid in self.full_nodes:
+                self._full_counts[nid] += len(files)
+                self._full_files += len(files)
+            return node
+
+    def remove_dir_by_name(self, path):
+        return self.remove_dir(dir_nid(path))
+
+    def remove_dir(self, nid):
+        """Remove the directory from the model, it no longer counts against the width of its parent.
+        Its subdirectories stay, their paths are still valid on disk.
+        """
+        with self._lock:
+            self._dirty.add(nid)
+            node = self._dir_tree.get_node(nid)
+            if node is None:
+                return 0
+            if nid in self._open_dirs:
+                del self._open_dirs[nid]
+            if nid in self.full_nodes:
+                # Its parent slot was freed when it filled up
+                del self.full_nodes[nid]
+                self._full_files -= self._full_counts.pop(nid)
+            else:
+                parent = self._dir_tree.get_node(node.parent)
+                if parent is not None:
+                    parent.children -= 1
+                    self._update_open(parent)
+            return self._dir_tree.remove_node(nid)
 
     def remove_nid(self, nid):
         with self._lock:
@@ -102,29 +520,43 @@ class DirTree(object):
 
     def add_synced_node(self, nid, name):
         with self._lock:
+            self._dirty.add(nid)
             self.synced_nodes[nid] = name
+            node = self._dir_tree.get_node(nid)
+            if node is not None:
+                self._update_open(node)
 
     def remove_synced_node(self, nid):
         with self._lock:
             del self.synced_nodes[nid]
+            if nid in self._open_dirs:
+                del self._open_dirs[nid]
 
     def get_last_node_data(self):
-        with self._lock:
-            return self._last_node.data
+        return self._last_node.data
 
     def get_random_dir(self):
-        with self._lock:
-            try:
-                return self._dir_tree.get_node(random.choice(list(self._nids.keys())))
-            except IndexError:
-                return None
+        try:
+            return self._dir_tree.get_node(self._nids.random_key())
+        except IndexError:
+            return None
 
     def get_random_dir_synced(self):
-        with self._lock:
-            try:
-                return self._dir_tree.get_node(random.choice(list(self.synced_nodes.keys())))
-            except IndexError:
-                return None
+        try:
+            nid = self.synced_nodes.random_key()
+        except IndexError:
+            return None
+        return self._dir_tree.get_node(nid)
+
+    def get_random_dir_readable(self):
+        """Random active or full directory, for operations which don't modify it"""
+        active = len(self.synced_nodes)
+        try:
+            i = random.randrange(active + len(self.full_nodes))
+            nid = self.synced_nodes.keys()[i] if i < active else self.full_nodes.keys()[i - active]
+        except (IndexError, ValueError):
+            return None
+        return self._dir_tree.get_node(nid)
 
     def get_random_dir_not_synced(self):
         with self._lock:
@@ -134,134 +566,169 @@ class DirTree(object):
                 return None
 
     def get_random_dir_name(self):
-        with self._lock:
-            return self._dir_tree.get_node(random.choice(list(self._nids.keys()))).tag
+        return self._dir_tree.get_node(self._nids.random_key()).tag
 
     def get_random_dir_files(self):
-        with self._lock:
-            rand_dir = self.get_random_dir()
-            if not rand_dir:
-                return "/nodir/nofiles"
-            num_files = len(rand_dir.data.files)
-            if num_files == 0:
-                return "/{0}/nofiles".format(rand_dir.tag)
-            if num_files == 1:
-                max_files = 1
-            else:
-                max_files = random.randint(1, num_files)
-                if max_files > 10:
-                    max_files = 10
-            files = rand_dir.data.get_random_files(max_files)
-            filepaths = ""
-            for f in files:
-                if f.ondisk:
-                    filepaths += "/{0}/{1},".format(rand_dir.tag, f.name)
-            if not filepaths:
-                filepaths = "/{0}/nofiles".format(rand_dir.tag)
-            return filepaths
-
-
-def build_recursive_tree(tree, base, depth, width):
-    """
-    Args:
-        tree: Tree
-        base: Node
-        depth: int
-        width: int
-    """
-    if depth >= 0:
-        depth -= 1
-        for _ in range(width):
-            directory = Directory(None)
-            tree.create_node("{0}".format(directory.name), "{0}".format(xxhash.xxh64(directory.name)),
-                             parent=base.identifier, data=directory)
-        dirs_nodes = tree.children(base.identifier)
-        for dir_node in dirs_nodes:
-            newbase = tree.get_node(dir_node.identifier)
-            build_recursive_tree(tree, newbase, depth, width)
-    else:
-        return
+        rand_dir = self.get_random_dir()
+        if not rand_dir:
+            return "/nodir/nofiles"
+        num_files = len(rand_dir.data.files)
+        if num_files == 0:
+            return "/{0}/nofiles".format(rand_dir.tag)
+        if num_files == 1:
+            max_files = 1
+        else:
+            max_files = random.randint(1, num_files)
+            if max_files > 10:
+                max_files = 10
+        files = rand_dir.data.get_random_files(max_files)
+        filepaths = ""
+        for f in files:
+            if f.ondisk:
+                filepaths += "/{0}/{1},".format(rand_dir.tag, f.name)
+        if not filepaths:
+            filepaths = "/{0}/nofiles".format(rand_dir.tag)
+        return filepaths
 
 
 class Directory(object):
-    def __init__(self, file_names_generator):
-        self._lock = threading.RLock()
+    def __init__(self, file_names_generator, name=None):
+        self._lock = threading.Lock()  # Per directory, files of different directories are updated in parallel
         self.file_names_generator = file_names_generator
-        self._name = StringUtils.get_random_string_nospec(64)
+        self._name = name or StringUtils.get_random_string_nospec(64)
         self.ondisk = False
         self.checksum = 0
         self.creation_time = None
         self.size = 0
         self.files = []
-        self.files_dict = {}
+        self.files_dict = IndexedDict()
 
     @property
     def name(self):
         return self._name
 
     def touch(self):
+        return self.new_file()[1].name
+
+    def new_file(self):
+        """A file with the next name of the name stream which isn't in the directory yet. A tree resumed from a
+        snapshot replays the names from the start, the restored files must not be replaced.
+
+        Returns:
+            tuple (file_id, File)
+        """
+        with self._lock:
+            # As many names as there are files in the directory may already be taken in a row
+            for _ in range(len(self.files_dict) + 1):
+                new_file = File(self.file_names_generator)
+                new_file_id = file_id(new_file.name)
+                if new_file_id not in self.files_dict:
+                    break
+            self.files_dict[new_file_id] = new_file
+            return new_file_id, new_file
+
+    def add_file(self, new_file):
         with self._lock:
-            new_file = File(self.file_names_generator)
-            self.files_dict[xxhash.xxh64(new_file.name).hexdigest()] = new_file
-            return new_file.name
+            self.files_dict[file_id(new_file.name)] = new_file
+
+    def add_files(self, new_files):
+        with self._lock:
+            for new_file in new_files:
+                self.files_dict[file_id(new_file.name)] = new_file
+
+    def list_files(self):
+        with self._lock:
+            return list(self.files_dict.values())
 
     def get_file_by_name(self, name):
+        return self.get_file(file_id(name))
+
+    def get_file(self, key):
+        with self._lock:
+            return self.files_dict.get(key)
+
+    def get_random_file(self):
         with self._lock:
             try:
-                return self.files_dict[xxhash.xxh64(name).hexdigest()]
-            except KeyError:
+                return self.files_dict.random_value()
+            except IndexError:
                 return None
 
-    def get_random_file(self):
+    def get_random_file_item(self):
+        """
+        Returns:
+            tuple (file_id, File), None when the directory has no files
+        """
         with self._lock:
             try:
-                return random.choice(list(self.files_dict.values()))
+                return self.files_dict.random_item()
             except IndexError:
                 return None
 
     def get_random_files(self, f_number=10):
         with self._lock:
             try:
-                return random.sample(list(self.files_dict.values()), f_number)
+                return self.files_dict.sample_values(f_number)
             except (IndexError, ValueError):
                 return None
 
     def delete_file_by_name(self, name):
         with self._lock:
-            del self.files_dict[xxhash.xxh64(name).hexdigest()]
+            del self.files_dict[file_id(name)]
 
     def rename_file(self, source_name, dest_name):
+        return self.rename_file_id(file_id(source_name), dest_name)
+
+    def rename_file_id(self, source_id, dest_name):
         with self._lock:
             new_file = File(name=dest_name)
-            self.files_dict[xxhash.xxh64(new_file.name).hexdigest()] = new_file
-            self.files_dict[xxhash.xxh64(source_name).hexdigest()].ondisk = False
+            dest_id = file_id(dest_name)
+            replaced = self.files_dict.get(dest_id)
+            if replaced is not None:
+                # Deletes and renames in flight were issued for the file it replaces, their results land on this one
+                new_file.removals_issued = replaced.removals_issued
+                new_file.removals_done = replaced.removals_done
+            self.files_dict[dest_id] = new_file
+            self.files_dict[source_id].ondisk = False
             return new_file
 
     def delete_random_file(self):
         with self._lock:
-            del self.files_dict[random.choice(list(self.files_dict.keys()))]
+            del self.files_dict[self.files_dict.random_key()]
 
     def delete_random_files(self, f_number):
         with self._lock:
-            for f in random.sample(list(self.files_dict.keys()), f_number):
+            for f in self.files_dict.sample_keys(f_number):
                 del self.files_dict[f]
 
 
 class File(object):
+    """Expected state of a single file. There are tens of millions of these on long runs, so no per instance
+    __dict__, and times, hash and uuid are plain ints.
+    """
+    __slots__ = ('_name', 'data_pattern', 'data_pattern_len', 'data_pattern_hash', 'data_pattern_offset', 'uuid',
+                 'tid', 'creation_time', 'modify_time', 'ondisk', 'size', 'removals_issued', 'removals_done')
+
     def __init__(self, file_name_generator=None, name=None):
         # self._name = StringUtils.get_random_string_nospec(64)
         self._name = next(file_name_generator) if file_name_generator else name
         self.data_pattern = 0
         self.data_pattern_len = 0
-        self.data_pattern_hash = 'ef46db3751d8e999'  # zero xxhash hash
+        self.data_pattern_hash = EMPTY_HASH
         self.data_pattern_offset = 0
-        self.uuid = uuid.uuid4().hex[-5:]  # Unique session ID, will be modified on each file modify action
+        self.uuid = new_file_uuid()  # Unique session ID, will be modified on each file modify action
         self.tid = 0  # incremental transaction id for each file
-        self.last_actions = []
-        self.creation_time = None
-        self.modify_time = datetime.datetime.now()
+        self.creation_time = 0  # Nanoseconds since the epoch, same as client timestamps
+        self.modify_time = time.time_ns()
         self.ondisk = False
         self.size = 0
+        # Deletes and renames of the file dispatched and applied. Jobs which raced with one in flight may fail with
+        # ENOENT. Each counter has a single writer, jobs are dispatched on one thread and results applied on another
+        self.removals_issued = 0
+        self.removals_done = 0
+
+    def removal_in_flight(self):
+        return self.removals_issued > self.removals_done
 
     @property
     def name(self):
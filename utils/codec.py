@@ -0,0 +1,86 @@
+"""
+Wire codecs for controller <-> client (dynamo) messages.
+
+The client offers the codecs it can speak in its 'connect' message (always sent as JSON), the controller picks the
+first one it supports and encodes every job frame for that client with it. Frames are self describing, so the client
+replies with whatever codec the controller used.
+"""
+import json
+import time
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__author__ = 'samuels'
+
+MSGPACK_TAG = b'\x01'  # JSON frames always start with '{' or '[' so a single tag byte is enough
+
+
+class JsonCodec:
+    name = 'json'
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message).encode('utf8')
+
+    @staticmethod
+    def decode(frame):
+        return json.loads(frame.decode('utf8'))
+
+    @staticmethod
+    def timestamp():
+        return datetime.utcnow().strftime('%Y/%m/%d %H:%M:%S.%f')
+
+
+class MsgpackCodec:
+    """Binary codec, timestamps are integer nanoseconds since the epoch instead of formatted strings"""
+    name = 'msgpack'
+
+    @staticmethod
+    def encode(message):
+        return MSGPACK_TAG + msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def decode(frame):
+        return msgpack.unpackb(memoryview(frame)[1:], raw=False)
+
+    @staticmethod
+    def timestamp():
+        return time.time_ns()
+
+
+CODECS = {JsonCodec.name: JsonCodec}
+if msgpack:
+    CODECS[MsgpackCodec.name] = MsgpackCodec
+
+DEFAULT_CODEC = JsonCodec
+
+
+def available_codecs():
+    """Codec names in order of preference, fastest first"""
+    return sorted(CODECS, key=lambda name: name == JsonCodec.name)
+
+
+def get_codec(name):
+    return CODECS[name]
+
+
+def negotiate(offered):
+    """Pick the first of the offered codec names we support, fall back to JSON for clients which offer nothing"""
+    for name in offered or ():
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
+
+
+def detect(frame):
+    if frame[:1] == MSGPACK_TAG:
+        return MsgpackCodec
+    return JsonCodec
+
+
+def decode(frame):
+    return detect(frame).decode(frame)
@@ -0,0 +1,106 @@
+"""
+Memory-mapped file name corpus, e.g. the hash collision names string_generator.py stores in filenames.dat
+2016 samuels (c)
+"""
+import itertools
+import mmap
+import operator
+import os
+from array import array
+
+__author__ = 'samuels'
+
+OFFSETS_SUFFIX = '.offsets'
+OFFSETS_CHUNK = 1 << 24  # Bytes of the corpus split into lines at once while building the index
+
+
+class NameCorpus(object):
+    """Read-only corpus of names, one per line, which isn't loaded into memory.
+
+    The corpus file is mapped, and names are sliced out of the mapping on demand through an index of the offsets
+    of the lines. The index is built once and saved next to the corpus as <corpus>.offsets, later runs map it too,
+    so opening a corpus of millions of names costs next to nothing. Both mappings are read-only and backed by the
+    page cache, so controller shards share the same physical pages. A pickled corpus carries its path only, and
+    is mapped again when it's unpickled.
+
+    Blank lines are skipped.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: str
+        """
+        self.path = path
+        self._names = self._map(path)
+        self._offsets = self._load_offsets()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        start = self._offsets[i]
+        end = self._names.find(b'\n', start)
+        if end < 0:
+            end = len(self._names)
+        return self._names[start:end].rstrip(b'\r').decode()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def names(self, start=0):
+        """Endless iterator over the names, from the start-th one on, wraps around at the end of the corpus"""
+        names, offsets = self._names, self._offsets
+        find = names.find
+        while True:
+            for offset in offsets[start % len(offsets):]:
+                end = find(b'\n', offset)
+                yield names[offset:end if end >= 0 else len(names)].rstrip(b'\r').decode()
+            start = 0
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load_offsets(self):
+        offsets_path = self.path + OFFSETS_SUFFIX
+        try:
+            if os.stat(offsets_path).st_mtime_ns >= os.stat(self.path).st_mtime_ns:
+                offsets = self._map(offsets_path)
+                if offsets and len(offsets) % 8 == 0:
+                    return memoryview(offsets).cast('Q')
+        except OSError:
+            pass
+        offsets = self.build_offsets(self._names)
+        try:
+            with open(offsets_path + '.tmp', 'wb') as f:
+                offsets.tofile(f)
+            os.replace(offsets_path + '.tmp', offsets_path)
+        except OSError:
+            pass  # Read-only corpus directory, the index is rebuilt on every run
+        return offsets
+
+    @staticmethod
+    def build_offsets(names):
+        """Offsets of the first character of each non blank line. Lines are split and measured in C a chunk at a
+        time, not looked for one by one.
+        """
+        offsets = array('Q')
+        size = len(names)
+        start = 0
+        while start < size:
+            end = names.rfind(b'\n', start, start + OFFSETS_CHUNK) + 1
+            if not end or start + OFFSETS_CHUNK >= size:
+                end = size
+            lines = names[start:end].split(b'\n')
+            starts = itertools.accumulate(map(operator.add, map(len, lines[:-1]), itertools.repeat(1)),
+                                          initial=start)
+            offsets.extend(itertools.compress(starts, map(bytes.strip, lines)))
+            start = end
+        return offsets
@@ -12,6 +12,64 @@ GLOBAL_SSH_PATH = os.environ.get("QA_GLOBAL_SSH_PATH", "/zebra/qa/qa-util-script
 SSH_PATH = os.environ.get("SSH_PATH", "ssh")
 
 
+NAME_CHARS = digits + ascii_letters
+NAME_CHUNK = 1024
+# Random bytes map onto NAME_CHARS 4 times over, the 8 bytes left over are dropped so every character is as likely
+_NAME_TABLE = bytes.maketrans(bytes(range(4 * len(NAME_CHARS))), (4 * NAME_CHARS).encode())
+_NAME_DROP = bytes(range(4 * len(NAME_CHARS), 256))
+
+
+class NameGenerator(object):
+    """Iterator over random [0-9a-zA-Z] names, min_length to max_length characters long.
+
+    Names are made NAME_CHUNK at a time out of a single randbytes() call, translated to characters in C, instead
+    of a random.choice() call per character. The generator has its own random generator seeded from the global one
+    when it's built, so with --seed the names it produces are the same from run to run. Safe to share between
+    threads, a list pop is atomic.
+    """
+
+    def __init__(self, min_length, max_length=None, chunk=NAME_CHUNK):
+        """
+        Args:
+            min_length: int
+            max_length: int, None for names of min_length only
+            chunk: int
+        """
+        self.min_length = min_length
+        self.max_length = max_length or min_length
+        self.chunk = chunk
+        self._random = random.Random(random.getrandbits(64))
+        self._names = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self._names.pop()
+        except IndexError:
+            self._names = self.generate(self.chunk)
+            return self._names.pop()
+
+    def generate(self, k):
+        if self.min_length == self.max_length:
+            lengths = [self.min_length] * k
+        else:
+            lengths = self._random.choices(range(self.min_length, self.max_length + 1), k=k)
+        total = sum(lengths)
+        chars = b''
+        while len(chars) < total:
+            # A bit more than needed, as about 3% of the bytes are dropped
+            chars += self._random.randbytes(total + total // 16 + 64).translate(_NAME_TABLE, _NAME_DROP)
+        chars = chars.decode()
+        names = []
+        start = 0
+        for length in lengths:
+            names.append(chars[start:start + length])
+            start += length
+        return names
+
+
 class StringUtils:
     def __init__(self):
         pass
@@ -22,12 +80,11 @@ class StringUtils:
 
     @staticmethod
     def get_random_string_nospec(length):
-        return ''.join(random.choice(digits + ascii_letters) for _ in range(length))
+        return ''.join(random.choices(NAME_CHARS, k=length))
 
     @staticmethod
     def random_string_generator():
-        while 1:
-            yield ''.join(random.choice(digits + ascii_letters) for _ in range(random.randint(16, 64)))
+        return NameGenerator(16, 64)
 
     @staticmethod
     def string_from_file_generator(file_names):